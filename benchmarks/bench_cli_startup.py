@@ -0,0 +1,48 @@
+"""
+Measures how long starting the program takes before the conversion can begin: importing the gui (main.py) compared to
+importing what the command line version (cli.py) needs for the conversion. Every start is a new Python process so
+nothing is cached in memory between the starts.
+
+Usage: python benchmarks/bench_cli_startup.py --repeat 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("gui", "import main"),
+    ("cli", "import cli, main_functions"),
+]
+HEAVY_MODULES = ["PyQt5", "comtypes"]
+
+
+def start(code):
+    check = f"{code}; import sys; print(','.join(x for x in {HEAVY_MODULES!r} if x in sys.modules))"
+    begin = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", check], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return time.perf_counter() - begin, result.stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="Number of starts measured in each case")
+    args = parser.parse_args()
+    baseline = None
+    print(f"{'start':>6} {'best ms':>10} {'mean ms':>10} {'speed-up':>10}  imported")
+    for name, code in CASES:
+        times = []
+        for _ in range(args.repeat):
+            elapsed, imported = start(code)
+            times.append(elapsed)
+        best = min(times)
+        baseline = baseline or best
+        print(f"{name:>6} {best * 1000:>10.1f} {sum(times) / len(times) * 1000:>10.1f} {baseline / best:>10.2f}  "
+              f"{imported or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Measures throughput of compilations running at the same time in one process. Every job compiles its own set of
+generated files with a table of contents in its own workspace. *.rtf jobs share one pool of warm backend instances,
+so the jobs keep all instances busy. *.txt jobs render their pages in "Render workers" processes, so they run in
+parallel when there are free processor cores.
+
+Usage: python benchmarks/bench_concurrent_jobs.py --type rtf --engine libre-office --instances 4 --concurrency 1 2 4
+       python benchmarks/bench_concurrent_jobs.py --type txt --render-workers 2 --concurrency 1 2 4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# Settings and the font are read from the program folder
+os.chdir(REPO_DIR)
+
+from converter_pool import ConverterPool
+from helper_functions import settings
+from main_functions import Converter, run_converters
+from synthetic import create_listing_corpus, create_rtf_corpus
+
+
+def create_corpora(directory, filetype, jobs, files):
+    corpora = []
+    for i in range(jobs):
+        folder = os.path.join(directory, f"input_{i}")
+        os.makedirs(folder)
+        if filetype == "txt":
+            corpora.append(create_listing_corpus(folder, files))
+        else:
+            corpora.append(create_rtf_corpus(folder, files))
+    return corpora
+
+
+def make_converters(corpora, filetype, output_dir, pool=None):
+    converters = []
+    for i, files in enumerate(corpora):
+        converter = Converter()
+        converter.set_files(files)
+        converter.set_filetype(filetype)
+        converter.set_filename(os.path.join(output_dir, f"job_{i}.pdf"))
+        if pool is not None:
+            converter.set_engine(pool.engine)
+            converter.set_converter_pool(pool)
+        converters.append(converter)
+    return converters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--type", choices=["txt", "rtf"], default="txt", help="Type of the generated files")
+    parser.add_argument("--jobs", type=int, default=8, help="Number of compilations")
+    parser.add_argument("--files", type=int, default=20, help="Files in every compilation")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4], help="Concurrent jobs to measure")
+    parser.add_argument("--render-workers", type=int, default=2, help="Render worker processes of every *.txt job")
+    parser.add_argument("--engine", default="libre-office", help="word or libre-office for *.rtf jobs")
+    parser.add_argument("--instances", type=int, default=4, help="Backend instances shared by the *.rtf jobs")
+    args = parser.parse_args()
+    if not os.path.exists("CourierNewRegular.ttf"):
+        sys.exit("CourierNewRegular.ttf not found from the program folder")
+    settings["Auto accept TOC"] = True
+    settings["Parser workers"] = 1
+    settings["Render workers"] = args.render_workers
+    # Every job has to convert its files
+    settings["Conversion cache"] = False
+
+    directory = tempfile.mkdtemp(prefix="jobs_bench_")
+    pool = None
+    try:
+        corpora = create_corpora(directory, args.type, args.jobs, args.files)
+        if args.type == "rtf":
+            pool = ConverterPool(args.engine, instances=args.instances)
+            # Backend start-up is not measured
+            list(pool.imap(corpora[0][:args.instances], "pdf", output_dir=directory))
+        baseline = None
+        print(f"{'concurrent':>10} {'seconds':>10} {'jobs/min':>10} {'speed-up':>10}")
+        for concurrency in args.concurrency:
+            converters = make_converters(corpora, args.type, directory, pool)
+            start = time.perf_counter()
+            errors = [x for x in run_converters(converters, concurrency) if x is not None]
+            elapsed = time.perf_counter() - start
+            if errors:
+                raise errors[0]
+            baseline = baseline or elapsed
+            print(f"{concurrency:>10} {elapsed:>10.2f} {args.jobs / elapsed * 60:>10.1f} {baseline / elapsed:>10.2f}")
+    finally:
+        if pool is not None:
+            pool.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
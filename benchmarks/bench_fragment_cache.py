@@ -0,0 +1,70 @@
+"""
+Measures how long compiling packages of generated SAS listing files takes with the fragment cache: without the cache,
+with an empty cache, with every file in the cache and after one file has been edited. Also shows the size of the
+cache.
+
+Usage: python benchmarks/bench_fragment_cache.py --files 100 1000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# Settings and the font are read from the program folder
+os.chdir(REPO_DIR)
+
+from fragment_cache import FragmentCache
+from helper_functions import settings
+from main_functions import Converter
+from synthetic import create_listing_corpus, make_listing
+
+
+def timed_compile(files, output, cache):
+    settings["Fragment cache"] = cache
+    converter = Converter()
+    converter.set_files(files)
+    converter.set_filetype("txt")
+    converter.set_filename(output)
+    start = time.perf_counter()
+    converter.convert()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[100, 1000], help="Package sizes to measure")
+    args = parser.parse_args()
+    if not os.path.exists("CourierNewRegular.ttf"):
+        sys.exit("CourierNewRegular.ttf not found from the program folder")
+    settings["Auto accept TOC"] = True
+    settings["Section manifest"] = False
+
+    directory = tempfile.mkdtemp(prefix="fragment_bench_")
+    try:
+        print(f"{'files':>8} {'no cache (s)':>13} {'empty (s)':>10} {'full (s)':>9} {'one edit (s)':>13} "
+              f"{'speed-up':>9} {'cache (MB)':>11}")
+        for num_files in args.files:
+            folder = os.path.join(directory, f"input_{num_files}")
+            os.makedirs(folder)
+            files = create_listing_corpus(folder, num_files)
+            output = os.path.join(directory, "compiled.pdf")
+            settings["Fragment cache directory"] = os.path.join(directory, f"cache_{num_files}")
+            uncached = timed_compile(files, output, False)
+            empty = timed_compile(files, output, True)
+            full = timed_compile(files, output, True)
+            with open(files[len(files) // 2], "w") as file:
+                file.write(make_listing(num_files, pages=4))
+            edited = timed_compile(files, output, True)
+            size = FragmentCache.from_settings(settings).size()
+            print(f"{num_files:>8} {uncached:>13.2f} {empty:>10.2f} {full:>9.2f} {edited:>13.2f} "
+                  f"{uncached / edited:>9.2f} {size / 1024 / 1024:>11.1f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measures what instrumentation costs: compilation time of packages of generated SAS listing files with instrumentation
+disabled and enabled, and the time of one stage measured with instrumentation disabled.
+
+Usage: python benchmarks/bench_instrumentation.py --files 100 1000 --repeats 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# Settings and the font are read from the program folder
+os.chdir(REPO_DIR)
+
+import instrumentation
+from helper_functions import settings
+from main_functions import Converter
+from synthetic import create_listing_corpus
+
+
+def timed_compile(files, output, enabled):
+    settings["Instrumentation"] = enabled
+    converter = Converter()
+    converter.set_files(files)
+    converter.set_filetype("txt")
+    converter.set_filename(output)
+    start = time.perf_counter()
+    converter.convert()
+    return time.perf_counter() - start
+
+
+def disabled_stage():
+    with instrumentation.stage("render", "file.txt") as measurement:
+        measurement.pages += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[100, 1000], help="Package sizes to measure")
+    parser.add_argument("--repeats", type=int, default=3, help="Compilations measured, the fastest time is shown")
+    args = parser.parse_args()
+    if not os.path.exists("CourierNewRegular.ttf"):
+        sys.exit("CourierNewRegular.ttf not found from the program folder")
+    settings["Auto accept TOC"] = True
+    settings["Section manifest"] = False
+
+    calls = 1000000
+    seconds = timeit.timeit(disabled_stage, number=calls)
+    print(f"Disabled stage: {seconds / calls * 1e9:.0f} ns per stage")
+
+    directory = tempfile.mkdtemp(prefix="instrumentation_bench_")
+    try:
+        #  Without the fragment cache every compilation renders the pages, with it the pages are rendered only once
+        for cache in (False, True):
+            settings["Fragment cache"] = cache
+            settings["Fragment cache directory"] = os.path.join(directory, "cache")
+            print(f"\nFragment cache {'on' if cache else 'off'}")
+            print(f"{'files':>8} {'disabled (s)':>13} {'enabled (s)':>12} {'overhead':>9}")
+            for num_files in args.files:
+                folder = os.path.join(directory, f"input_{num_files}_{cache}")
+                os.makedirs(folder)
+                files = create_listing_corpus(folder, num_files)
+                output = os.path.join(directory, "compiled.pdf")
+                disabled = min(timed_compile(files, output, False) for _ in range(args.repeats))
+                enabled = min(timed_compile(files, output, True) for _ in range(args.repeats))
+                print(f"{num_files:>8} {disabled:>13.2f} {enabled:>12.2f} {(enabled / disabled - 1) * 100:>8.1f}%")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
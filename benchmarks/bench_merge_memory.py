@@ -0,0 +1,101 @@
+"""
+Measures peak memory and peak number of open files when merging a generated corpus of converted PDF tables into one
+document. Memory and open files should stay flat when the number of files grows. Every generated file embeds the
+same logo, so the output size also shows how much sharing identical resources saves.
+
+Usage: python benchmarks/bench_merge_memory.py --files 500 1000 5000 --baseline --no-dedup
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyPDF2.pdf import PdfFileReader
+from pdf_assembly import StreamingPdfWriter
+from synthetic import create_pdf_corpus
+
+
+def open_files():
+    """
+    Returns number of open file descriptors of the process or None if it is not available on the platform
+    """
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def merge_streaming(files, output_file, deduplicate=True):
+    peak_files = 0
+    with StreamingPdfWriter(output_file, deduplicate=deduplicate) as writer:
+        for file in files:
+            with open(file, 'rb') as stream:
+                writer.add_document(PdfFileReader(stream))
+                peak_files = max(peak_files, open_files() or 0)
+    return peak_files
+
+
+def merge_baseline(files, output_file):
+    from PyPDF2 import PdfFileMerger
+    peak_files = 0
+    merger = PdfFileMerger()
+    for file in files:
+        merger.append(file)
+        peak_files = max(peak_files, open_files() or 0)
+    merger.write(output_file)
+    merger.close()
+    return peak_files
+
+
+def run(merge, files, output_file):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        peak_files = merge(files, output_file)
+    except OSError as error:
+        #  Too many open files
+        tracemalloc.stop()
+        return None, None, str(error)
+    elapsed = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak_memory, peak_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[500, 1000, 5000], help="Corpus sizes to measure")
+    parser.add_argument("--pages", type=int, default=2, help="Pages in each generated file")
+    parser.add_argument("--baseline", action="store_true", help="Measure PdfFileMerger as well")
+    parser.add_argument("--no-dedup", action="store_true", help="Measure streaming without sharing resources as well")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="merge_bench_")
+    try:
+        corpus = create_pdf_corpus(directory, max(args.files), args.pages)
+        output_file = os.path.join(directory, "merged.pdf")
+        merges = [("streaming", merge_streaming)]
+        if args.no_dedup:
+            merges.append(("no sharing", lambda files, output: merge_streaming(files, output, deduplicate=False)))
+        if args.baseline:
+            merges.append(("PdfFileMerger", merge_baseline))
+        print(f"{'merge':>14} {'files':>8} {'seconds':>10} {'peak MB':>10} {'open files':>11} {'output MB':>10}")
+        for name, merge in merges:
+            for num_files in args.files:
+                elapsed, peak_memory, peak_files = run(merge, corpus[:num_files], output_file)
+                if elapsed is None:
+                    print(f"{name:>14} {num_files:>8} failed: {peak_files}")
+                    continue
+                print(f"{name:>14} {num_files:>8} {elapsed:>10.2f} {peak_memory / 1024 / 1024:>10.1f} "
+                      f"{peak_files:>11} {os.path.getsize(output_file) / 1024 / 1024:>10.1f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
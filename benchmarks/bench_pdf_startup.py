@@ -0,0 +1,77 @@
+"""
+Measures how long creating a PDF object takes. PDF() loads the CourierNewRegular.ttf font from the program folder:
+parsing the font file, loading the parsed metrics from the cache next to the font and reusing metrics already loaded
+in the same process are measured separately.
+
+Usage: python benchmarks/bench_pdf_startup.py --repeat 20
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# Settings and the font are read from the program folder
+os.chdir(REPO_DIR)
+
+import font_cache
+from fpdf import FPDF
+from pdf_template import PDF
+
+FONT_FILE = "CourierNewRegular.ttf"
+
+
+def measure(create, repeat, before=None):
+    times = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        create()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, sum(times) / len(times) * 1000
+
+
+def parse_without_cache():
+    pdf = FPDF()
+    pdf.add_font('Courier New', '', FONT_FILE, uni=True)
+
+
+def forget_loaded():
+    font_cache._loaded.clear()
+
+
+def forget_everything():
+    forget_loaded()
+    try:
+        os.remove(font_cache.metrics_path(FONT_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="Number of PDF objects created in each case")
+    args = parser.parse_args()
+    if not os.path.exists(FONT_FILE):
+        sys.exit(f"{FONT_FILE} not found from the program folder")
+    # FPDF's own pickle would hide the parsing time
+    fpdf_pickle = os.path.splitext(FONT_FILE)[0] + ".pkl"
+
+    def forget_fpdf_pickle():
+        if os.path.exists(fpdf_pickle):
+            os.remove(fpdf_pickle)
+
+    cases = [("FPDF.add_font, no cache", lambda: measure(parse_without_cache, args.repeat, before=forget_fpdf_pickle)),
+             ("PDF(), cold cache", lambda: measure(PDF, args.repeat, before=forget_everything)),
+             ("PDF(), cache file", lambda: measure(PDF, args.repeat, before=forget_loaded)),
+             ("PDF(), in memory", lambda: measure(PDF, args.repeat))]
+    print(f"{'case':>26} {'min ms':>10} {'mean ms':>10}")
+    for name, run in cases:
+        best, mean = run()
+        print(f"{name:>26} {best:>10.2f} {mean:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
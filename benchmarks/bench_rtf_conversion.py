@@ -0,0 +1,53 @@
+"""
+Measures RTF to PDF conversion throughput of ConverterPool with 1 to N parallel backend instances on a generated
+corpus of RTF tables.
+
+Usage: python benchmarks/bench_rtf_conversion.py --files 64 --workers 1 2 4 8 16 --engine libre-office
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter_pool import ConverterPool
+from synthetic import create_rtf_corpus
+
+
+def run(files, engine, workers):
+    with ConverterPool(engine, instances=workers) as pool:
+        # Warm up the instances so that the measurement does not include backend start-up
+        list(pool.imap(files[:workers], "pdf"))
+        start = time.perf_counter()
+        converted = list(pool.imap(files, "pdf"))
+        elapsed = time.perf_counter() - start
+    for file in converted:
+        os.remove(file)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=64, help="Number of generated RTF files")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Worker counts to measure")
+    parser.add_argument("--engine", default="libre-office", help="word or libre-office")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="rtf_bench_")
+    try:
+        files = create_rtf_corpus(directory, args.files)
+        baseline = None
+        print(f"{'workers':>8} {'seconds':>10} {'files/s':>10} {'speed-up':>10}")
+        for workers in args.workers:
+            elapsed = run(files, args.engine, workers)
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {elapsed:>10.2f} {len(files) / elapsed:>10.2f} {baseline / elapsed:>10.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures how long adding, replacing and removing one section of a compiled document takes with section_update.py,
+for packages of generated SAS listing files of different sizes, and compares it with compiling the whole package
+again. Also shows how much every update grows the file.
+
+Usage: python benchmarks/bench_section_update.py --files 100 1000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# Settings and the font are read from the program folder
+os.chdir(REPO_DIR)
+
+from helper_functions import settings
+from main_functions import Converter
+from section_update import update_sections
+from synthetic import create_listing_corpus, make_listing
+
+
+def full_compile(files, output):
+    converter = Converter()
+    converter.set_files(files)
+    converter.set_filetype("txt")
+    converter.set_filename(output)
+    start = time.perf_counter()
+    converter.convert()
+    return time.perf_counter() - start
+
+
+def timed_update(document, **changes):
+    size = os.path.getsize(document)
+    start = time.perf_counter()
+    update_sections(document, **changes)
+    return time.perf_counter() - start, os.path.getsize(document) - size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[100, 1000], help="Package sizes to measure")
+    args = parser.parse_args()
+    if not os.path.exists("CourierNewRegular.ttf"):
+        sys.exit("CourierNewRegular.ttf not found from the program folder")
+    settings["Auto accept TOC"] = True
+    settings["Section manifest"] = True
+
+    directory = tempfile.mkdtemp(prefix="section_bench_")
+    try:
+        print(f"{'files':>8} {'operation':>10} {'seconds':>10} {'full (s)':>10} {'speed-up':>10} {'growth (kB)':>12}")
+        for num_files in args.files:
+            folder = os.path.join(directory, f"input_{num_files}")
+            os.makedirs(folder)
+            files = create_listing_corpus(folder, num_files)
+            document = os.path.join(directory, f"compiled_{num_files}.pdf")
+            full = full_compile(files, document)
+            late = os.path.join(folder, f"l_{num_files // 2:05d}_late.txt")
+            with open(late, "w") as file:
+                file.write(make_listing(num_files))
+            with open(files[1], "w") as file:
+                file.write(make_listing(num_files + 1, pages=4))
+            for operation, changes in (("add", {"add": [late]}), ("replace", {"refresh": True}),
+                                       ("remove", {"remove": [files[2]]})):
+                elapsed, growth = timed_update(document, **changes)
+                print(f"{num_files:>8} {operation:>10} {elapsed:>10.2f} {full:>10.2f} {full / elapsed:>10.2f} "
+                      f"{growth / 1024:>12.1f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
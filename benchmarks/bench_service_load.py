@@ -0,0 +1,100 @@
+"""
+Load test of the compilation service. Client threads submit jobs at the same time, each job compiling its own set of
+generated SAS listing files, and wait for them to finish. Jobs per minute are measured for every number of concurrent
+clients. The service is started in this process unless the port of a running service is given. With --baseline one
+cli.py process per job is measured too, which is what running the program once per deliverable costs.
+
+Usage: python benchmarks/bench_service_load.py --jobs 16 --files 10 --clients 1 4 8 --service-jobs 2 --baseline
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from service import JobQueue, create_server, load_settings, request, wait_for_job
+from synthetic import create_listing_corpus
+
+
+def create_corpora(directory, jobs, files):
+    corpora = []
+    for i in range(jobs):
+        folder = os.path.join(directory, f"input_{i}")
+        os.makedirs(folder)
+        create_listing_corpus(folder, files)
+        corpora.append(folder)
+    return corpora
+
+
+def run_job(url, folder, output):
+    status, job = request(f"{url}/jobs", "POST", {"files": [os.path.join(folder, "*.txt")], "output": output})
+    if status != 202:
+        raise RuntimeError(job["error"])
+    job = wait_for_job(url, job["id"], interval=0.05)
+    if job["state"] != "done":
+        raise RuntimeError(job["error"])
+
+
+def run_cli(folder, output):
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, "cli.py"), os.path.join(folder, "*.txt"), "-o", output,
+                    "-q"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def measure(corpora, directory, clients, run):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        futures = [executor.submit(run, folder, os.path.join(directory, f"job_{i}.pdf"))
+                   for i, folder in enumerate(corpora)]
+        for future in futures:
+            future.result()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=16, help="Jobs submitted in every measurement")
+    parser.add_argument("--files", type=int, default=10, help="Listing files in every job")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 8], help="Concurrent clients to measure")
+    parser.add_argument("--service-jobs", type=int, default=2, help="Jobs the started service runs at the same time")
+    parser.add_argument("--port", type=int, help="Port of a running service. By default a service is started")
+    parser.add_argument("--baseline", action="store_true", help="Measure one cli.py process per job too")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="service_bench_")
+    server = job_queue = None
+    try:
+        corpora = create_corpora(directory, args.jobs, args.files)
+        if args.port is None:
+            job_queue = JobQueue(load_settings(), args.service_jobs)
+            server = create_server(job_queue, port=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            port = server.server_address[1]
+        else:
+            port = args.port
+        url = f"http://127.0.0.1:{port}"
+        # The first job loads the font and the modules, like a service that has been running for a while
+        run_job(url, corpora[0], os.path.join(directory, "warm_up.pdf"))
+        cases = [("service", clients, lambda folder, output: run_job(url, folder, output)) for clients in args.clients]
+        if args.baseline:
+            cases += [("cli", clients, run_cli) for clients in args.clients]
+        print(f"{'mode':>8} {'clients':>8} {'seconds':>10} {'jobs/min':>10}")
+        for mode, clients, run in cases:
+            elapsed = measure(corpora, directory, clients, run)
+            print(f"{mode:>8} {clients:>8} {elapsed:>10.2f} {args.jobs / elapsed * 60:>10.1f}")
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            job_queue.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Measures how many pages per second are rendered from synthetic SAS listing files when the page texts are written as
+one block of text ("Fast text body") and when they are written with multi_cell.
+
+Usage: python benchmarks/bench_text_body.py --files 200 --repeat 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# Settings and the font are read from the program folder
+os.chdir(REPO_DIR)
+
+from helper_functions import parse_document
+from pdf_template import PARAMETERS, PDF
+from synthetic import create_listing_corpus
+
+
+def render(documents, fast):
+    PARAMETERS["Fast text body"] = fast
+    pdf = PDF()
+    pdf.set_title("")
+    start = time.perf_counter()
+    for document in documents:
+        pdf.print_document(document)
+    elapsed = time.perf_counter() - start
+    return elapsed, pdf.page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help="Number of generated listing files")
+    parser.add_argument("--repeat", type=int, default=3, help="Times each case is rendered, the best time is shown")
+    args = parser.parse_args()
+    if not os.path.exists("CourierNewRegular.ttf"):
+        sys.exit("CourierNewRegular.ttf not found from the program folder")
+
+    directory = tempfile.mkdtemp(prefix="body_bench_")
+    try:
+        documents = [parse_document(x) for x in create_listing_corpus(directory, args.files)]
+        baseline = None
+        print(f"{'body':>12} {'pages':>8} {'seconds':>10} {'pages/s':>10} {'speed-up':>10}")
+        for name, fast in (("multi_cell", False), ("fast", True)):
+            elapsed, pages = min(render(documents, fast) for _ in range(args.repeat))
+            baseline = baseline or elapsed
+            print(f"{name:>12} {pages:>8} {elapsed:>10.2f} {pages / elapsed:>10.1f} {baseline / elapsed:>10.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Measures parsing time of synthetic SAS listing files with different numbers of parser processes. Worker count 0
+chooses the number from the size of the files, the number used is shown in the used column.
+
+Usage: python benchmarks/bench_txt_parsing.py --files 5000 --workers 1 4 16 --chunk-size 8
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# Settings are read from the program folder
+os.chdir(REPO_DIR)
+
+from helper_functions import parse_documents, parser_workers
+from synthetic import create_listing_corpus
+
+
+def run(files, workers, chunk_size):
+    start = time.perf_counter()
+    pages = sum(document.num_pages for document in parse_documents(files, workers, chunk_size))
+    return time.perf_counter() - start, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000, help="Number of generated listing files")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16], help="Worker counts to measure")
+    parser.add_argument("--chunk-size", type=int, default=8, help="Files sent to a worker at a time")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="txt_bench_")
+    try:
+        files = create_listing_corpus(directory, args.files)
+        baseline = None
+        print(f"{'workers':>8} {'used':>6} {'seconds':>10} {'files/s':>10} {'speed-up':>10}")
+        for workers in args.workers:
+            elapsed, pages = run(files, workers, args.chunk_size)
+            baseline = baseline or elapsed
+            print(f"{workers:>8} {parser_workers(files, workers):>6} {elapsed:>10.2f} {len(files) / elapsed:>10.1f} "
+                  f"{baseline / elapsed:>10.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Measures how long watch mode takes to update the compiled document after one generated SAS listing file is edited,
+for packages of different sizes, and compares it with compiling the whole package again.
+
+Usage: python benchmarks/bench_watch.py --files 20 80 320
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# Settings and the font are read from the program folder
+os.chdir(REPO_DIR)
+
+from helper_functions import settings
+from main_functions import Converter
+from synthetic import create_listing_corpus
+from watch import WatchCompiler
+
+
+def full_compile(files, output):
+    converter = Converter()
+    converter.set_files(files)
+    converter.set_filetype("txt")
+    converter.set_filename(output)
+    start = time.perf_counter()
+    converter.convert()
+    return time.perf_counter() - start
+
+
+def edit(file):
+    with open(file, "a") as stream:
+        stream.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[20, 80, 320], help="Package sizes to measure")
+    parser.add_argument("--edits", type=int, default=5, help="Single file edits measured, the median time is shown")
+    args = parser.parse_args()
+    if not os.path.exists("CourierNewRegular.ttf"):
+        sys.exit("CourierNewRegular.ttf not found from the program folder")
+    settings["Auto accept TOC"] = True
+
+    directory = tempfile.mkdtemp(prefix="watch_bench_")
+    try:
+        print(f"{'files':>8} {'full (s)':>10} {'initial (s)':>12} {'update (s)':>11} {'speed-up':>10}")
+        for num_files in args.files:
+            folder = os.path.join(directory, f"input_{num_files}")
+            os.makedirs(folder)
+            files = create_listing_corpus(folder, num_files)
+            full = full_compile(files, os.path.join(directory, "full.pdf"))
+            with WatchCompiler(folder, os.path.join(directory, "watched.pdf"), "txt") as compiler:
+                start = time.perf_counter()
+                compiler.update(files)
+                initial = time.perf_counter() - start
+                updates = []
+                for i in range(args.edits):
+                    file = files[i * len(files) // args.edits]
+                    edit(file)
+                    start = time.perf_counter()
+                    compiler.update([file])
+                    updates.append(time.perf_counter() - start)
+            update = sorted(updates)[len(updates) // 2]
+            print(f"{num_files:>8} {full:>10.2f} {initial:>12.2f} {update:>11.2f} {full / update:>10.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
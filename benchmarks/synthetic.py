@@ -0,0 +1,132 @@
+"""
+Generators for synthetic input files used by the benchmarks
+"""
+import os
+import random
+import struct
+import zlib
+from fpdf import FPDF
+
+
+def make_listing(number, pages=3, rows=40, line_symbol="_"):
+    """
+    Returns text of a SAS listing in the layout the *.txt conversion expects: study name and title, dashed lines
+    around the column headers and the data rows and the program info in the footer
+    :param number: Number of the listing used in the title and the program name
+    :param pages: Number of pages in the listing
+    :param rows: Number of data rows on each page
+    :param line_symbol: Symbol used in the dashed lines
+    :return: Text of the listing
+    """
+    generator = random.Random(number)
+    lines = []
+    for page in range(pages):
+        lines.append("Study ABC-123 Sas")
+        lines.append(f"Listing 16.2.{number} Subject data listing")
+        lines.append(line_symbol * 100)
+        lines.append("  Subject   Visit      Parameter        Value   Unit")
+        lines.append(line_symbol * 100)
+        for row in range(rows):
+            lines.append(f"  {1000 + row:<9} {'Week ' + str(row % 12):<10} {'Hemoglobin':<16} "
+                         f"{generator.uniform(100, 180):7.1f}   g/L")
+        lines.append(line_symbol * 100)
+        lines.append(f"Program: l_{number}.sas   Page {page + 1} of {pages}")
+        lines.append("\f")
+    return "\n".join(lines) + "\n"
+
+
+def create_listing_corpus(directory, num_files, pages=3, rows=40):
+    """
+    Writes num_files synthetic listings to the directory
+    :return: list of absolute paths of the files
+    """
+    files = []
+    for number in range(num_files):
+        path = os.path.join(directory, f"l_{number:05d}.txt")
+        with open(path, "w") as file:
+            file.write(make_listing(number, pages, rows))
+        files.append(path)
+    return files
+
+
+def make_rtf_table(number, rows=40, columns=6):
+    """
+    Returns a RTF document with a header, a title, a table and a footer in the layout of a study output
+    """
+    lines = [r"{\rtf1\ansi\deff0{\fonttbl{\f0 Courier New;}}\f0\fs16",
+             r"\pard\qc Study ABC-123 Sas\par",
+             rf"\pard\qc Table 14.{number}.1 Summary of Adverse Events\par"]
+    cell_borders = "".join(rf"\cellx{1500 * (column + 1)}" for column in range(columns))
+    for row in range(rows):
+        cells = "".join(rf"\intbl {row * column + number}\cell " for column in range(columns))
+        lines.append(rf"\trowd {cell_borders} {cells}\row")
+    lines.append(rf"\pard Program: t_ae_{number}.sas\par}}")
+    return "\n".join(lines)
+
+
+def create_rtf_corpus(directory, num_files):
+    """
+    Writes num_files synthetic RTF tables to the directory
+    :return: list of absolute paths of the files
+    """
+    files = []
+    for number in range(num_files):
+        path = os.path.join(directory, f"t_{number:05d}.rtf")
+        with open(path, "w") as file:
+            file.write(make_rtf_table(number))
+        files.append(path)
+    return files
+
+
+def make_logo_png(path, width=240, height=80):
+    """
+    Writes a PNG image with a colour gradient, used as the sponsor logo on every page of the synthetic PDF tables
+    """
+    #  Every row starts with filter type 0 followed by the RGB values of the pixels
+    rows = b"".join(b"\x00" + bytes(value for x in range(width) for value in (x % 256, y * 3 % 256, (x + y) % 256))
+                    for y in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        file.write(chunk(b"IDAT", zlib.compress(rows)))
+        file.write(chunk(b"IEND", b""))
+
+
+def make_pdf_table(number, pages=2, rows=40, logo=None):
+    """
+    Returns a PDF document as bytes that looks like a converted RTF table: title on the first page, table rows on
+    every page and optionally the same logo image on every page
+    """
+    pdf = FPDF(orientation="L")
+    pdf.set_font("Courier", size=8)
+    for page in range(pages):
+        pdf.add_page()
+        if logo is not None:
+            pdf.image(logo, x=10, y=8, w=30)
+        pdf.cell(0, 5, f"Table 14.{number}.1 Summary of Adverse Events", ln=1, align="C")
+        for row in range(rows):
+            pdf.cell(0, 4, "".join(f"{row * column + number:>12}" for column in range(6)), ln=1)
+    return pdf.output(dest="S").encode("latin1")
+
+
+def create_pdf_corpus(directory, num_files, pages=2, logo=True):
+    """
+    Writes num_files synthetic PDF tables to the directory. Every file embeds its own copy of the same logo like the
+    files converted by Word or LibreOffice do
+    :return: list of absolute paths of the files
+    """
+    logo_path = None
+    if logo:
+        logo_path = os.path.join(directory, "logo.png")
+        make_logo_png(logo_path)
+    files = []
+    for number in range(num_files):
+        path = os.path.join(directory, f"t_{number:05d}.pdf")
+        with open(path, "wb") as file:
+            file.write(make_pdf_table(number, pages, logo=logo_path))
+        files.append(path)
+    return files
@@ -0,0 +1,160 @@
+"""
+Command line version of the program for batch use without the gui. Qt is never imported and Word's COM interface is
+imported only when *.rtf files are converted with Word.
+
+Usage: python cli.py "listings/*.txt" -o compiled.pdf --toc-orientation L
+       python cli.py "tables/**/*.rtf" -o tables.pdf --engine libreoffice --set "Converter instances=4"
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+
+PROGRAM_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def find_files(patterns):
+    """
+    Expands the glob patterns to files. Files of every pattern are in alphabetical order and the patterns in the given
+    order, files matched by more than one pattern are included once
+    :param patterns: List of glob patterns or file paths
+    :return: List of absolute file paths
+    """
+    files = []
+    for pattern in patterns:
+        for file in sorted(glob.glob(pattern, recursive=True)):
+            file = os.path.abspath(file)
+            if os.path.isfile(file) and file not in files:
+                files.append(file)
+    return files
+
+
+def guess_filetype(files):
+    """
+    Returns "txt" or "rtf" from the extensions of the files or None if they are mixed or something else
+    """
+    extensions = {os.path.splitext(file)[1].lower().lstrip(".") for file in files}
+    if len(extensions) == 1 and extensions <= {"txt", "rtf"}:
+        return extensions.pop()
+    return None
+
+
+def parse_setting(text):
+    """
+    Parses "Key=value" from --set. The value is read as JSON when possible, so numbers and true/false get their types
+    :return: (key, value) tuple
+    """
+    key, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"Expected Key=value, got {text}")
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return key.strip(), value
+
+
+def load_settings(overrides=()):
+    """
+    Changes to the program folder, where the settings and the font are read from like when the gui is started, and
+    loads the settings
+    :param overrides: List of (key, value) tuples replacing values of settings.json
+    :return: Settings dictionary shared by all modules
+    """
+    os.chdir(PROGRAM_DIR)
+    import settings
+    parameters = settings.get_parameters()
+    for key, value in overrides:
+        if key not in parameters:
+            raise KeyError(f"Unknown setting {key}")
+        parameters[key] = value
+    #  Nobody reviews the table of contents
+    parameters["Auto accept TOC"] = True
+    return parameters
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Input files or glob patterns. Quote patterns with ** so the shell "
+                                                  "does not expand them")
+    parser.add_argument("-o", "--output", help="Path of the compiled pdf file. By default \"PDF name\" from the "
+                                               "settings in the current folder")
+    parser.add_argument("--type", choices=["txt", "rtf"], help="Type of the input files. By default from the file "
+                                                               "extensions")
+    parser.add_argument("--no-toc", action="store_true", help="Do not create the table of contents")
+    parser.add_argument("--toc-orientation", choices=["P", "L"], default="P", help="Orientation of the table of "
+                                                                                   "contents pages")
+    parser.add_argument("--toc-file", help="Table of contents in the \"chapter: page\" format used instead of the "
+                                           "proposed one")
+    parser.add_argument("--engine", default="word", help="Converter of *.rtf files: word or libreoffice")
+    parser.add_argument("--set", type=parse_setting, action="append", default=[], metavar="KEY=VALUE",
+                        help="Overrides a setting of settings.json, can be repeated")
+    parser.add_argument("--report", action="store_true", help="Measure the stages of the compilation, print them and "
+                                                              "write the JSON report next to the document")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Do not print progress")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    files = find_files(args.inputs)
+    if not files:
+        parser.error("No input files found")
+    filetype = args.type or guess_filetype(files)
+    if filetype is None:
+        parser.error("Could not tell the type of the input files, use --type")
+    output = os.path.abspath(args.output) if args.output else None
+    toc_file = os.path.abspath(args.toc_file) if args.toc_file else None
+    working_dir = os.getcwd()
+
+    try:
+        parameters = load_settings(args.set)
+    except KeyError as e:
+        parser.error(e.args[0])
+    if toc_file:
+        parameters["TOC file"] = toc_file
+    if args.report:
+        parameters["Instrumentation"] = True
+    if output is None:
+        output = os.path.join(working_dir, parameters["PDF name"])
+
+    from main_functions import Converter
+    from converter_pool import normalize_engine
+    converter = Converter()
+    converter.set_files(files)
+    converter.set_filetype(filetype)
+    converter.set_filename(output)
+    converter.set_create_toc(not args.no_toc)
+    converter.set_toc_orientation(args.toc_orientation)
+    try:
+        converter.set_engine(normalize_engine(args.engine))
+    except ValueError as e:
+        parser.error(str(e))
+    if not args.quiet:
+        total = converter.get_num_files()
+
+        def print_progress(count):
+            #  The last progress value, one more than the number of files, tells that the document is finished
+            if count <= total:
+                print(f"{count}/{total}", file=sys.stderr)
+
+        converter.progress.connect(print_progress)
+        from instrumentation import format_report
+        converter.send_report.connect(lambda report: print(format_report(report), file=sys.stderr))
+    try:
+        converter.convert()
+    except (OSError, ValueError) as e:
+        print(f"Compilation failed: {e}", file=sys.stderr)
+        return 1
+    if not args.quiet and converter.deduplication_summary() is not None:
+        print(converter.deduplication_summary(), file=sys.stderr)
+    print(converter.filename)
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
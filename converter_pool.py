@@ -0,0 +1,363 @@
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+WORD_FILETYPES = {
+    "rtf": 6,
+    "pdf": 17,
+    "docx": 16,
+    "doc": 0,
+    "html": 8,
+    "xml": 19,
+    "txt": 7,
+    "windows_txt": 3
+}
+
+LIBRE_OFFICE_FILTERS = {
+    "pdf": "writer_pdf_Export",
+    "docx": "MS Word 2007 XML",
+    "doc": "MS Word 97",
+    "rtf": "Rich Text Format",
+    "html": "HTML (StarWriter)",
+    "txt": "Text",
+}
+
+# The gui calls LibreOffice "of" (Open Office) so both names are accepted
+ENGINE_ALIASES = {
+    "of": "libre-office",
+    "libreoffice": "libre-office",
+    "libre-office": "libre-office",
+    "word": "word",
+}
+
+
+def normalize_engine(engine):
+    """
+    Returns the canonical name of the backend converter
+    :param engine: Name of the engine as given by the gui or the settings
+    :return: Either "word" or "libre-office"
+    """
+    try:
+        return ENGINE_ALIASES[engine.lower()]
+    except (KeyError, AttributeError):
+        raise ValueError("Not valid backend converter")
+
+
+def uno_available():
+    """
+    Returns True when the python-uno bridge of LibreOffice can be imported. Without it every file is converted by
+    starting soffice again
+    """
+    try:
+        import uno
+    except ImportError:
+        return False
+    return True
+
+
+def default_output_name(input_file, output_filetype):
+    """
+    Returns the path where converted file is saved when no output name is given: same folder and name as the input
+    :param input_file: Absolute path of the input file
+    :param output_filetype: Filetype of the converted file
+    :return: Absolute path of the output file
+    """
+    return os.path.splitext(input_file)[0] + "." + output_filetype
+
+
+class WordBackend:
+    """
+    Microsoft Word instance that is kept open between conversions. COM objects are bound to the thread that created
+    them so the instance must be started, used and closed from the same thread
+    """
+
+    def __init__(self):
+        self.application = None
+
+    def start(self):
+        import comtypes
+        import comtypes.client
+        comtypes.CoInitialize()
+        try:
+            self.application = comtypes.client.CreateObject("Word.Application")
+            self.application.Visible = False
+            self.application.DisplayAlerts = 0
+        except Exception:
+            comtypes.CoUninitialize()
+            raise RuntimeError("Error setting up Word application")
+
+    def convert(self, input_file, output_file, output_filetype):
+        if output_filetype not in WORD_FILETYPES:
+            raise ValueError("Output filetype not found in supported filetypes.")
+        try:
+            document = self.application.Documents.Open(os.path.abspath(input_file), ReadOnly=True)
+        except Exception:
+            raise FileNotFoundError("Error opening file: format not supported or file not found")
+        try:
+            #  Forces Word to finish laying out the document before saving. Replaces the fixed two second sleep
+            document.Repaginate()
+            document.SaveAs(os.path.abspath(output_file), FileFormat=WORD_FILETYPES[output_filetype])
+        finally:
+            document.Close(SaveChanges=0)
+
+    def close(self):
+        import comtypes
+        if self.application is not None:
+            try:
+                self.application.Quit()
+            except Exception:
+                pass
+            self.application = None
+            comtypes.CoUninitialize()
+
+
+class LibreOfficeBackend:
+    """
+    Headless LibreOffice instance. When the python-uno bridge is available the soffice process is started once and
+    kept listening on a named pipe so documents are converted without starting a new process. Without the bridge each
+    call falls back to the soffice command line
+    """
+    startup_timeout = 60
+
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.process = None
+        self.desktop = None
+        self.pipe_name = None
+
+    def _base_command(self):
+        command = ["soffice"]
+        if self.profile_dir is not None:
+            command.append("-env:UserInstallation=" + _path_to_url(self.profile_dir))
+        command += ["--headless", "--invisible", "--norestore", "--nologo", "--nodefault"]
+        return command
+
+    def start(self):
+        if not uno_available():
+            return
+        import uno
+        self.pipe_name = f"pdf_converter_{os.getpid()}_{id(self)}"
+        self.process = subprocess.Popen(self._base_command() + [f"--accept=pipe,name={self.pipe_name};urp;"],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver",
+                                                                          local_context)
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            try:
+                context = resolver.resolve(f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext")
+                break
+            except Exception:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.close()
+                    raise RuntimeError("Error setting up LibreOffice")
+                time.sleep(0.1)
+        self.desktop = context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+
+    def convert(self, input_file, output_file, output_filetype):
+        if self.desktop is not None and output_filetype in LIBRE_OFFICE_FILTERS:
+            self._convert_with_uno(input_file, output_file, output_filetype)
+        else:
+            self._convert_with_command_line(input_file, output_file, output_filetype)
+
+    def _convert_with_uno(self, input_file, output_file, output_filetype):
+        import uno
+        document = self.desktop.loadComponentFromURL(uno.systemPathToFileUrl(os.path.abspath(input_file)),
+                                                     "_blank", 0, (_property("Hidden", True),))
+        if document is None:
+            raise FileNotFoundError("Error opening file: format not supported or file not found")
+        try:
+            document.storeToURL(uno.systemPathToFileUrl(os.path.abspath(output_file)),
+                                (_property("FilterName", LIBRE_OFFICE_FILTERS[output_filetype]),))
+        finally:
+            document.close(True)
+
+    def _convert_with_command_line(self, input_file, output_file, output_filetype):
+        out_dir = tempfile.mkdtemp(prefix="lo_out_")
+        try:
+            subprocess.run(self._base_command() + ["--convert-to", output_filetype, "--outdir", out_dir, input_file],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            converted = default_output_name(os.path.join(out_dir, os.path.basename(input_file)), output_filetype)
+            if not os.path.exists(converted):
+                raise FileNotFoundError("Error opening file: format not supported or file not found")
+            shutil.move(converted, output_file)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    def close(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+
+def _path_to_url(path):
+    return "file:///" + os.path.abspath(path).replace("\\", "/").lstrip("/")
+
+
+def _property(name, value):
+    from com.sun.star.beans import PropertyValue
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+def create_backend(engine, profile_dir=None):
+    engine = normalize_engine(engine)
+    if engine == "word":
+        return WordBackend()
+    return LibreOfficeBackend(profile_dir)
+
+
+class ConverterPool:
+    """
+    Long-lived set of warm backend converter instances. Every instance lives in its own worker thread that starts the
+    backend once and then converts files handed to it until the pool is closed. Used by Converter so that Word or
+    LibreOffice is not started again for every file. With more than one instance files are converted in parallel,
+    each LibreOffice instance running with its own user profile so that the instances don't lock each other out.
+    If a pdf_cache.PdfCache is given files converted earlier are copied from the cache instead of converting them
+    """
+
+    def __init__(self, engine="word", instances=1, cache=None):
+        self.engine = normalize_engine(engine)
+        self.instances = max(1, int(instances))
+        self.cache = cache
+        self._tasks = queue.Queue()
+        self._workers = []
+        self._profile_dirs = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start_workers(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Converter pool has been closed")
+            if not self._workers and self.engine == "libre-office" and not uno_available():
+                logger.warning("python-uno is not available, LibreOffice is started again for every file. Run the "
+                               "program with the Python of LibreOffice or install the uno bridge to keep the "
+                               "instances running")
+            while len(self._workers) < self.instances:
+                profile_dir = None
+                if self.engine == "libre-office":
+                    profile_dir = tempfile.mkdtemp(prefix="lo_profile_")
+                    self._profile_dirs.append(profile_dir)
+                worker = threading.Thread(target=self._work, args=(profile_dir,), daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self, profile_dir):
+        backend = None
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            input_file, output_file, output_filetype, future = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                key = None
+                if self.cache is not None:
+                    key = self.cache.key(input_file, self.engine, output_filetype=output_filetype)
+                    if self.cache.get(key, output_file):
+                        future.set_result(output_file)
+                        continue
+                if backend is None:
+                    backend = create_backend(self.engine, profile_dir)
+                    backend.start()
+                backend.convert(input_file, output_file, output_filetype)
+                if key is not None:
+                    self.cache.put(key, output_file)
+                future.set_result(output_file)
+            except BaseException as error:
+                #  A crashed backend is restarted for the next file
+                if backend is not None and not isinstance(error, (ValueError, FileNotFoundError)):
+                    backend.close()
+                    backend = None
+                future.set_exception(error)
+        if backend is not None:
+            backend.close()
+
+    def submit(self, input_file, output_filetype="pdf", output_file_name=None):
+        """
+        Queues the file for conversion
+        :param input_file: Absolute path of the file to convert
+        :param output_filetype: Filetype to convert the file to
+        :param output_file_name: Path of the converted file. Defaults to the input path with new extension
+        :return: Future that resolves to the path of the converted file
+        """
+        self._start_workers()
+        if output_file_name is None:
+            output_file_name = default_output_name(input_file, output_filetype)
+        future = Future()
+        self._tasks.put((input_file, output_file_name, output_filetype, future))
+        return future
+
+    def convert(self, input_file, output_filetype="pdf", output_file_name=None):
+        """
+        Converts the file with one of the warm backend instances and waits for the result
+        :return: Path of the converted file
+        """
+        return self.submit(input_file, output_filetype, output_file_name).result()
+
+    def imap(self, input_files, output_filetype="pdf", output_dir=None):
+        """
+        Converts the files in parallel with all the backend instances
+        :param input_files: List of absolute paths of the files to convert
+        :param output_filetype: Filetype to convert the files to
+        :param output_dir: Folder where the converted files are written. By default they are written next to the input
+            files. The names get the position of the file as prefix so files with the same name don't overwrite each
+            other
+        :return: Generator yielding paths of the converted files in the same order as the input files
+        """
+        output_names = [None] * len(input_files)
+        if output_dir is not None:
+            names = [os.path.splitext(os.path.basename(file))[0] for file in input_files]
+            output_names = [os.path.join(output_dir, f"{i:05d}_{name}.{output_filetype}")
+                            for i, name in enumerate(names)]
+        futures = [self.submit(file, output_filetype, name) for file, name in zip(input_files, output_names)]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        """
+        Shuts down the backend instances and removes their LibreOffice profiles
+        :return:
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers)
+        for _ in workers:
+            self._tasks.put(None)
+        for worker in workers:
+            worker.join()
+        for profile_dir in self._profile_dirs:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
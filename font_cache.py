@@ -0,0 +1,151 @@
+"""
+Cache of parsed TrueType font metrics. FPDF.add_font parses the font file every time a PDF object is created unless
+it finds a pickle next to the font, and it uses that pickle even if the font file has changed. Here the parsed
+metrics and glyph widths are stored next to the font with the hash of the font file and parsed again only when the
+hash changes. Metrics loaded once are also kept in memory, so creating more PDF objects in the same process, for
+example for the table of contents or in a worker process, does not read the cache file again.
+"""
+import os
+import pickle
+import re
+import tempfile
+from fpdf.ttfonts import TTFontFile
+from pdf_cache import hash_file
+
+# Bump when the cached metrics change in a way that makes old cache files invalid
+FONT_CACHE_VERSION = 1
+
+_loaded = {}
+
+
+def metrics_path(font_file):
+    """
+    Returns path of the metrics cache file of the font
+    """
+    return os.path.splitext(font_file)[0] + ".metrics.pkl"
+
+
+def parse_font_metrics(font_file):
+    """
+    Parses the metrics of the font the same way FPDF.add_font does
+    :param font_file: Path of the TrueType font file
+    :return: Dictionary of font metrics
+    """
+    ttf = TTFontFile()
+    ttf.getMetrics(font_file)
+    desc = {
+        'Ascent': int(round(ttf.ascent, 0)),
+        'Descent': int(round(ttf.descent, 0)),
+        'CapHeight': int(round(ttf.capHeight, 0)),
+        'Flags': ttf.flags,
+        'FontBBox': "[%s %s %s %s]" % tuple(int(round(x, 0)) for x in ttf.bbox[0:4]),
+        'ItalicAngle': int(ttf.italicAngle),
+        'StemV': int(round(ttf.stemV, 0)),
+        'MissingWidth': int(round(ttf.defaultWidth, 0)),
+    }
+    return {
+        'name': re.sub('[ ()]', '', ttf.fullName),
+        'type': 'TTF',
+        'desc': desc,
+        'up': round(ttf.underlinePosition),
+        'ut': round(ttf.underlineThickness),
+        'originalsize': os.stat(font_file).st_size,
+        'cw': ttf.charWidths,
+    }
+
+
+def load_font_metrics(font_file):
+    """
+    Returns metrics of the font from memory, from the cache file next to the font or by parsing the font file
+    :param font_file: Path of the TrueType font file
+    :return: Dictionary of font metrics. Shared between callers and must not be modified
+    """
+    stat = os.stat(font_file)
+    key = (os.path.abspath(font_file), stat.st_size, stat.st_mtime_ns)
+    if key in _loaded:
+        return _loaded[key]
+    digest = hash_file(font_file)
+    cache_file = metrics_path(font_file)
+    metrics = None
+    try:
+        with open(cache_file, 'rb') as file:
+            cached = pickle.load(file)
+        if cached["version"] == FONT_CACHE_VERSION and cached["hash"] == digest:
+            metrics = cached["metrics"]
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+        pass
+    if metrics is None:
+        metrics = parse_font_metrics(font_file)
+        try:
+            #  Written to a temporary file first so parallel workers never read a half written file
+            handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)), suffix=".tmp")
+            with os.fdopen(handle, 'wb') as file:
+                pickle.dump({"version": FONT_CACHE_VERSION, "hash": digest, "metrics": metrics}, file)
+            os.replace(tmp_path, cache_file)
+        except OSError:
+            #  Font folder is not writable, the metrics are still kept in memory
+            pass
+    _loaded[key] = metrics
+    return metrics
+
+
+class GlyphSubset(list):
+    """
+    Codes of the characters used with a font. FPDF appends the code of every character it writes to the subset of
+    the font, so the list would grow with the length of the text and checking if a code is in it would scan the whole
+    list. Here every code is stored only once, in the order it was first used, and membership is checked from a set.
+    The glyphs embedded in the document are the same as with the plain list
+    """
+
+    def __init__(self, codes=()):
+        super().__init__()
+        self._codes = set()
+        self.extend(codes)
+
+    def append(self, code):
+        if code not in self._codes:
+            self._codes.add(code)
+            super().append(code)
+
+    def extend(self, codes):
+        for code in codes:
+            self.append(code)
+
+    def __contains__(self, code):
+        return code in self._codes
+
+    def __delitem__(self, index):
+        removed = self[index]
+        super().__delitem__(index)
+        self._codes.difference_update(removed if isinstance(index, slice) else [removed])
+
+
+def add_cached_font(pdf, family, font_file, glyphs=None):
+    """
+    Adds unicode TrueType font to the document like pdf.add_font(family, '', font_file, uni=True) but with metrics
+    from the cache
+    :param pdf: FPDF object
+    :param family: Font family name used with set_font
+    :param font_file: Path of the TrueType font file
+    :param glyphs: Characters added to the font subset in sorted order before any text is written. Documents that are
+        merged together and created with the same characters embed identical subsets of the font
+    :return:
+    """
+    fontkey = family.lower()
+    if fontkey in pdf.fonts:
+        return
+    metrics = load_font_metrics(font_file)
+    #  Glyphs of the control characters, and of digits when the page count alias is used, are always in the subset
+    subset = GlyphSubset(range(0, 57) if hasattr(pdf, 'str_alias_nb_pages') else range(0, 32))
+    if glyphs:
+        subset.extend(sorted(ord(x) for x in glyphs))
+    pdf.fonts[fontkey] = {
+        'i': len(pdf.fonts) + 1, 'type': metrics['type'],
+        'name': metrics['name'], 'desc': metrics['desc'],
+        'up': metrics['up'], 'ut': metrics['ut'],
+        'cw': metrics['cw'],
+        'ttffile': font_file, 'fontkey': fontkey,
+        'subset': subset, 'unifilename': None,
+    }
+    pdf.font_files[fontkey] = {'length1': metrics['originalsize'], 'type': "TTF", 'ttffile': font_file}
+    pdf.font_files[font_file] = {'type': "TTF"}
@@ -0,0 +1,193 @@
+"""
+Cache of rendered *.txt files. The pages of every file are rendered into a pdf_assembly.Fragment of their own, which
+is stored with the chapter name and page count of the file under the hash of the file contents, the settings that
+change how the pages look and the font. When a package is compiled again only the files not found from the cache are
+parsed and rendered, the document is assembled from the fragments and the table of contents is the only other thing
+rendered. The cache is size-bounded like the cache of converted RTF files, least recently used fragments are evicted.
+
+The cache can be inspected and pruned with pdf_cache.py:
+    python pdf_cache.py info --fragments
+"""
+import os
+import pickle
+from PyPDF2.pdf import PdfFileReader
+import instrumentation
+from helper_functions import parse_documents, settings
+from pdf_assembly import Fragment
+from pdf_cache import PdfCache, hash_file
+from pdf_template import FONT_FILE, TOC_CHARACTERS
+from shard_rendering import render_shards
+
+# Bump when rendering changes in a way that makes old cached fragments invalid
+FRAGMENT_CACHE_VERSION = 1
+
+# Settings that change how a *.txt file is parsed or how its pages look. Other settings, like the table of contents
+# settings, do not change the fragments
+LAYOUT_SETTINGS = ("Chapter body x-offset", "Chapter body y-offset", "Distance between header and chapter title",
+                   "Distance between lines of chapter body", "Distance between lower-dashed line and footer",
+                   "Fast text body", "First word in footer", "Footer y-offset from bottom", "Header y-offset",
+                   "Last word in header", "Line symbol", "Max header lines", "TOC level", "Two linebreaks")
+
+# Characters embedded from the font in every fragment whatever characters the file has. Fragments rendered in
+# different compilations then embed the same font subset, which is written only once to the document. A file with
+# other characters gets a subset of its own
+FRAGMENT_GLYPHS = frozenset(TOC_CHARACTERS).union(chr(x) for x in range(32, 127))
+
+
+class CachedDocument:
+    """
+    Rendered pages of one *.txt file and what the table of contents needs from the file
+    """
+
+    def __init__(self, chapter_name, num_pages, fragment):
+        self.chapter_name = chapter_name
+        self.num_pages = num_pages
+        self.fragment = fragment
+
+
+class FragmentCache(PdfCache):
+    """
+    PdfCache of CachedDocument objects
+    """
+
+    def __init__(self, directory, max_size_mb, parameters):
+        """
+        :param parameters: Settings the fragments are rendered with
+        """
+        super().__init__(directory, max_size_mb, suffix=".fragment")
+        self.options = {"version": FRAGMENT_CACHE_VERSION, "font": hash_file(FONT_FILE),
+                        "settings": {key: parameters[key] for key in LAYOUT_SETTINGS}}
+
+    @classmethod
+    def from_settings(cls, parameters):
+        """
+        Creates the cache from program settings
+        :param parameters: Settings dictionary
+        :return: FragmentCache or None if caching is disabled
+        """
+        if not parameters["Fragment cache"]:
+            return None
+        return cls(parameters["Fragment cache directory"], parameters["Fragment cache size (MB)"], parameters)
+
+    def document_key(self, input_file):
+        """
+        Creates the cache key of the *.txt file
+        :param input_file: Absolute path of the file
+        :return: Hex digest string
+        """
+        return self.key(input_file, "fpdf", **self.options)
+
+    def load(self, key):
+        """
+        Returns the cached document
+        :param key: Key created by document_key()
+        :return: CachedDocument or None if not found or not readable
+        """
+        data = self.read(key)
+        if data is None:
+            return None
+        instrumentation.count("cache", bytes_read=len(data))
+        try:
+            return pickle.loads(data)
+        except Exception:
+            #  Half-written or from another version of the program, rendered again and replaced
+            return None
+
+    def store(self, key, document):
+        """
+        Stores the rendered document
+        :param key: Key created by document_key()
+        :param document: CachedDocument
+        :return:
+        """
+        data = pickle.dumps(document, pickle.HIGHEST_PROTOCOL)
+        self.write(key, data)
+        instrumentation.count("cache", bytes_written=len(data))
+
+
+def render_fragments(documents, directory, progress=None):
+    """
+    Renders every parsed document into a Fragment of its own. Documents are rendered together in shards, grouped by
+    the font subset they need, and the shards are then split into fragments one document at a time
+    :param documents: List of ParsedDocument objects
+    :param directory: Folder for the temporary pdf files
+    :param progress: Optional function called with the number of documents rendered so far
+    :return: Generator yielding (index of the document, Fragment) tuples, grouped by font subset
+    """
+    groups = {}
+    for index, document in enumerate(documents):
+        groups.setdefault(FRAGMENT_GLYPHS.union(document.characters), []).append(index)
+    done = 0
+    for glyphs, indexes in groups.items():
+        group_progress = None if progress is None else lambda count, done=done: progress(done + count)
+        with instrumentation.stage("render") as measurement:
+            shards = render_shards([documents[i] for i in indexes], settings["Render workers"], directory, glyphs,
+                                   group_progress)
+            for shard in shards:
+                measurement.file_written(shard)
+        remaining = iter(indexes)
+        for shard in shards:
+            with open(shard, 'rb') as stream:
+                reader = PdfFileReader(stream)
+                #  Page count from the root of the page tree, the pages of FPDF are its direct children
+                num_pages = int(reader.trailer["/Root"]["/Pages"]["/Count"])
+                start = 0
+                while start < num_pages:
+                    index = next(remaining)
+                    with instrumentation.stage("fragment") as measurement:
+                        fragment = Fragment.from_document(reader, range(start, start + documents[index].num_pages))
+                        measurement.pages += documents[index].num_pages
+                    start += documents[index].num_pages
+                    yield index, fragment
+            instrumentation.count("fragment", bytes_read=os.path.getsize(shard))
+            os.remove(shard)
+        done += len(indexes)
+    instrumentation.count_documents("render", documents)
+
+
+def iter_documents(files, cache, directory, progress=None):
+    """
+    Returns the rendered pages of the *.txt files one file at a time, so only one file is kept in memory when the
+    caller writes every file to the document before taking the next. Files found from the cache come first, in the
+    order of the files. The other files are then parsed and rendered, added to the cache and returned in the order
+    they are rendered
+    :param files: List of absolute paths of *.txt files
+    :param cache: FragmentCache, or None to render every file
+    :param directory: Folder for the temporary pdf files
+    :param progress: Optional function called with the number of files loaded or rendered so far
+    :return: Generator yielding (index of the file, CachedDocument) tuples
+    """
+    keys = {}
+    missing = []
+    for index, file in enumerate(files):
+        document = None
+        if cache is not None:
+            with instrumentation.stage("cache", file) as measurement:
+                keys[index] = cache.document_key(file)
+                document = cache.load(keys[index])
+                #  Every file is read for its hash
+                measurement.file_read(file)
+                if document is not None:
+                    measurement.pages += document.num_pages
+        if document is None:
+            missing.append(index)
+            continue
+        if progress is not None:
+            progress(index + 1 - len(missing))
+        yield index, document
+    if not missing:
+        return
+    done = len(files) - len(missing)
+    with instrumentation.stage("parse"):
+        documents = list(parse_documents([files[i] for i in missing],
+                                         settings["Parser workers"] if len(missing) > 1 else 1,
+                                         settings["Parser chunk size"]))
+    instrumentation.count_documents("parse", documents, read=True)
+    for position, fragment in render_fragments(documents, directory,
+                                               None if progress is None else lambda count: progress(done + count)):
+        index = missing[position]
+        document = CachedDocument(documents[position].chapter_name, documents[position].num_pages, fragment)
+        if cache is not None:
+            with instrumentation.stage("cache"):
+                cache.store(keys[index], document)
+        yield index, document
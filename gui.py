@@ -1,10 +1,12 @@
-from PyQt5.QtCore import QThread, QUrl
+from PyQt5.QtCore import QThread, QUrl, QObject, pyqtSignal
 from PyQt5.QtWidgets import QVBoxLayout, QLabel, QPushButton, QWidget, QFileDialog, QRadioButton, \
     QButtonGroup, QTextBrowser, QCheckBox, QProgressBar, QTextEdit, QHBoxLayout, QLineEdit, QDoubleSpinBox, QSpinBox, \
     QMenu, QMenuBar, QMainWindow, QAction
 from PyQt5.QtGui import QCloseEvent, QDesktopServices
 from main_functions import Converter
 from settings import get_parameters
+from helper_functions import format_toc_text, parse_toc_text
+from instrumentation import format_report
 import json
 
 
@@ -14,16 +16,45 @@ def _open_github():
     QDesktopServices.openUrl(url)
 
 
+class QtConverter(QObject, Converter):
+    """
+    Converter with Qt signals so it can be moved to a QThread and send progress and the table of contents to the gui
+    """
+    finished = pyqtSignal()
+    started = pyqtSignal()
+    progress = pyqtSignal(int)
+    send_toc = pyqtSignal(object)
+    send_report = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def convert(self):
+        """
+        Runs the compilation in the converter thread. An exception cannot be raised from a slot, so it is sent to the
+        gui with the failed signal instead of finished
+        :return:
+        """
+        try:
+            super().convert()
+        except Exception as e:
+            self.failed.emit(f"{type(e).__name__}: {e}")
+
+
 class MainWindow(QWidget):
     """
     Class for GUI functionality of the program.
     """
+    start_compiling = pyqtSignal()
 
     def __init__(self):
         super().__init__()
         self.window_layout = QVBoxLayout(self)
         self.main_layout = QHBoxLayout()
-        self.converter = Converter()
+        self.converter = QtConverter()
+        self.compiling = False
+        self.report = None
+        self.toc_text_window = None
+        self.accept_toc_button = None
+        self.create_thread()
         self.parameters = None
         self.setWindowTitle("PDF compiler")
         self.settings_window = None
@@ -52,21 +83,25 @@ class MainWindow(QWidget):
 
     def create_thread(self):
         """
-        Creates a thread for converter so the application doesn't freeze while converting
+        Creates a thread for converter so the application doesn't freeze while converting. The thread and the converter
+        are kept for the lifetime of the window and every compilation is started with the start_compiling signal, so
+        other documents can be compiled without restarting the program
         :return:
         """
-        try:
-            self.thread.isFinished()
-        except:
-            self.thread = QThread()
-            self.thread.finished.connect(self._update_finished_text)
-            self.converter.moveToThread(self.thread)
-            self.thread.started.connect(self.converter.convert)
-            self.converter.finished.connect(self.thread.quit)
-            # self.converter.finished.connect(self.converter.deleteLater)
-            self.thread.finished.connect(self.thread.deleteLater)
-            self.converter.progress.connect(self._on_progress_update)
-            self.converter.send_toc.connect(self.create_toc_show_window)
+        self.thread = QThread()
+        self.converter.moveToThread(self.thread)
+        self.start_compiling.connect(self.converter.convert)
+        self.converter.finished.connect(self._update_finished_text)
+        self.converter.failed.connect(self._update_failed_text)
+        self.converter.progress.connect(self._on_progress_update)
+        self.converter.send_toc.connect(self.create_toc_show_window)
+        self.converter.send_report.connect(self._on_report)
+        self.thread.start()
+
+    def closeEvent(self, a0: QCloseEvent):
+        self.thread.quit()
+        if not self.compiling:
+            self.thread.wait()
 
     def update_parameters(self):
         self.parameters = get_parameters()
@@ -86,11 +121,7 @@ class MainWindow(QWidget):
         self.tmp_layout.addWidget(self.toc_text_window)
         self.tmp_layout.addWidget(self.accept_toc_button)
         self.main_layout.addLayout(self.tmp_layout)
-        text = ""
-        for key, value in toc_dict.items():
-            key = key.replace("\n", "").replace("\r", "").strip()
-            text += f'{key}: {value}\n'
-        self.toc_text_window.setText(text)
+        self.toc_text_window.setText(format_toc_text(toc_dict))
 
     def accept_toc(self):
         """
@@ -99,21 +130,20 @@ class MainWindow(QWidget):
         :return:
         """
         text = self.toc_text_window.toPlainText()
-        df = {}
-        for line in text.splitlines():
-            line = line.split(":")
-            value, data = line[0], line[1]
-            value, data = value.strip(), int(data)
-            df[value] = data
-        self.converter.set_toc_dict(df)
+        self.converter.set_toc_dict(parse_toc_text(text))
         self.converter.accept_toc()
+        self._remove_toc_window()
+        self._update_text_window("Creating the PDF. Just a second")
+
+    def _remove_toc_window(self):
+        if self.toc_text_window is None:
+            return None
         self.layout().removeWidget(self.toc_text_window)
         self.toc_text_window.deleteLater()
         self.toc_text_window = None
         self.layout().removeWidget(self.accept_toc_button)
         self.accept_toc_button.deleteLater()
         self.accept_toc_button = None
-        self._update_text_window("Creating the PDF. Just a second")
 
     def create_base_ui(self):
         """
@@ -230,6 +260,8 @@ class MainWindow(QWidget):
         This function calls the converter to start the file conversion
         :return:
         """
+        if self.compiling:
+            return None
         self.converter.set_create_toc(self.toc_button.isChecked())
         if not self.converter.filename_set():
             self.compile_button.setText("Compile from selected files\n Select save location first!")
@@ -238,9 +270,9 @@ class MainWindow(QWidget):
             self._update_text_window("Select files first!")
             return None
         self._update_started_text()
-        self.create_thread()
         self._update_progress_bar_length()
-        self.thread.start()
+        self.compiling = True
+        self.start_compiling.emit()
 
     def _update_text_window(self, msg):
         self.big_text_box.setText(msg)
@@ -248,13 +280,31 @@ class MainWindow(QWidget):
     def _on_progress_update(self, value):
         self.progress_bar.setValue(value)
 
+    def _on_report(self, report):
+        self.report = report
+
     def _update_finished_text(self):
         if self.toc_button.isChecked():
             compile_text = f"PDF compiled as {self.converter.filename}"
         else:
             compile_text = f"PDF compiled as {self.converter.filename} \nTable of contents page not created"
+        if self.converter.deduplication_summary() is not None:
+            compile_text += "\n" + self.converter.deduplication_summary()
+        if self.report is not None:
+            #  Sent just before finished when "Instrumentation" is enabled
+            compile_text += "\n\n" + format_report(self.report)
+            self.report = None
         self._update_text_window(compile_text)
-        self.compile_button.setText("RESTART PROGRAM BEFORE COMPILING OTHER DOCUMENTS")
+        self.compiling = False
+        self.compile_button.setText("Compile from selected files")
+
+    def _update_failed_text(self, error):
+        #  The table of contents may still be waiting for review if rendering failed meanwhile
+        self._remove_toc_window()
+        self.report = None
+        self._update_text_window(f"Compilation failed: {error}")
+        self.compiling = False
+        self.compile_button.setText("Compile from selected files")
 
     def _update_started_text(self):
         self.label_above_text_box.setText("Compiling..."
@@ -289,19 +339,27 @@ class SettingsWindow(QWidget):
                       "Items on vertical toc",
                       "Items on horizontal toc",
                       "Horizontal Toc characters per line",
-                      "Vertical Toc characters per line"]
+                      "Vertical Toc characters per line",
+                      "Converter instances",
+                      "Cache size (MB)",
+                      "Fragment cache size (MB)",
+                      "Parser workers",
+                      "Parser chunk size",
+                      "Render workers",
+                      "Streamed TXT size (MB)"]
         for key, value in self.parameters.items():
             label = QLabel(key)
             setting_box = None
             if key == "First word in footer" or key == "Last word in header":
                 setting_box = QLineEdit()
                 setting_box.setText(str(value))
-            elif key == "Two linebreaks":
+            elif isinstance(value, bool):
                 setting_box = QCheckBox()
                 if value:
                     setting_box.setChecked(True)
             elif key in int_keys:
                 setting_box = QSpinBox()
+                setting_box.setMaximum(1000000)
                 setting_box.setValue(value)
             elif isinstance(value, int) or isinstance(value, float):
                 setting_box = QDoubleSpinBox()
@@ -1,12 +1,20 @@
 import os
 import re
 import math
+import mmap
 import textwrap
+import multiprocessing
+from collections import Counter, deque
+from functools import partial
 from itertools import accumulate
+import instrumentation
 import settings
 
 settings = settings.get_parameters()
 
+# Least text parsed by one worker process when the number of processes is chosen automatically, see parser_workers
+PARSE_BYTES_PER_WORKER = 8 * 1024 * 1024
+
 
 def get_text_from_file(file_path):
     """
@@ -19,6 +27,103 @@ def get_text_from_file(file_path):
     return text
 
 
+class ParsedDocument:
+    """
+    Contents of one *.txt file parsed to the parts that the table of contents and the pdf pages need. Created once
+    per file by parse_document. characters is the set of all characters in the file, so it covers every character
+    printed on the pages of the file
+    """
+
+    def __init__(self, file_path, header_text, chapter_name, program_info, blocks, characters=frozenset()):
+        self.file_path = file_path
+        self.header_text = header_text
+        self.chapter_name = chapter_name
+        self.program_info = program_info
+        self.blocks = blocks
+        self.characters = characters
+
+    @property
+    def num_pages(self):
+        return len(self.blocks)
+
+
+def parse_document(file_path):
+    """
+    Reads the text file and extracts header, chapter name, program info and page blocks from it
+    :param file_path: Absolute path to the file
+    :return: ParsedDocument
+    """
+    if os.path.getsize(file_path) > settings["Streamed TXT size (MB)"] * 1024 * 1024:
+        document = scan_document(file_path)
+        if document is not None:
+            return document
+    text = get_text_from_file(file_path)
+    info_lines = get_info_lines(text)
+    header_text = "\n".join(info_lines[0:settings["TOC level"]])
+    chapter_name = "\n".join(info_lines[settings["TOC level"]:])
+    program_info = get_program_info(text)
+    blocks = get_text_blocks(text)
+    return ParsedDocument(file_path, header_text, chapter_name, program_info, blocks, frozenset(text))
+
+
+def init_worker_settings(parameters):
+    """
+    Gives a worker process the same settings as the parent process has. Used as multiprocessing pool initializer
+    """
+    settings.clear()
+    settings.update(parameters)
+
+
+def worker_pool(processes):
+    """
+    Starts worker processes that have the same settings as this process. The processes are spawned, not forked,
+    because the service and the watch mode start pools from threads and a forked process can inherit locks held by
+    the other threads
+    :param processes: Number of worker processes
+    :return: multiprocessing.Pool
+    """
+    context = multiprocessing.get_context("spawn")
+    return context.Pool(processes, initializer=init_worker_settings, initargs=(dict(settings),))
+
+
+def parser_workers(files, workers):
+    """
+    Returns the number of worker processes parse_documents uses for the files. A given number is used as is, but not
+    more processes than there are files. With 0 the number is chosen from the total size of the files: starting a
+    process takes about as long as parsing a few megabytes, so every process gets at least PARSE_BYTES_PER_WORKER bytes
+    and there is at most one process per cpu core
+    :param files: list of absolute paths of files
+    :param workers: Number of worker processes, 0 to choose automatically
+    :return: Number of worker processes, 1 when the files are parsed in this process
+    """
+    if workers == 0:
+        size = sum(os.path.getsize(file) for file in files)
+        workers = min(os.cpu_count() or 1, size // PARSE_BYTES_PER_WORKER)
+    return max(1, min(workers, len(files)))
+
+
+def parse_documents(files, workers=1, chunk_size=1):
+    """
+    Parses the text files in parallel worker processes. Parsing only depends on the file and the settings so the
+    files can be split freely between the processes
+    :param files: list of absolute paths of files
+    :param workers: Number of worker processes. 0 chooses the number from the size of the files, see parser_workers,
+        and 1 parses in this process
+    :param chunk_size: Number of files sent to a worker process at a time
+    :return: Generator yielding ParsedDocument objects in the same order as the files
+    """
+    workers = parser_workers(files, workers)
+    if workers == 1:
+        for file in files:
+            yield parse_document(file)
+        return
+    with worker_pool(workers) as pool:
+        for document, cpu in pool.imap(partial(instrumentation.timed, parse_document), files,
+                                       chunksize=max(1, chunk_size)):
+            instrumentation.worker_cpu(cpu)
+            yield document
+
+
 def get_info_lines(text):
     """
     Gets research name from block of text
@@ -133,6 +238,180 @@ def remove_empty_lines(block_of_text):
     return text
 
 
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def _read_rows(mapped, encoding):
+    """
+    Yields the lines of a memory-mapped text file. Lines are split exactly like str.splitlines splits the text read
+    by get_text_from_file, but only about one chunk of the file is decoded at a time
+    :param mapped: mmap of the file
+    :param encoding: Encoding that open() uses for the file
+    """
+    start = 0
+    size = len(mapped)
+    while start < size:
+        #  Chunks end after a newline so no line or multibyte character is split between two chunks
+        end = mapped.find(b"\n", min(start + READ_CHUNK_SIZE, size) - 1)
+        end = size if end == -1 else end + 1
+        yield from mapped[start:end].decode(encoding).splitlines()
+        start = end
+
+
+def _fix_format_rows(rows, num, tail, num_rows):
+    """
+    Streaming version of fix_format. Gives the same rows that fix_format(text, num).splitlines() gives including the
+    way rows at the start of the file are compared to the rows at the end of the file
+    :param rows: Rows of the file
+    :param num: Number of symbols in the added line
+    :param tail: Last four rows of the file
+    :param num_rows: Number of rows in the file
+    """
+    footer = settings["First word in footer"]
+    line = settings["Line symbol"] * num
+    previous = deque(maxlen=4)
+    rows = iter(rows)
+    row = next(rows, None)
+    for i in range(num_rows - 1):
+        following = next(rows)
+        if footer in following:
+            yield line
+        if i >= 4:
+            earlier = previous[0]
+        elif i - 4 >= -num_rows:
+            earlier = tail[i - 4]
+        else:
+            earlier = None
+        if earlier is not None and footer in earlier:
+            yield line
+        yield row
+        previous.append(row)
+        row = following
+    if row is not None:
+        yield row
+
+
+def _split_blocks(rows, split_size, one_size):
+    """
+    Streaming version of splitting the text in get_text_blocks. Yields the blocks one at a time with empty lines
+    removed like remove_empty_lines does
+    :param rows: Rows of the text
+    :param split_size: Length of the dashed lines splitting the text
+    :param one_size: True when the file has dashed lines of only one length
+    """
+    symbol = settings["Line symbol"]
+    split_re = re.compile(f"(?<!{symbol})[{symbol}]{'{'}{split_size}{'}'}(?!{symbol})")
+    piece = 0
+    lines = []
+
+    def selected():
+        return piece % 3 == 2 if one_size else piece % 2 == 1
+
+    for row in rows:
+        position = 0
+        if symbol * split_size in row:
+            for match in split_re.finditer(row):
+                if selected():
+                    lines.append(row[position:match.start()])
+                    yield os.linesep.join([x for x in lines if x])
+                    lines = []
+                piece += 1
+                position = match.end()
+        if selected():
+            lines.append(row[position:])
+    if selected():
+        yield os.linesep.join([x for x in lines if x])
+
+
+class StreamedBlocks:
+    """
+    Page blocks of a large text file. The blocks are read from the memory-mapped file one at a time every time the
+    object is iterated, so only about one page of the file is in memory at a time. Gives the same blocks as
+    get_text_blocks. Created by scan_document
+    """
+
+    def __init__(self, file_path, encoding, split_size, one_size, fix_format_size=None, tail=(), num_rows=0,
+                 num_blocks=None):
+        self.file_path = file_path
+        self.encoding = encoding
+        self.split_size = split_size
+        self.one_size = one_size
+        self.fix_format_size = fix_format_size
+        self.tail = list(tail)
+        self.num_rows = num_rows
+        self.num_blocks = num_blocks
+
+    def __iter__(self):
+        with open(self.file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            rows = _read_rows(mapped, self.encoding)
+            if self.fix_format_size is not None:
+                rows = _fix_format_rows(rows, self.fix_format_size, self.tail, self.num_rows)
+            yield from _split_blocks(rows, self.split_size, self.one_size)
+
+    def __len__(self):
+        if self.num_blocks is None:
+            self.num_blocks = sum(1 for _ in self)
+        return self.num_blocks
+
+
+def scan_document(file_path):
+    """
+    Parses large text file without reading the whole file to memory. The file is read once to find the header, the
+    program info and the lengths of the dashed lines. The page blocks are read later by iterating the returned
+    document's blocks
+    :param file_path: Absolute path to the file
+    :return: ParsedDocument with StreamedBlocks or None if the file has no dashed lines and has to be parsed by
+        parse_document
+    """
+    symbol = settings["Line symbol"]
+    max_info_rows = settings["Max header lines"] + settings["TOC level"]
+    with open(file_path, 'r') as file:
+        encoding = file.encoding
+    info_lines = []
+    info_found = False
+    program_info = None
+    sizes = set()
+    num_lines = 0
+    run_lengths = Counter()
+    tail = deque(maxlen=4)
+    num_rows = 0
+    characters = set()
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for row in _read_rows(mapped, encoding):
+            #  Same rules as in get_info_lines, get_program_info and get_text_blocks
+            if not info_found:
+                if "____" in row or len(info_lines) == max_info_rows:
+                    info_found = True
+                elif not is_empty_line(row):
+                    info_lines.append(row)
+            if not is_empty_line(row):
+                program_info = row
+            if symbol * 20 in row:
+                num_lines = len(row.strip())
+                sizes.add(num_lines)
+                run_lengths.update(len(x.group(0)) for x in re.finditer(f"[{symbol}]+", row))
+            characters.update(row)
+            tail.append(row)
+            num_rows += 1
+    if not sizes:
+        return None
+    if not info_found:
+        info_lines = None
+
+    if settings["Two linebreaks"] == "False":
+        blocks = StreamedBlocks(file_path, encoding, max(sizes) + 1, False, fix_format_size=max(sizes) + 1,
+                                tail=tail, num_rows=num_rows)
+    else:
+        one_size = len(sizes) == 1
+        #  Text is split from every dashed line that has exactly num_lines symbols
+        pieces = run_lengths[num_lines] + 1
+        blocks = StreamedBlocks(file_path, encoding, num_lines, one_size,
+                                num_blocks=pieces // 3 if one_size else pieces // 2)
+    header_text = "\n".join(info_lines[0:settings["TOC level"]])
+    chapter_name = "\n".join(info_lines[settings["TOC level"]:])
+    return ParsedDocument(file_path, header_text, chapter_name, program_info, blocks, frozenset(characters))
+
+
 def get_chapter_from_pdf_txt(pdf_text):
     """
     Helper function to extract the "chapter name" from the text document. Needed in rtf conversion
@@ -166,6 +445,34 @@ def break_chapter_to_lines(chapter, orientation="P"):
     return lines
 
 
+def format_toc_text(toc):
+    """
+    Formats table of contents as text that the user can edit. One "chapter: page" line per chapter
+    :param toc: Table of contents dictionary
+    :return: Python string
+    """
+    text = ""
+    for key, value in toc.items():
+        key = key.replace("\n", "").replace("\r", "").strip()
+        text += f'{key}: {value}\n'
+    return text
+
+
+def parse_toc_text(text):
+    """
+    Reads table of contents from the text format created by format_toc_text
+    :param text: Python string
+    :return: Table of contents dictionary
+    """
+    toc = {}
+    for line in text.splitlines():
+        if is_empty_line(line):
+            continue
+        chapter, page = line.rsplit(":", 1)
+        toc[chapter.strip()] = int(page)
+    return toc
+
+
 def compile_toc(chapters, pages, orientation):
     """
     Creates table of contents library from chapters and lengths of chapters
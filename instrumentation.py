@@ -0,0 +1,296 @@
+"""
+Instrumentation of compilations. When "Instrumentation" is enabled every stage of a compilation, like converting,
+parsing, rendering and merging, is measured: wall time, CPU time, bytes read and written and pages produced, in total
+and for every input file. Converter collects the measurements to a report that it writes as JSON next to the document
+and sends with its send_report signal.
+
+Code measures a stage with the module functions, which use the instrumentation activated for the current thread by
+activate(). Without an active instrumentation they return shared objects that do nothing:
+
+    with instrumentation.stage("merge", file, output=writer) as measurement:
+        ...
+        measurement.pages += num_pages
+        measurement.file_read(pdf_file)
+
+Stages are not nested, the times of the stages of a compilation add up to at most its total time.
+
+CPU time is the time of the thread running the compilation and of the work it hands to worker processes. Pool
+workers run their jobs through timed() and the compilation adds the returned time with worker_cpu(), so compilations
+running at the same time do not count each other's workers. Word and LibreOffice are not counted.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Bump when the report format changes
+REPORT_VERSION = 1
+
+_local = threading.local()
+
+
+def report_path(pdf_file):
+    """
+    Returns path of the instrumentation report of the document
+    """
+    return os.path.splitext(pdf_file)[0] + ".report.json"
+
+
+def timed(function, *args):
+    """
+    Calls the function and returns its result with the CPU time the call took. Used as the job of pool workers,
+    for example pool.imap(partial(timed, parse_document), files), and the time is then given to worker_cpu()
+    :return: (result, seconds) tuple
+    """
+    start = time.process_time()
+    result = function(*args)
+    return result, time.process_time() - start
+
+
+class Measurement:
+    """
+    Wall time and CPU time in seconds, bytes read and written and pages produced by a stage
+    """
+    __slots__ = ("wall", "cpu", "bytes_read", "bytes_written", "pages", "calls")
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.pages = 0
+        self.calls = 0
+
+    def file_read(self, path):
+        self.bytes_read += os.path.getsize(path)
+
+    def file_written(self, path):
+        self.bytes_written += os.path.getsize(path)
+
+    def add(self, other):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def to_dict(self):
+        return {"wall": round(self.wall, 6), "cpu": round(self.cpu, 6), "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written, "pages": self.pages, "calls": self.calls}
+
+
+class _NullMeasurement(Measurement):
+    """
+    Measurement that ignores the files, given when instrumentation is disabled
+    """
+    __slots__ = ()
+
+    def file_read(self, path):
+        pass
+
+    def file_written(self, path):
+        pass
+
+
+class _NullStage:
+    """
+    Reusable context manager of a stage that is not measured
+    """
+
+    def __enter__(self):
+        return _NullMeasurement()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Instrumentation:
+    """
+    Collects the measurements of one compilation
+    """
+    enabled = True
+
+    def __init__(self):
+        #  CPU time of the worker processes of this compilation, see worker_cpu
+        self._worker_cpu = 0.0
+        self._start_wall = time.perf_counter()
+        self._start_cpu = self._cpu_time()
+        #  Stage name: Measurement, in the order the stages first ran
+        self.stages = {}
+        #  Input file: {stage name: Measurement}
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def _cpu_time(self):
+        #  Only this thread, compilations running at the same time in other threads are not counted
+        return time.thread_time() + self._worker_cpu
+
+    def worker_cpu(self, seconds):
+        """
+        Adds CPU time used by a worker process for this compilation, counted in the stage running when it is added
+        """
+        self._worker_cpu += seconds
+
+    @contextmanager
+    def stage(self, name, file=None, output=None):
+        """
+        Measures the code run in the with block as a stage
+        :param name: Name of the stage
+        :param file: Input file the stage is run for, None for stages run for all files
+        :param output: Optional writer with a bytes_written attribute, like pdf_assembly.StreamingPdfWriter, whose
+            growth during the stage is added to the bytes written
+        :return: Measurement whose counters the block can increase
+        """
+        measurement = Measurement()
+        written = output.bytes_written if output is not None else 0
+        wall = time.perf_counter()
+        cpu = self._cpu_time()
+        try:
+            yield measurement
+        finally:
+            measurement.wall = time.perf_counter() - wall
+            measurement.cpu = self._cpu_time() - cpu
+            measurement.calls = 1
+            if output is not None:
+                measurement.bytes_written += output.bytes_written - written
+            self._add(name, file, measurement)
+
+    def count(self, name, file=None, pages=0, bytes_read=0, bytes_written=0):
+        """
+        Adds pages and bytes to a stage without measuring time, for example the pages of every file of a stage run
+        for all files at once
+        """
+        measurement = Measurement()
+        measurement.pages = pages
+        measurement.bytes_read = bytes_read
+        measurement.bytes_written = bytes_written
+        self._add(name, file, measurement)
+
+    def _add(self, name, file, measurement):
+        with self._lock:
+            self.stages.setdefault(name, Measurement()).add(measurement)
+            if file is not None:
+                self.files.setdefault(file, {}).setdefault(name, Measurement()).add(measurement)
+
+    def report(self, **info):
+        """
+        Returns the measurements as a dictionary that can be written as JSON
+        :param info: Items added to the report, for example the path of the document
+        :return: Dictionary
+        """
+        with self._lock:
+            return {
+                "version": REPORT_VERSION,
+                **info,
+                "wall": round(time.perf_counter() - self._start_wall, 6),
+                "cpu": round(self._cpu_time() - self._start_cpu, 6),
+                "stages": {name: measurement.to_dict() for name, measurement in self.stages.items()},
+                "files": {file: {name: measurement.to_dict() for name, measurement in stages.items()}
+                          for file, stages in self.files.items()},
+            }
+
+
+class _DisabledInstrumentation:
+    """
+    Instrumentation that measures nothing
+    """
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name, file=None, output=None):
+        return self._stage
+
+    def count(self, name, file=None, pages=0, bytes_read=0, bytes_written=0):
+        pass
+
+    def worker_cpu(self, seconds):
+        pass
+
+
+DISABLED = _DisabledInstrumentation()
+
+
+def current():
+    """
+    Returns the instrumentation active in this thread
+    """
+    return getattr(_local, "instrumentation", DISABLED)
+
+
+def enabled():
+    return current().enabled
+
+
+def stage(name, file=None, output=None):
+    """
+    Measures a stage with the active instrumentation, see Instrumentation.stage
+    """
+    return current().stage(name, file, output)
+
+
+def count(name, file=None, pages=0, bytes_read=0, bytes_written=0):
+    """
+    Adds pages and bytes to a stage of the active instrumentation, see Instrumentation.count
+    """
+    current().count(name, file, pages, bytes_read, bytes_written)
+
+
+def worker_cpu(seconds):
+    """
+    Adds CPU time of a worker process to the active instrumentation, see timed
+    """
+    current().worker_cpu(seconds)
+
+
+def count_documents(name, documents, read=False):
+    """
+    Adds the pages of every parsed *.txt file to a stage run for all files
+    :param name: Name of the stage
+    :param documents: ParsedDocument objects
+    :param read: Also adds the size of the file as bytes read
+    :return:
+    """
+    if not enabled():
+        return
+    for document in documents:
+        count(name, document.file_path, pages=document.num_pages,
+              bytes_read=os.path.getsize(document.file_path) if read else 0)
+
+
+@contextmanager
+def activate(enable=True):
+    """
+    Measures the stages run in this thread in the with block
+    :param enable: When False nothing is measured
+    :return: Instrumentation, or a disabled instrumentation whose enabled attribute is False
+    """
+    previous = current()
+    _local.instrumentation = Instrumentation() if enable else DISABLED
+    try:
+        yield _local.instrumentation
+    finally:
+        _local.instrumentation = previous
+
+
+def save_report(report, path):
+    """
+    Writes the report as JSON
+    :param report: Dictionary returned by Instrumentation.report
+    :param path: Path of the JSON file
+    :return:
+    """
+    with open(path, "w") as file:
+        json.dump(report, file, indent=4)
+
+
+def format_report(report):
+    """
+    Formats the stages of the report as a table for showing in the command line or the gui
+    :param report: Dictionary returned by Instrumentation.report
+    :return: String
+    """
+    lines = [f"{'stage':<12} {'wall (s)':>9} {'cpu (s)':>9} {'read (kB)':>10} {'written (kB)':>12} {'pages':>7}"]
+    for name, stage_report in report["stages"].items():
+        lines.append(f"{name:<12} {stage_report['wall']:>9.2f} {stage_report['cpu']:>9.2f} "
+                     f"{stage_report['bytes_read'] / 1024:>10.1f} {stage_report['bytes_written'] / 1024:>12.1f} "
+                     f"{stage_report['pages']:>7}")
+    lines.append(f"{'total':<12} {report['wall']:>9.2f} {report['cpu']:>9.2f}")
+    return "\n".join(lines)
@@ -1,3 +1,4 @@
+import multiprocessing
 from PyQt5.QtWidgets import QApplication
 from gui import MainWindow
 import settings
@@ -11,4 +12,5 @@ def main():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
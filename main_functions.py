@@ -1,30 +1,30 @@
-import time
-import comtypes.client
-from PyPDF2.merger import PdfFileMerger
-from PyPDF2.pdf import PdfFileReader, PdfFileWriter
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyPDF2.pdf import PdfFileReader
 import helper_functions
-from pdf_template import PDF
+import instrumentation
+from pdf_template import PDF, StreamingPDF, TOC_CHARACTERS
+from converter_pool import ConverterPool, normalize_engine
+from pdf_cache import PdfCache
+from shard_rendering import render_shards
+from pdf_assembly import StreamingPdfWriter, reader_from_bytes
+from pdf_incremental import append_links
+from pdf_probe import probe_cache, probe_key
+from workspace import Workspace
+from manifest import Manifest
+from fragment_cache import FRAGMENT_GLYPHS, FragmentCache, iter_documents
 from helper_functions import *
-from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QObject
 
 
-def get_toc(files, toc_orientation):
+def get_toc(documents, toc_orientation):
     """
-    Creates a dictionary that has all the chapter names and page numbers from the list of text files
+    Creates a dictionary that has all the chapter names and page numbers from the list of parsed text files
     :param toc_orientation: Parameter that specifies table of contents orientation
-    :param files: list of absolute paths of files
+    :param documents: list of helper_functions.ParsedDocument objects
     :return: returns library where keys are chapter names and values are page numbers where they start
     """
-    chapters = []
-    pages = []
-    for file in files:
-        text = get_text_from_file(file)
-        info_lines = get_info_lines(text)
-        chapter_name_rows = info_lines[settings["TOC level"]:]
-        chapter_name = "\n".join(chapter_name_rows)
-        chapters.append(chapter_name)
-        num_pages = len(get_text_blocks(text))
-        pages.append(num_pages)
+    chapters = [document.chapter_name for document in documents]
+    pages = [document.num_pages for document in documents]
     toc = compile_toc(chapters, pages, orientation=toc_orientation)
     return toc
 
@@ -54,84 +54,135 @@ def change_coordinates(arr, orientation):
     return new
 
 
-### TODO: ABILITY TO CONVERT MULTIPLE FILES WITHOUT CLOSING WORD IN BETWEEN
 def change_filetype(input_file, output_filetype, backend_converter='word', output_file_name=None):
     """
-    Converts the input file to requested filetype and saves it as specified output file. Uses Microsoft Word backend but
-        it is possible to include openoffice support
+    Converts the input file to requested filetype and saves it as specified output file. Starts a new backend
+        instance for the single file, use converter_pool.ConverterPool when converting many files
     :param input_file: Absolute path of the current file
     :param output_filetype: Filetype to convert the input file. Supported filetypes:
         rtf, pdf, docx, doc, html, xml
     :param output_file_name: name and path for output file. If left blank saves in the same folder with same name as input
         file
-    :param backend_converter: What tool to use to convert the files. Options: word or libreoffice
-    :return: Does not return anything
+    :param backend_converter: What tool to use to convert the files. Options: word or libre-office
+    :return: Path of the converted file
     """
+    with ConverterPool(backend_converter, instances=1, cache=PdfCache.from_settings(settings)) as pool:
+        return pool.convert(input_file, output_filetype, output_file_name)
 
-    filetypes = {
-        "rtf": 6,
-        "pdf": 17,
-        "docx": 16,
-        "doc": 0,
-        "html": 8,
-        "xml": 19,
-        "txt": 7,
-        "windows_txt": 3
-    }
-    if output_file_name is None:
-        filename = input_file.split(".")[0]
-        output_file_name = filename + "." + output_filetype
-    if backend_converter == 'word':
-        if output_filetype not in filetypes:
-            raise ValueError("Output filetype not found in supported filetypes.")
-        try:
-            word_backend = comtypes.client.CreateObject("Word.Application")
-            word_backend.Visible = False
-        except:
-            raise RuntimeError("Error setting up Word application")
-        try:
-            document = word_backend.Documents.Open(input_file)
-        except:
-            word_backend.Quit()
-            raise FileNotFoundError("Error opening file: format not supported or file not found")
-        format_number = filetypes[output_filetype]
 
-        time.sleep(2)
-        document.SaveAs(output_file_name, FileFormat=format_number)
-        document.Close()
-        word_backend.Quit()
+def add_rendered_documents(store, names, documents, directory, glyphs=None):
+    """
+    Renders the parsed *.txt files the same way as a full compilation and copies the pages of every file to the store
+    as a fragment of its own
+    :param store: pdf_assembly.FragmentStore or pdf_incremental.IncrementalDocument
+    :param names: Name of the fragment of every document, usually the path of the file
+    :param documents: List of ParsedDocument objects
+    :param directory: Folder for the temporary pdf files
+    :param glyphs: Characters embedded from the font, see PDF
+    :return:
+    """
+    shards = render_shards(documents, settings["Render workers"], directory, glyphs)
+    remaining = iter(zip(names, documents))
+    for shard in shards:
+        with open(shard, 'rb') as stream:
+            reader = PdfFileReader(stream)
+            start = 0
+            while start < reader.getNumPages():
+                name, document = next(remaining)
+                store.add(name, reader, range(start, start + document.num_pages))
+                start += document.num_pages
+        os.remove(shard)
+
+
+def add_converted_files(store, files, pool, directory):
+    """
+    Converts the *.rtf files with the pool and copies the pages of every file to the store as a fragment named by the
+    path of the file
+    :param store: pdf_assembly.FragmentStore or pdf_incremental.IncrementalDocument
+    :param files: List of absolute paths of *.rtf files
+    :param pool: Running ConverterPool
+    :param directory: Folder for the converted files
+    :return: List of (chapter name, page count) tuples of the files
+    """
+    sections = []
+    for file, converted in zip(files, pool.imap(files, "pdf", output_dir=directory)):
+        with open(converted, 'rb') as stream:
+            reader = PdfFileReader(stream)
+            info = probe_cache.probe(probe_key(file, pool.engine), reader)
+            store.add(file, reader)
+        os.remove(converted)
+        sections.append((Converter._get_chapter_name(info.first_page_text, file), info.num_pages))
+    return sections
+
+
+def run_converters(converters, concurrent_jobs=1):
+    """
+    Runs the compilations of several converters in this process, at most concurrent_jobs at a time. Every compilation
+    has its own workspace, so the converters can also share one converter pool set with set_converter_pool. The table
+    of contents has to be accepted without review, from the settings or a TOC file
+    :param converters: Converter objects whose files, filetype and filename have been set
+    :param concurrent_jobs: Number of compilations running at the same time
+    :return: List of exceptions raised by the compilations in the same order as the converters, None when successful
+    """
+    with ThreadPoolExecutor(max(1, concurrent_jobs)) as executor:
+        futures = [executor.submit(converter.convert) for converter in converters]
+    return [future.exception() for future in futures]
 
-    elif backend_converter == "libre-office":
-        os.system(f'soffice --headless --convert-to {output_filetype} {input_file}')
-        # os.system(f'libreoffice --headless --convert-to {output_filetype} {input_file}')
-        # os.system(f'libreoffice6.3 --headless --convert-to {output_filetype} {input_file}')
 
-    else:
-        raise ValueError("Not valid backend converter")
+class Signal:
+    """
+    Calls the connected functions with the emitted values. Has the connect and emit methods of pyqtSignal so the
+    conversion does not need Qt when it is run from the command line
+    """
+
+    def __init__(self):
+        self._slots = []
 
-    return output_file_name
+    def connect(self, slot):
+        self._slots.append(slot)
 
+    def emit(self, *args):
+        for slot in self._slots:
+            slot(*args)
 
-class Converter(QThread):
+
+class Converter:
     """
-    Main class for file conversion. This class is created and controlled by gui.py
+    Main class for file conversion. Created and controlled by cli.py, and by gui.py through gui.QtConverter which
+    replaces the signals with Qt signals
     """
-    finished = pyqtSignal()
-    started = pyqtSignal()
-    progress = pyqtSignal(int)
-    send_toc = pyqtSignal(object)
+    SIGNALS = ("finished", "started", "progress", "send_toc", "send_report")
 
     def __init__(self):
         super().__init__()
+        for name in self.SIGNALS:
+            #  Signals defined by a subclass are kept
+            if not hasattr(type(self), name):
+                setattr(self, name, Signal())
         self.create_toc = True
         self.files = None
         self.filename = None
         self.toc_orientation = "P"
         self.engine = "word"
-        self.trash = []
+        self.toc_accepted = threading.Event()
+        self.converter_pool = None
+        self._reset()
+
+    def _reset(self):
+        """
+        Clears the results of the previous compilation so the same converter can compile other documents
+        :return:
+        """
         self.chapters = []
         self.pages = []
-        self.toc_accepted = False
+        self.toc_dict = None
+        self.toc_accepted.clear()
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self.glyphs = None
+        self.toc_pages = 0
+        self.workspace = None
+        self.report = None
 
     def set_files(self, files):
         self.files = files
@@ -162,6 +213,14 @@ class Converter(QThread):
     def set_engine(self, engine):
         self.engine = engine
 
+    def set_converter_pool(self, converter_pool):
+        """
+        Sets an already running pool of backend converters. If not set the pool is started for each compilation
+        :param converter_pool: converter_pool.ConverterPool instance
+        :return:
+        """
+        self.converter_pool = converter_pool
+
     def filetype_set(self):
         return not (self.filetype is None)
 
@@ -177,39 +236,41 @@ class Converter(QThread):
     def convert(self):
         """
         Main function to make the conversion. When the parameters are set this higher level function calls either
-        rtf creating function or pdf creating function. Also deletes temporary trash files that rtf conversion
-        creates
+        rtf creating function or pdf creating function. Temporary files are written to a workspace of this
+        compilation that is removed afterwards, so the converter can be used again and several converters can run at
+        the same time. A manifest of the sections is written next to the document, see manifest.py. With
+        "Instrumentation" enabled the stages of the compilation are measured and the report is written next to the
+        document and sent with send_report, see instrumentation.py
         :return:
         """
         if not self.filetype or not self.files:
             raise ValueError("Filetype, filename or files has not been set")
-        if self.filetype == "rtf":
-            self._create_pdf_from_rtf_files()
-            if self.create_toc:
-                self.create_toc_pdf_and_append_it()
-
-        elif self.filetype == "txt":
-            self._create_pdf_from_txt_files()
-        else:
-            raise ValueError("Filetype not set")
-        self._delete_trash()
+        self._reset()
+        with instrumentation.activate(settings["Instrumentation"]) as recorder:
+            self.workspace = Workspace.from_settings(settings)
+            try:
+                if self.filetype == "rtf":
+                    self._create_pdf_from_rtf_files()
+                elif self.filetype == "txt":
+                    self._create_pdf_from_txt_files()
+                else:
+                    raise ValueError("Filetype not set")
+            finally:
+                self.workspace.cleanup()
+            if settings["Section manifest"]:
+                with instrumentation.stage("manifest"):
+                    Manifest.from_compilation(self.filetype, self.files, self.chapters, self.pages, self.toc_pages,
+                                              self.toc_orientation).save(self.filename)
+        if recorder.enabled:
+            self.report = recorder.report(document=self.filename, filetype=self.filetype, num_files=len(self.files),
+                                          num_pages=self.toc_pages + sum(self.pages),
+                                          document_size=os.path.getsize(self.filename), duplicates=self.duplicates,
+                                          bytes_saved=self.bytes_saved)
+            instrumentation.save_report(self.report, instrumentation.report_path(self.filename))
+            self.send_report.emit(self.report)
         self.progress.emit(self.get_num_files() + 1)
         self.finished.emit()
 
-    def _delete_trash(self):
-        """
-        Deletes the temporary files created by conversions. At the moment only *.rtf file conversion creates temporary
-        files
-        :return:
-        """
-        for file in self.trash:
-            try:
-                os.remove(file)
-            except FileNotFoundError:
-                path = os.path.abspath(".")
-                file = path + "/" + file
-                os.remove(file)
-
     def converter_ready(self):
         return self.files_set() and self.filename_set() and self.filetype_set()
 
@@ -218,147 +279,365 @@ class Converter(QThread):
         Main function to create pdf file from set of rtf files. Adding the hyperlinks is done by other function
         :return:
         """
-        pdfs = []
-        self.progress.emit(0)
-        for count, file in enumerate(self.files):
-            #  Changes the rtf tiles to pdf files using change_filetype helper function
-            changed_file = change_filetype(file, "pdf", self.engine)
-            pdfs.append(changed_file)
-            self.progress.emit(count + 1)
-        merger = PdfFileMerger()
+        #  Table of contents uses its own font subset since the fonts of the converted files are different
+        self.glyphs = None
         pages = []
         chapters = []
-        for file in pdfs:
-            #  Loop for appending the created pdf files together.
-            read_pdf = PdfFileReader(file)
-            txt = read_pdf.getPage(0)
-            page_content = txt.extractText()
-            try:
-                #  Tries to get "chapter name from the text contents of the pdf
-                chapter = helper_functions.get_chapter_from_pdf_txt(page_content)
-                chapters.append(chapter)
-            except:
-                #  If it doesn't find any "chapter" names from the pdf text then it pulls the chapter name from the
-                #  name of the pdf
-                chapter = os.path.basename(file)
-                chapter = chapter.split(".")[0]
-                chapter = chapter.replace("_", " ")
-                chapters.append(chapter)
-
-            pages.append(read_pdf.getNumPages())
-            merger.append(fileobj=file)
-        self.pages = pages
-        self.chapters = chapters
-        if not self.create_toc:
-            merger.write(self.master_file_name)
-        else:
-            merger.write("tmp.pdf")
-        merger.close()
-        self.trash += pdfs
+        self.progress.emit(0)
+        pool = self.converter_pool
+        if pool is None or pool.engine != normalize_engine(self.engine):
+            pool = ConverterPool(self.engine, instances=settings["Converter instances"],
+                                 cache=PdfCache.from_settings(settings))
+        try:
+            with StreamingPdfWriter(self.filename, deduplicate=settings["Deduplicate resources"]) as writer:
+                converted = pool.imap(self.files, "pdf", output_dir=self.workspace.path)
+                for count, rtf_file in enumerate(self.files):
+                    #  Changes the rtf tiles to pdf files in the workspace with the warm backend converter instances.
+                    #  Files are returned in the original order and each one is copied to the final document and
+                    #  closed while the next files are still converting, so only one converted file is open at a time.
+                    #  The page count and the chapter name are probed with the same reader that copies the pages, so
+                    #  objects read by the probe are not read again. Conversion time of a file is the time waited for
+                    #  it, the other instances convert the next files meanwhile
+                    with instrumentation.stage("convert", rtf_file) as measurement:
+                        file = next(converted)
+                        measurement.file_read(rtf_file)
+                        measurement.file_written(file)
+                    with open(file, 'rb') as stream:
+                        read_pdf = PdfFileReader(stream)
+                        with instrumentation.stage("probe", rtf_file) as measurement:
+                            info = probe_cache.probe(probe_key(rtf_file, pool.engine), read_pdf)
+                            chapters.append(self._get_chapter_name(info.first_page_text, rtf_file))
+                            pages.append(info.num_pages)
+                        instrumentation.count("convert", rtf_file, pages=info.num_pages)
+                        with instrumentation.stage("merge", rtf_file, output=writer) as measurement:
+                            writer.add_document(read_pdf)
+                            measurement.file_read(file)
+                            measurement.pages += info.num_pages
+                    #  Converted file is not needed anymore
+                    os.remove(file)
+                    self.progress.emit(count + 1)
+                self.pages = pages
+                self.chapters = chapters
+                if self.create_toc:
+                    self._propose_toc()
+                    self.create_toc_pdf_and_append_it(writer)
+                with instrumentation.stage("write", output=writer):
+                    writer.close()
+            self._report_deduplication(writer)
+        finally:
+            if pool is not self.converter_pool:
+                pool.close()
+
+    @staticmethod
+    def _get_chapter_name(page_content, file):
+        """
+        Gets the "chapter" name from the text of the first page of converted pdf file
+        :param page_content: Text of the first page
+        :param file: Path of the file
+        :return: Chapter name
+        """
+        try:
+            #  Tries to get "chapter name from the text contents of the pdf
+            return helper_functions.get_chapter_from_pdf_txt(page_content)
+        except:
+            #  If it doesn't find any "chapter" names from the pdf text then it pulls the chapter name from the
+            #  name of the pdf
+            chapter = os.path.basename(file)
+            chapter = chapter.split(".")[0]
+            return chapter.replace("_", " ")
 
     def _create_pdf_from_txt_files(self):
         """
         Main function from creating the pdf file from *.txt files. Called by convert()
         :return:
         """
-        pdf = PDF()
-        pdf.set_title("")
+        cache = FragmentCache.from_settings(settings)
+        if cache is not None:
+            self._create_pdf_from_cached_txt_files(cache)
+            return
+        #  Every file is read and parsed only once. When the table of contents is created all files are parsed first
+        #  and the same parsed documents are used for the pages
+        documents = parse_documents(self.files, settings["Parser workers"], settings["Parser chunk size"])
+        #  With one render worker or one file the pages are rendered straight to the document
+        sharded = min(settings["Render workers"] or os.cpu_count() or 1, len(self.files)) > 1
+        if self.create_toc or sharded:
+            with instrumentation.stage("parse"):
+                documents = list(documents)
+            instrumentation.count_documents("parse", documents, read=True)
+            if sharded:
+                self._create_pdf_from_txt_shards(documents)
+                return
+            self.chapters = [document.chapter_name for document in documents]
+            self.pages = [document.num_pages for document in documents]
+            #  The user reviews the table of contents while the pages are rendered
+            self._propose_toc()
+
+        #  Pages are written to the file as soon as they are finished so memory use does not grow with the page count
+        with StreamingPDF(self.filename) as pdf:
+            pdf.set_title("")
+            for count, file in enumerate(self.files):
+                #  Loop creating the pages of the pdf file from the parsed *.txt files and sending them to
+                #  pdf_template class. Without the table of contents files are parsed while the pages are created and
+                #  the time waited for the parsed file is measured
+                if self.create_toc:
+                    document = documents[count]
+                    #  Text of the file is not kept after its pages are rendered
+                    documents[count] = None
+                else:
+                    with instrumentation.stage("parse", file) as measurement:
+                        document = next(documents)
+                        measurement.file_read(file)
+                        measurement.pages += document.num_pages
+                    self.chapters.append(document.chapter_name)
+                    self.pages.append(document.num_pages)
+                self.progress.emit(count + 1)
+                with instrumentation.stage("render", file, output=pdf) as measurement:
+                    pdf.print_document(document)
+                    measurement.pages += document.num_pages
+            if self.create_toc:
+                self._add_toc_pages(pdf)
+            with instrumentation.stage("write", output=pdf):
+                pdf.close()
 
+    def _add_toc_pages(self, pdf):
+        """
+        Writes the accepted table of contents after the text pages and moves its pages in front of them. The
+        hyperlinks are written by FPDF with the pages, so the written pages are not read again
+        :param pdf: StreamingPDF that has the text pages
+        :return:
+        """
+        with instrumentation.stage("toc_review"):
+            self._wait_for_toc()
+
+        with instrumentation.stage("toc", output=pdf) as measurement:
+            #  Links need the page they lead to before their page is written, so the pages of the table of contents
+            #  are counted first
+            counter = PDF()
+            counter.table_of_contents(self.toc_dict, orientation=self.toc_orientation, create_hyperlink=False)
+            toc_pages = counter.page
+            first_page = pdf.page + 1
+
+            def link_page(page_number):
+                #  Page numbers of the table of contents count its own pages, which are written after the text pages
+                if page_number > toc_pages:
+                    return page_number - toc_pages
+                return first_page + page_number - 1
+
+            pdf.table_of_contents(self.toc_dict, orientation=self.toc_orientation, link_pages=link_page)
+            pdf.move_to_front(first_page)
+            self.toc_pages = pdf.page - first_page + 1
+            measurement.pages += self.toc_pages
+
+    def _create_pdf_from_txt_shards(self, documents):
+        """
+        Renders contiguous runs of the parsed *.txt files into separate temporary pdf files in parallel worker
+        processes. The table of contents is proposed before rendering so the pages are rendered while the user reviews
+        it. The table of contents and its hyperlinks are then added the same way as in rtf conversion
+        :param documents: List of ParsedDocument objects
+        :return:
+        """
+        self.chapters = [document.chapter_name for document in documents]
+        self.pages = [document.num_pages for document in documents]
+        #  Every shard and the table of contents embed the same subset of the font, which is then written only once
+        #  to the final document
+        self.glyphs = set(TOC_CHARACTERS).union(*(document.characters for document in documents))
         if self.create_toc:
-            #  Extracts table of contents from "chapter names" and sends it for confirmation to gui.py. Also creates
-            #  the table of contents page
-            self.toc_dict = get_toc(self.files, self.toc_orientation)
-            self.send_toc.emit(self.toc_dict)
-
-            while not self.toc_accepted:
-                # Waits for user confirmation
-                time.sleep(1)
-                pass
-            pdf.table_of_contents(self.toc_dict, orientation=self.toc_orientation)
-
-        for count, file in enumerate(self.files):
-            #  Loop creating the pages of the pdf file from *.txt files. Loops files, gets the text then gets required
-            #  information from the given text and sends it to pdf_template class
-            text = get_text_from_file(file)
-            info_text = get_info_lines(text)
-            header_text = "\n".join(info_text[0:settings["TOC level"]])
-            pdf.set_title(header_text.strip())
-            program_info = get_program_info(text)
-            chapter_name = "\n".join(info_text[settings["TOC level"]:])
-            self.progress.emit(count + 1)
-
-            for block in get_text_blocks(text):
-                pdf.print_chapter(chapter_title=chapter_name.strip(), text_body=block,
-                                  footer_text=program_info.strip())
-        pdf.output(self.filename, 'F')
-
-    def create_toc_pdf_and_append_it(self):
-        """
-        Appends table of contents pdf and the text pages together. Then calls function to add the hyperlinks to the
-        the hyperlinks to table of contents. Only used by rtf conversion
+            self._propose_toc()
+        with instrumentation.stage("render") as measurement:
+            shards = render_shards(documents, settings["Render workers"], self.workspace.path, self.glyphs,
+                                   progress=self.progress.emit)
+            for shard in shards:
+                measurement.file_written(shard)
+        instrumentation.count_documents("render", documents)
+        with StreamingPdfWriter(self.filename, deduplicate=settings["Deduplicate resources"]) as writer:
+            with instrumentation.stage("merge", output=writer) as measurement:
+                for shard in shards:
+                    with open(shard, 'rb') as stream:
+                        writer.add_document(PdfFileReader(stream))
+                    measurement.file_read(shard)
+                    os.remove(shard)
+                measurement.pages += sum(self.pages)
+            if self.create_toc:
+                self.create_toc_pdf_and_append_it(writer)
+            with instrumentation.stage("write", output=writer):
+                writer.close()
+        self._report_deduplication(writer)
+
+    def _create_pdf_from_cached_txt_files(self, cache):
+        """
+        Builds the document from the pages of the *.txt files rendered by earlier compilations, see fragment_cache.py.
+        Only the files not found from the cache are parsed and rendered, and then added to the cache. Every file is
+        written to the document as soon as it is loaded or rendered and dropped before the next one, so memory use
+        does not grow with the size of the package
+        :param cache: FragmentCache
         :return:
         """
-        link_locations, page_locations = self._create_toc_pdf_for_rtf()
-        link_locations = [change_coordinates(x, self.toc_orientation) for x in link_locations]  # Coordinate change
-        merger = PdfFileMerger()
-        merger.append("toc.pdf")
-        merger.append("tmp.pdf")
-        merger.write("tmp2.pdf")
-        merger.close()
+        chapters = [None] * len(self.files)
+        pages = [0] * len(self.files)
+        body = [None] * len(self.files)
+        with StreamingPdfWriter(self.filename, deduplicate=settings["Deduplicate resources"]) as writer:
+            #  Files come in the order they are loaded or rendered, their pages are put in the order of the files
+            #  when all have been written
+            for index, document in iter_documents(self.files, cache, self.workspace.path, self.progress.emit):
+                with instrumentation.stage("merge", self.files[index], output=writer) as measurement:
+                    body[index] = writer.add_fragment(document.fragment)
+                    measurement.pages += document.num_pages
+                chapters[index] = document.chapter_name
+                pages[index] = document.num_pages
+            for numbers in body:
+                writer.pages.extend(numbers)
+            self.chapters = chapters
+            self.pages = pages
+            #  Table of contents embeds the same font subset as the fragments when the chapter names have no other
+            #  characters
+            self.glyphs = FRAGMENT_GLYPHS.union(*self.chapters)
+            if self.create_toc:
+                self._propose_toc()
+                self.create_toc_pdf_and_append_it(writer)
+            with instrumentation.stage("write", output=writer):
+                writer.close()
+        self._report_deduplication(writer)
 
-        self._create_hyperlinks(link_locations, page_locations)
+    def assemble_fragments(self, store, names, chapters, pages, glyphs=None):
+        """
+        Builds the document from pages copied earlier to a pdf_assembly.FragmentStore, one fragment for every input
+        file, and adds the table of contents compiled from the chapters and page counts of the fragments. Nothing is
+        rendered or converted again except the table of contents. Used by watch.py and section_update.py
+        :param store: FragmentStore or pdf_incremental.IncrementalDocument that has the fragments
+        :param names: Names of the fragments in document order
+        :param chapters: Chapter name of every fragment
+        :param pages: Page count of every fragment
+        :param glyphs: Characters of the font subset embedded in the fragments, None for converted *.rtf files
+        :return:
+        """
+        self._reset()
+        self.chapters = list(chapters)
+        self.pages = list(pages)
+        self.glyphs = glyphs
+        self._write_fragments(store, names)
 
-        self.trash += ["tmp.pdf", "tmp2.pdf", "toc.pdf"]
+    def _write_fragments(self, store, names):
+        """
+        Writes the document from the fragments of the store with the table of contents in front of them
+        :param store: FragmentStore or pdf_incremental.IncrementalDocument
+        :param names: Names of the fragments in document order
+        :return:
+        """
+        if self.create_toc:
+            self._propose_toc()
+        with store.open(self.filename, names) as writer:
+            if self.create_toc:
+                self.create_toc_pdf_and_append_it(writer)
+            with instrumentation.stage("write", output=writer):
+                writer.close()
+        self._report_deduplication(writer)
+
+    def _report_deduplication(self, writer):
+        """
+        Records how much smaller the final document got by sharing identical fonts, images and other resources. Shown
+        by the gui and the command line when the compilation is finished, see deduplication_summary, and added to the
+        instrumentation report
+        :param writer: Closed StreamingPdfWriter
+        :return:
+        """
+        self.duplicates = writer.duplicates
+        self.bytes_saved = writer.bytes_saved
+
+    def deduplication_summary(self):
+        """
+        Returns a line telling how many duplicate resources the last compilation shared, or None if it shared none
+        """
+        if not self.duplicates:
+            return None
+        return f"Shared {self.duplicates} duplicate resources, saved {self.bytes_saved / 1024:.1f} kB"
+
+    def create_toc_pdf_and_append_it(self, writer):
+        """
+        Creates the table of contents once the user has accepted it and inserts it with the hyperlinks in front of the
+        body pages. Used by rtf conversion, sharded and cached txt conversion and _write_fragments
+        :param writer: StreamingPdfWriter, FragmentStore or IncrementalDocument that has the body pages
+        :return:
+        """
+        toc_pdf, link_locations, page_locations, toc_pages = self._create_toc_pdf()
+        with instrumentation.stage("hyperlinks"):
+            link_locations = [change_coordinates(x, self.toc_orientation) for x in link_locations]  # Coordinate change
+            links = self._create_hyperlinks(link_locations, page_locations, toc_pages)
+        toc_reader = reader_from_bytes(toc_pdf)
+        self.toc_pages = toc_reader.getNumPages()
+        if settings["Incremental hyperlinks"]:
+            #  Links are appended to the written file so only the table of contents pages are written again
+            with instrumentation.stage("merge", output=writer) as measurement:
+                writer.add_document(toc_reader, index=0)
+                measurement.pages += self.toc_pages
+            with instrumentation.stage("write", output=writer):
+                writer.close()
+            with instrumentation.stage("hyperlinks") as measurement:
+                measurement.bytes_written += append_links(self.filename, links)
+        else:
+            with instrumentation.stage("merge", output=writer) as measurement:
+                writer.add_document(toc_reader, index=0, links=links)
+                measurement.pages += self.toc_pages
 
     def set_toc_dict(self, toc_dict):
         self.toc_dict = toc_dict
 
     def accept_toc(self):
-        self.toc_accepted = True
+        self.toc_accepted.set()
 
-    def _create_hyperlinks(self, link_locations, page_locations):
+    def _propose_toc(self):
         """
-        Helper function for appending the hyperlinks. Loops through the the links and adds them to the table of contents
-        page. Only used by rtf conversion
-        :param link_locations:
-        :param page_locations:
+        Compiles the table of contents from the chapters and page counts. The table of contents is loaded from the
+        file set in settings or accepted as is when running unattended, otherwise it is sent to gui.py for the user to
+        review. Does not wait for the confirmation, see _wait_for_toc
         :return:
         """
-        reader = PdfFileReader("tmp2.pdf")
-        writer = PdfFileWriter()
-        for i in range(reader.getNumPages()):
-            #  We need to read the temporary pdf and then append the links to it. This could also be moved to create_
-            #  toc_and_append_it function but the function grows a bit too large.
-            page = reader.getPage(i)
-            writer.addPage(page)
-        for i in range(len(link_locations)):
-            toc_page = 1
-            #  If statements give the page in which to add the hyperlink
-            if self.toc_orientation == "P":
-                toc_page = math.floor(i / settings["Items on vertical toc"])
-            if self.toc_orientation == "L":
-                toc_page = math.floor(i / settings["Items on horizontal toc"])
-            writer.addLink(pagenum=toc_page, pagedest=page_locations[i] - 1, rect=link_locations[i], fit="/Fit",
-                           border=[0, 0, 0])
-        with open(self.filename, 'wb') as out:
-            writer.write(out)
-
-    def _create_toc_pdf_for_rtf(self):
-        """
-        Super short helper function for creating the table of contents page for the rtf conversion. Functionality could/
-        should be moved to other funtion
+        toc = compile_toc(list(self.chapters), list(self.pages), orientation=self.toc_orientation)
+        if settings["TOC file"]:
+            with open(settings["TOC file"], "r") as file:
+                self.set_toc_dict(parse_toc_text(file.read()))
+            self.accept_toc()
+        elif settings["Auto accept TOC"]:
+            self.set_toc_dict(toc)
+            self.accept_toc()
+        else:
+            self.send_toc.emit(toc)
+
+    def _wait_for_toc(self):
+        """
+        Blocks until the table of contents has been accepted
         :return:
         """
-        toc = compile_toc(self.chapters, self.pages, orientation=self.toc_orientation)
-        self.send_toc.emit(toc)
-        while not self.toc_accepted:  # Waits for user confirmation
-            time.sleep(1)
-
-        pdf = PDF()
-        pdf.set_title("")
-        pdf.table_of_contents(self.toc_dict, orientation=self.toc_orientation, create_hyperlink=False)
-        pdf.output("toc.pdf", 'F')
-        link_locations, page_locations = pdf.get_link_locations()
-        pdf.close()
-        time.sleep(2)
-        return link_locations, page_locations
+        self.toc_accepted.wait()
+
+    @staticmethod
+    def _create_hyperlinks(link_locations, page_locations, toc_pages):
+        """
+        Helper function for creating the hyperlinks. Gives every link the table of contents page where it is and the
+        page where it leads to
+        :param link_locations: Link rectangles in pdf coordinates
+        :param page_locations: Page numbers where the links lead
+        :param toc_pages: Table of contents page of every link, see PDF.get_link_locations
+        :return: List of (page index of link, page index of destination, rectangle) tuples
+        """
+        return [(toc_page, page - 1, location)
+                for location, page, toc_page in zip(link_locations, page_locations, toc_pages)]
+
+    def _create_toc_pdf(self):
+        """
+        Super short helper function for creating the table of contents pages in memory after the user has accepted
+        the table of contents. Functionality could/should be moved to other funtion
+        :return: Table of contents pdf as bytes, link locations, page numbers where the links lead and table of
+            contents pages of the links
+        """
+        with instrumentation.stage("toc_review"):
+            self._wait_for_toc()
+
+        with instrumentation.stage("toc") as measurement:
+            pdf = PDF(glyphs=self.glyphs)
+            pdf.set_title("")
+            pdf.table_of_contents(self.toc_dict, orientation=self.toc_orientation, create_hyperlink=False)
+            toc_pdf = pdf.output(dest='S').encode("latin1")
+            link_locations, page_locations, toc_pages = pdf.get_link_locations()
+            measurement.pages += pdf.page_no()
+            measurement.bytes_written += len(toc_pdf)
+        return toc_pdf, link_locations, page_locations, toc_pages
@@ -0,0 +1,115 @@
+"""
+Manifest of a compiled document. Lists the sections of the document, one for every input file, with the chapter name,
+the hash of the input file and the pages of the section, and tells how many table of contents pages are in front of
+them. Written next to the document so sections can later be inserted, replaced or removed without compiling the whole
+document again, see section_update.py
+"""
+import json
+import os
+from pdf_cache import hash_file
+
+# Bump when the format changes in a way that older versions can't read
+MANIFEST_VERSION = 1
+
+
+def manifest_path(pdf_file):
+    """
+    Returns path of the manifest file of the document
+    """
+    return os.path.splitext(pdf_file)[0] + ".manifest.json"
+
+
+class Section:
+    """
+    Pages of one input file in the document
+    """
+
+    def __init__(self, file, chapter_name, digest, first_page, num_pages):
+        self.file = file
+        self.chapter_name = chapter_name
+        self.digest = digest
+        #  Page numbers start from one at the first page of the document, table of contents included
+        self.first_page = first_page
+        self.num_pages = num_pages
+
+    def page_indexes(self):
+        """
+        Returns indexes of the pages of the section starting from zero
+        """
+        return range(self.first_page - 1, self.first_page - 1 + self.num_pages)
+
+    def to_dict(self):
+        return {"file": self.file, "chapter": self.chapter_name, "hash": self.digest,
+                "pages": [self.first_page, self.first_page + self.num_pages - 1]}
+
+    @classmethod
+    def from_dict(cls, data):
+        first, last = data["pages"]
+        return cls(data["file"], data["chapter"], data["hash"], first, last - first + 1)
+
+
+class Manifest:
+    """
+    Sections of a compiled document in document order
+    """
+
+    def __init__(self, filetype, sections, toc_pages=0, toc_orientation="P", pdf_size=None):
+        self.filetype = filetype
+        self.sections = sections
+        self.toc_pages = toc_pages
+        self.toc_orientation = toc_orientation
+        #  Size of the document the manifest was written for, to notice when the document has been replaced
+        self.pdf_size = pdf_size
+
+    @classmethod
+    def from_compilation(cls, filetype, files, chapters, pages, toc_pages, toc_orientation, digests=None):
+        """
+        Creates the manifest from the input files of a compilation and their chapter names and page counts
+        :param digests: Optional dictionary of file: hash for files already hashed. Other files are hashed now
+        :return: Manifest
+        """
+        digests = digests or {}
+        sections = []
+        first_page = toc_pages + 1
+        for file, chapter, num_pages in zip(files, chapters, pages):
+            digest = digests[file] if file in digests else hash_file(file)
+            sections.append(Section(file, chapter, digest, first_page, num_pages))
+            first_page += num_pages
+        return cls(filetype, sections, toc_pages, toc_orientation)
+
+    @property
+    def num_pages(self):
+        return self.toc_pages + sum(x.num_pages for x in self.sections)
+
+    def save(self, pdf_file):
+        """
+        Writes the manifest next to the document
+        :param pdf_file: Path of the compiled document
+        :return: Path of the manifest file
+        """
+        self.pdf_size = os.path.getsize(pdf_file)
+        path = manifest_path(pdf_file)
+        data = {"version": MANIFEST_VERSION, "filetype": self.filetype, "toc_pages": self.toc_pages,
+                "toc_orientation": self.toc_orientation, "pdf_size": self.pdf_size,
+                "sections": [x.to_dict() for x in self.sections]}
+        with open(path, "w") as file:
+            json.dump(data, file, indent=4)
+        return path
+
+    @classmethod
+    def load(cls, pdf_file):
+        """
+        Reads the manifest of the document
+        :param pdf_file: Path of the compiled document
+        :return: Manifest
+        :raises ValueError: When the manifest is from another version or does not match the document
+        """
+        with open(manifest_path(pdf_file), "r") as file:
+            data = json.load(file)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError("Manifest was written by another version of the program")
+        manifest = cls(data["filetype"], [Section.from_dict(x) for x in data["sections"]], data["toc_pages"],
+                       data["toc_orientation"], data["pdf_size"])
+        if manifest.pdf_size != os.path.getsize(pdf_file):
+            raise ValueError("Document has changed since the manifest was written, compile it again")
+        return manifest
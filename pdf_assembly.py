@@ -0,0 +1,615 @@
+import hashlib
+import os
+from array import array
+from io import BytesIO
+from PyPDF2.generic import ArrayObject, DictionaryObject, FloatObject, IndirectObject, NameObject, NullObject, \
+    NumberObject, StreamObject
+from PyPDF2.pdf import PdfFileReader
+
+# Dictionaries of these types are shared between documents when they are identical. Streams and arrays are always
+# shared. Other dictionaries, for example pages and annotations, must stay separate objects
+SHARED_TYPES = ("/Font", "/FontDescriptor", "/Encoding", "/ExtGState")
+# Dictionaries without a type that are shared, CIDSystemInfo of CID fonts is identified by its /Registry entry
+SHARED_KEYS = ("/Registry",)
+# Attributes a page inherits from the nodes of the page tree above it
+INHERITED_ATTRIBUTES = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+def reader_from_bytes(pdf_bytes):
+    """
+    Opens pdf document that is kept in memory
+    :param pdf_bytes: Contents of the pdf file
+    :return: PdfFileReader
+    """
+    return PdfFileReader(BytesIO(pdf_bytes))
+
+
+def source_pages(reader, pages=None):
+    """
+    Returns the pages of the document. When every page is a direct child of the root of the page tree, like in the
+    files written by FPDF, Word and LibreOffice, the pages are read from the /Kids of the root and get the attributes
+    they inherit from it. Otherwise the page tree is flattened with PdfFileReader.getPage, which loads every page
+    :param reader: PdfFileReader of the document
+    :param pages: Indexes of the pages, by default all pages
+    :return: List of (IndirectObject, DictionaryObject) tuples
+    """
+    root = reader.trailer["/Root"]["/Pages"]
+    if "/Kids" in root and "/Count" in root and len(root["/Kids"]) == int(root["/Count"]):
+        kids = root["/Kids"]
+        inherited = {NameObject(key): root.raw_get(key) for key in INHERITED_ATTRIBUTES if key in root}
+        found = []
+        for i in (range(len(kids)) if pages is None else pages):
+            page = kids[i].getObject()
+            if page.get("/Type") == "/Pages":
+                #  Deeper page tree whose node counts happen to match
+                break
+            copy = DictionaryObject(inherited)
+            copy.update(page)
+            found.append((kids[i], copy))
+        else:
+            return found
+    if pages is None:
+        pages = range(reader.getNumPages())
+    return [(page.indirectRef, page) for page in (reader.getPage(i) for i in pages)]
+
+
+def link_annotation(page_destination, rect):
+    """
+    Creates link annotation that opens the destination page fitted to the window
+    :param page_destination: Indirect reference to the destination page
+    :param rect: Rectangle of the link in pdf coordinates
+    :return: DictionaryObject
+    """
+    annotation = DictionaryObject()
+    annotation[NameObject("/Type")] = NameObject("/Annot")
+    annotation[NameObject("/Subtype")] = NameObject("/Link")
+    annotation[NameObject("/Rect")] = ArrayObject([FloatObject(x) for x in rect])
+    annotation[NameObject("/Border")] = ArrayObject([NumberObject(0), NumberObject(0), NumberObject(0)])
+    annotation[NameObject("/Dest")] = ArrayObject([page_destination, NameObject("/Fit")])
+    return annotation
+
+
+class PdfCopier:
+    """
+    Copies pages of pdf documents and the objects they use with new object numbers. How the copied objects are
+    stored is decided by the subclass in _write_object. Only the object numbers of the pages are kept in a compact
+    array.
+
+    Documents can also be inserted in front of the pages already copied, which is how the table of contents is
+    added after the body pages.
+
+    Identical fonts, images and other shared resources are copied only once. Every shareable object is hashed after
+    its references have been changed to point to the copied objects, so for example two fonts are identical when
+    their font files and widths are identical. duplicates and bytes_saved tell how much was saved
+    """
+
+    def __init__(self, deduplicate=True, pages_ref=None):
+        """
+        :param deduplicate: Copies identical shareable objects only once
+        :param pages_ref: Root of the page tree that the copied pages are added to. A new object by default
+        """
+        #  Offset of object n is at index n - 1
+        self._offsets = array("Q")
+        self._mapping = {}
+        self.pages = array("L")
+        self._pages_ref = pages_ref if pages_ref is not None else self._allocate()
+        self.deduplicate = deduplicate
+        self._digests = {}
+        self.duplicates = 0
+        self.bytes_saved = 0
+
+    def _allocate(self):
+        self._offsets.append(0)
+        return IndirectObject(len(self._offsets), 0, None)
+
+    def _write_object(self, reference, obj, data=None):
+        """
+        Stores the copied object
+        :param reference: Number of the object
+        :param obj: Copied object
+        :param data: Object already serialized, if available
+        """
+        raise NotImplementedError
+
+    def _write_serialized(self, number, data, references):
+        """
+        Stores an object of a Fragment that has been given its final references
+        :param number: Number of the object
+        :param data: Serialized object
+        :param references: Numbers of the objects it refers to
+        """
+        raise NotImplementedError
+
+    def _copy_fragment(self, fragment):
+        """
+        Gives the objects of a Fragment their numbers in this document and stores them with _write_serialized.
+        Shareable objects identical to objects already copied are not stored again
+        :param fragment: Fragment
+        :return: Tuple of the page numbers, the number of duplicates left out and their size
+        """
+        #  Local number 1 is the root of the page tree of the fragment
+        mapping = {1: self._pages_ref.idnum}
+        #  Objects referenced before they were added, in reference cycles or pages, keep the number they got first
+        reserved = set()
+        duplicates, bytes_saved = fragment.duplicates, fragment.bytes_saved
+
+        def number(local):
+            if local not in mapping:
+                mapping[local] = self._allocate().idnum
+                reserved.add(local)
+            return mapping[local]
+
+        for local, data, references, shareable in fragment.objects:
+            pieces = []
+            start = 0
+            for offset, reference in references:
+                pieces.append(data[start:offset])
+                pieces.append(b"%d 0 R" % number(reference))
+                start = offset
+            pieces.append(data[start:])
+            data = b"".join(pieces)
+            if shareable and self.deduplicate and local not in reserved:
+                digest = hashlib.sha256(data).digest()
+                if digest in self._digests:
+                    mapping[local] = self._digests[digest]
+                    duplicates += 1
+                    bytes_saved += len(data)
+                    continue
+                self._digests[digest] = number(local)
+            self._write_serialized(number(local), data, tuple(mapping[reference] for _, reference in references))
+        return array("L", [mapping[x] for x in fragment.pages]), duplicates, bytes_saved
+
+    def _write_trailer(self, out):
+        """
+        Writes the page tree, the catalog, the cross-reference table and the trailer after the objects. Objects whose
+        offset is zero are written as free entries
+        :param out: Output file
+        :return:
+        """
+        #  Page tree is written directly so the list of kids does not have to be built from objects
+        self._offsets[self._pages_ref.idnum - 1] = out.tell()
+        out.write(f"{self._pages_ref.idnum} 0 obj\n<< /Type /Pages /Count {len(self.pages)} /Kids [".encode())
+        for number in self.pages:
+            out.write(f" {number} 0 R".encode())
+        out.write(b" ] >>\nendobj\n")
+        root = self._allocate()
+        catalog = DictionaryObject()
+        catalog[NameObject("/Type")] = NameObject("/Catalog")
+        catalog[NameObject("/Pages")] = self._pages_ref
+        self._offsets[root.idnum - 1] = out.tell()
+        out.write(f"{root.idnum} 0 obj\n".encode())
+        catalog.writeToStream(out, None)
+        out.write(b"\nendobj\n")
+
+        xref_offset = out.tell()
+        out.write(f"xref\n0 {len(self._offsets) + 1}\n0000000000 65535 f \n".encode())
+        for offset in self._offsets:
+            out.write(f"{offset:010d} 00000 n \n".encode() if offset else b"0000000000 00001 f \n")
+        trailer = DictionaryObject()
+        trailer[NameObject("/Size")] = NumberObject(len(self._offsets) + 1)
+        trailer[NameObject("/Root")] = root
+        out.write(b"trailer\n")
+        trailer.writeToStream(out, None)
+        out.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+
+    @staticmethod
+    def _shareable(obj):
+        if isinstance(obj, (StreamObject, ArrayObject)):
+            return True
+        return isinstance(obj, DictionaryObject) and (obj.get("/Type") in SHARED_TYPES
+                                                      or any(key in obj for key in SHARED_KEYS))
+
+    def _copy(self, obj):
+        """
+        Returns copy of a direct object where the indirect references point to the copied objects. Referenced objects
+        that are not yet copied are written first
+        """
+        if isinstance(obj, IndirectObject):
+            return self._copy_indirect(obj)
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+        elif isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject([self._copy(x) for x in obj])
+        else:
+            return obj
+        for key, value in obj.items():
+            copy[key] = self._copy(value)
+        return copy
+
+    def _copy_indirect(self, reference):
+        key = (reference.idnum, reference.generation)
+        if key in self._mapping:
+            if self._mapping[key] is None:
+                #  Reference back to an object whose copy is not finished, the number is reserved now
+                self._mapping[key] = self._allocate()
+            return self._mapping[key]
+        self._mapping[key] = None
+        obj = reference.getObject()
+        copy = NullObject() if obj is None else self._copy(obj)
+        if self._mapping[key] is not None or not (self.deduplicate and self._shareable(copy)):
+            #  Objects in reference cycles are not shared because their number was needed before they were complete
+            if self._mapping[key] is None:
+                self._mapping[key] = self._allocate()
+            self._write_object(self._mapping[key], copy)
+            return self._mapping[key]
+        buffer = BytesIO()
+        copy.writeToStream(buffer, None)
+        data = buffer.getvalue()
+        digest = hashlib.sha256(data).digest()
+        if digest in self._digests:
+            self.duplicates += 1
+            self.bytes_saved += len(data)
+            self._mapping[key] = IndirectObject(self._digests[digest], 0, None)
+            return self._mapping[key]
+        self._mapping[key] = self._allocate()
+        self._digests[digest] = self._mapping[key].idnum
+        self._write_object(self._mapping[key], copy, data)
+        return self._mapping[key]
+
+    def add_document(self, reader, index=None, links=(), pages=None):
+        """
+        Copies all pages of the document and the objects they use. The reader is not needed after this and can be
+        closed
+        :param reader: PdfFileReader of the document
+        :param index: Position of the first page in the final document. Pages are added to the end by default
+        :param links: List of (page index in this document, page index of destination in the final document,
+            rectangle) tuples of link annotations added to the pages
+        :param pages: Indexes of the pages copied, by default all pages
+        :return:
+        """
+        document_pages = source_pages(reader, pages)
+        references = []
+        for source, page in document_pages:
+            #  Page numbers are reserved first so links between the pages of the document can refer to them
+            reference = self._allocate()
+            self._mapping[(source.idnum, source.generation)] = reference
+            references.append(reference)
+        if index is None:
+            index = len(self.pages)
+        self.pages[index:index] = array("L", [x.idnum for x in references])
+
+        page_links = {}
+        for page_index, page_destination, rect in links:
+            page_links.setdefault(page_index, []).append((page_destination, rect))
+        for page_index, ((source, page), reference) in enumerate(zip(document_pages, references)):
+            copy = DictionaryObject()
+            for key, value in page.items():
+                if key != "/Parent" and not (key == "/Annots" and page_index in page_links):
+                    copy[key] = self._copy(value)
+            copy[NameObject("/Parent")] = self._pages_ref
+            if page_index in page_links:
+                annotations = ArrayObject([self._copy(x) for x in (page["/Annots"] if "/Annots" in page else [])])
+                for page_destination, rect in page_links[page_index]:
+                    annotation = self._allocate()
+                    self._write_object(annotation, link_annotation(IndirectObject(self.pages[page_destination], 0, None), rect))
+                    annotations.append(annotation)
+                copy[NameObject("/Annots")] = annotations
+            self._write_object(reference, copy)
+            #  Reader keeps every object it has read. Objects already copied are found from the mapping, so they are
+            #  dropped to keep memory use from growing with the pages of the document
+            reader.resolvedObjects.clear()
+        #  Object numbers of the source are not needed anymore
+        self._mapping = {}
+
+
+class StreamingPdfWriter(PdfCopier):
+    """
+    Writes pdf document whose pages are copied from other pdf documents or Fragments. Objects of every added document
+    are written to the output file as soon as the document is added, so the added documents can be closed right after
+    and memory use does not grow with the number of documents. Only the object offsets and the page object numbers are kept in
+    compact arrays until the page tree and the cross-reference table are written by close(). The document is written
+    to output_file + ".part" and moved over the output file when it is complete, so a failed compilation does not
+    leave a truncated document in place of the previous one
+    """
+
+    def __init__(self, output_file, deduplicate=True):
+        super().__init__(deduplicate)
+        self.output_file = output_file
+        self._partial = output_file + ".part"
+        self._out = open(self._partial, 'wb')
+        self._out.write(b"%PDF-1.3\n%\xe2\xe3\xcf\xd3\n")
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._out.close()
+            if os.path.exists(self._partial):
+                os.remove(self._partial)
+
+    @property
+    def bytes_written(self):
+        """
+        Bytes written to the output file so far
+        """
+        return self._size if self._out.closed else self._out.tell()
+
+    def _write_object(self, reference, obj, data=None):
+        self._offsets[reference.idnum - 1] = self._out.tell()
+        self._out.write(f"{reference.idnum} 0 obj\n".encode())
+        if data is None:
+            obj.writeToStream(self._out, None)
+        else:
+            self._out.write(data)
+        self._out.write(b"\nendobj\n")
+
+    def _write_serialized(self, number, data, references):
+        self._write_object(IndirectObject(number, 0, None), None, data)
+
+    def add_fragment(self, fragment):
+        """
+        Writes the objects of a Fragment to the output file. The fragment is not needed after this. Its pages are not
+        added to the document, the caller adds them to pages in the order wanted, so fragments can be written in any
+        order
+        :param fragment: Fragment
+        :return: Page numbers of the fragment as an array
+        """
+        pages, duplicates, bytes_saved = self._copy_fragment(fragment)
+        self.duplicates += duplicates
+        self.bytes_saved += bytes_saved
+        return pages
+
+    def close(self):
+        """
+        Writes the page tree, the cross-reference table and the trailer, closes the output file and moves it over
+        output_file
+        :return: Number of pages in the document
+        """
+        if self._out.closed:
+            return len(self.pages)
+        self._write_trailer(self._out)
+        self._size = self._out.tell()
+        self._out.close()
+        os.replace(self._partial, self.output_file)
+        return len(self.pages)
+
+
+class Fragment:
+    """
+    Pages of a pdf document and the objects they use copied out of the document, with object numbers of their own.
+    Objects are kept serialized together with the positions of their references, so the fragment can be pickled and
+    given its final object numbers later with FragmentStore.add_fragment or StreamingPdfWriter.add_fragment without
+    parsing anything
+    """
+
+    def __init__(self, objects, pages, duplicates=0, bytes_saved=0):
+        """
+        :param objects: List of (local number, serialized object without its references, tuple of (offset, local
+            number) of the references, shareable) tuples, referenced objects before the objects referring to them
+            except in reference cycles. Local number 1 is the root of the page tree
+        :param pages: Local numbers of the pages
+        :param duplicates: Shareable objects of the document left out as duplicates
+        :param bytes_saved: Size of the left out objects
+        """
+        self.objects = objects
+        self.pages = pages
+        self.duplicates = duplicates
+        self.bytes_saved = bytes_saved
+
+    @classmethod
+    def from_document(cls, reader, pages=None, deduplicate=True):
+        """
+        Copies pages of the document
+        :param reader: PdfFileReader of the document
+        :param pages: Indexes of the pages copied, by default all pages
+        :param deduplicate: Copies identical shareable objects only once and marks the shareable objects so they can
+            be shared with other fragments
+        :return: Fragment
+        """
+        recorder = _FragmentRecorder(deduplicate)
+        recorder.add_document(reader, pages=pages)
+        return cls(recorder.objects, list(recorder.pages), recorder.duplicates, recorder.bytes_saved)
+
+
+class _FragmentRecorder(PdfCopier):
+    """
+    Serializes the copied objects for Fragment
+    """
+
+    def __init__(self, deduplicate):
+        super().__init__(deduplicate)
+        self.objects = []
+
+    def _write_object(self, reference, obj, data=None):
+        out = BytesIO()
+        references = []
+        _serialize(obj, out, references)
+        #  Data is given for the objects that PdfCopier would share
+        self.objects.append((reference.idnum, out.getvalue(), tuple(references), data is not None))
+
+
+class FragmentStore(PdfCopier):
+    """
+    Keeps the pages of pdf documents copied to memory, each document as a named fragment, with the object numbers
+    they have in the assembled document. A document is assembled from any of the fragments in any order by writing
+    the kept objects as they are, so replacing one fragment does not read or copy the others again. Identical shared
+    resources of the fragments are kept once. Objects no longer used by any fragment are dropped when the next
+    document is opened, their numbers are left as free entries in the cross-reference table.
+
+    Usage:
+        store.add("a", reader_a)
+        store.add_fragment("b", Fragment.from_document(reader_b))
+        with store.open("out.pdf", ["a", "b"]) as writer:
+            writer.add_document(toc_reader, index=0, links=links)
+    """
+
+    def __init__(self, deduplicate=True):
+        super().__init__(deduplicate)
+        #  Object number: (serialized object, numbers of the referenced objects)
+        self._objects = {}
+        self._fragments = {}
+        self._output_file = None
+        #  Size of the document written by close()
+        self.bytes_written = 0
+
+    def _write_object(self, reference, obj, data=None):
+        if data is None:
+            buffer = BytesIO()
+            obj.writeToStream(buffer, None)
+            data = buffer.getvalue()
+        self._objects[reference.idnum] = (data, tuple(_referenced_numbers(obj)))
+
+    def add(self, name, reader, pages=None):
+        """
+        Copies the pages of the document as a fragment, replacing the fragment of the same name
+        :param name: Name of the fragment, for example the path of the source file
+        :param reader: PdfFileReader of the document
+        :param pages: Indexes of the pages copied, by default all pages
+        :return: Number of pages
+        """
+        return self.add_fragment(name, Fragment.from_document(reader, pages, self.deduplicate))
+
+    def _write_serialized(self, number, data, references):
+        self._objects[number] = (data, references)
+
+    def add_fragment(self, name, fragment):
+        """
+        Gives the objects of a Fragment their numbers in the store, replacing the fragment of the same name. Shareable
+        objects identical to objects already in the store are not added again
+        :param name: Name of the fragment
+        :param fragment: Fragment
+        :return: Number of pages
+        """
+        self._fragments[name] = self._copy_fragment(fragment)
+        return len(fragment.pages)
+
+    def remove(self, name):
+        self._fragments.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._fragments
+
+    def _reachable(self, pages):
+        found = set()
+        stack = list(pages)
+        while stack:
+            number = stack.pop()
+            if number not in found and number in self._objects:
+                found.add(number)
+                stack.extend(self._objects[number][1])
+        return found
+
+    def open(self, output_file, names):
+        """
+        Starts a document whose body pages are the pages of the fragments in the given order. More pages, like the
+        table of contents, can be added with add_document before close() writes the file
+        :param output_file: Path of the pdf file
+        :param names: Names of the fragments
+        :return: The store itself
+        """
+        kept = self._reachable(number for pages, _, _ in self._fragments.values() for number in pages)
+        self._objects = {number: self._objects[number] for number in kept}
+        self._digests = {digest: number for digest, number in self._digests.items() if number in kept}
+        self.pages = array("L")
+        self.duplicates = self.bytes_saved = 0
+        for name in names:
+            pages, duplicates, bytes_saved = self._fragments[name]
+            self.pages.extend(pages)
+            self.duplicates += duplicates
+            self.bytes_saved += bytes_saved
+        self._output_file = output_file
+        self.bytes_written = 0
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._output_file = None
+
+    def close(self):
+        """
+        Writes the objects used by the pages of the document, the page tree, the cross-reference table and the trailer
+        :return: Number of pages in the document
+        """
+        num_pages = len(self.pages)
+        if self._output_file is None:
+            return num_pages
+        self._offsets = array("Q", bytes(self._offsets.itemsize * len(self._offsets)))
+        with open(self._output_file, 'wb') as out:
+            out.write(b"%PDF-1.3\n%\xe2\xe3\xcf\xd3\n")
+            for number in sorted(self._reachable(self.pages)):
+                self._offsets[number - 1] = out.tell()
+                out.write(f"{number} 0 obj\n".encode())
+                out.write(self._objects[number][0])
+                out.write(b"\nendobj\n")
+            self._write_trailer(out)
+            self.bytes_written = out.tell()
+        self._output_file = None
+        self.pages = array("L")
+        return num_pages
+
+
+def _referenced_numbers(obj):
+    """
+    Yields the numbers of the objects referenced by a direct object
+    """
+    if isinstance(obj, IndirectObject):
+        yield obj.idnum
+    elif isinstance(obj, DictionaryObject):
+        for value in obj.values():
+            yield from _referenced_numbers(value)
+    elif isinstance(obj, ArrayObject):
+        for value in obj:
+            yield from _referenced_numbers(value)
+
+
+def _serialize(obj, out, references):
+    """
+    Writes the object like writeToStream of PyPDF2 but leaves out the indirect references, whose positions in the
+    output and object numbers are appended to the references list instead
+    """
+    if isinstance(obj, IndirectObject):
+        references.append((out.tell(), obj.idnum))
+    elif isinstance(obj, DictionaryObject):
+        if isinstance(obj, StreamObject):
+            obj[NameObject("/Length")] = NumberObject(len(obj._data))
+        out.write(b"<<\n")
+        for key, value in list(obj.items()):
+            key.writeToStream(out, None)
+            out.write(b" ")
+            _serialize(value, out, references)
+            out.write(b"\n")
+        out.write(b">>")
+        if isinstance(obj, StreamObject):
+            del obj["/Length"]
+            out.write(b"\nstream\n")
+            out.write(obj._data)
+            out.write(b"\nendstream")
+    elif isinstance(obj, ArrayObject):
+        out.write(b"[")
+        for value in obj:
+            out.write(b" ")
+            _serialize(value, out, references)
+        out.write(b" ]")
+    else:
+        obj.writeToStream(out, None)
+
+
+def assemble_pdf(output_file, body, toc_pdf=None, links=()):
+    """
+    Builds the final document from the table of contents and the body pages. Table of contents pages and the link
+    annotations are added directly so no intermediate files are needed
+    :param output_file: Path of the final pdf file
+    :param body: Iterable of PdfFileReader objects whose pages form the body of the document
+    :param toc_pdf: Table of contents pdf document as bytes or None
+    :param links: List of (page index of link, page index of destination, rectangle) tuples. Page indexes start from
+        zero at the first page of the final document. Links can only be on table of contents pages
+    :return: Number of pages in the final document
+    """
+    with StreamingPdfWriter(output_file) as writer:
+        for reader in body:
+            writer.add_document(reader)
+        if toc_pdf is not None:
+            writer.add_document(reader_from_bytes(toc_pdf), index=0, links=links)
+        return writer.close()
@@ -0,0 +1,235 @@
+"""
+Content-addressed cache of converted files. Converted PDF files are stored under the hash of the input file contents
+and the backend converter options so unchanged RTF files are not converted again when a document is recompiled.
+
+Usage from the command line:
+    python pdf_cache.py info
+    python pdf_cache.py prune --max-size 500
+    python pdf_cache.py clear
+    python pdf_cache.py info --fragments
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+# Bump when the conversion changes in a way that makes old cached files invalid
+CACHE_VERSION = 1
+
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """
+    Returns sha256 hex digest of the file contents
+    :param file_path: Absolute path to the file
+    :param chunk_size: Bytes read at a time
+    :return: Hex digest string
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PdfCache:
+    """
+    Size-bounded cache directory. Least recently used entries are evicted when the size of the cache grows over the
+    limit. Modification time of an entry is updated every time it is used
+    """
+
+    def __init__(self, directory, max_size_mb, suffix=".pdf"):
+        self.directory = os.path.abspath(directory)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._size = None
+
+    @classmethod
+    def from_settings(cls, parameters):
+        """
+        Creates the cache from program settings
+        :param parameters: Settings dictionary
+        :return: PdfCache or None if caching is disabled
+        """
+        if not parameters["Conversion cache"]:
+            return None
+        return cls(parameters["Cache directory"], parameters["Cache size (MB)"])
+
+    def key(self, input_file, backend, **options):
+        """
+        Creates the cache key for the file
+        :param input_file: Absolute path of the input file
+        :param backend: Name of the backend converter
+        :param options: Other options affecting the output, for example the output filetype
+        :return: Hex digest string
+        """
+        digest = hashlib.sha256()
+        digest.update(hash_file(input_file).encode())
+        digest.update(json.dumps({"version": CACHE_VERSION, "backend": backend, "options": options},
+                                 sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key, output_file):
+        """
+        Copies the cached file to the output location
+        :param key: Key created by key()
+        :param output_file: Where to copy the cached file
+        :return: True if the file was found from the cache
+        """
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, output_file)
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, file):
+        """
+        Stores copy of the file in the cache and evicts old entries if the cache grows too large
+        :param key: Key created by key()
+        :param file: Path of the file to store
+        :return:
+        """
+        self._store(key, lambda path: shutil.copyfile(file, path))
+
+    def read(self, key):
+        """
+        Returns contents of the cached entry
+        :param key: Key of the entry
+        :return: Bytes or None if the entry is not in the cache
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def write(self, key, data):
+        """
+        Stores the bytes in the cache and evicts old entries if the cache grows too large
+        :param key: Key of the entry
+        :param data: Contents of the entry
+        :return:
+        """
+        def write_data(path):
+            with open(path, 'wb') as file:
+                file.write(data)
+        self._store(key, write_data)
+
+    def _store(self, key, write):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(handle)
+        #  Entry is written next to its place and then moved there, so a reader never sees half of it
+        write(tmp_path)
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            #  Overwritten entry no longer counts towards the size of the cache
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            if self._size is not None:
+                self._size += size - replaced
+        self._evict(self.max_size)
+
+    def entries(self):
+        """
+        Returns list of (path, size, last used time) tuples of the cached files, least recently used first
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda x: x[2])
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def _evict(self, max_size):
+        with self._lock:
+            if self._size is None:
+                self._size = self.size()
+            if self._size <= max_size:
+                return 0
+            removed = 0
+            for path, size, _ in self.entries():
+                if self._size <= max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._size -= size
+                removed += 1
+            return removed
+
+    def prune(self, max_size_mb=None):
+        """
+        Evicts least recently used entries until the cache is smaller than the given size
+        :param max_size_mb: Size limit in megabytes. Defaults to the limit of the cache
+        :return: Number of removed entries
+        """
+        max_size = self.max_size if max_size_mb is None else int(max_size_mb * 1024 * 1024)
+        with self._lock:
+            self._size = None
+        return self._evict(max_size)
+
+    def clear(self):
+        return self.prune(0)
+
+
+def main():
+    import settings
+    parameters = settings.get_parameters()
+    parser = argparse.ArgumentParser(description="Inspect or prune the cache of converted RTF files or the cache of "
+                                                 "rendered TXT files")
+    parser.add_argument("command", choices=["info", "prune", "clear"])
+    parser.add_argument("--max-size", type=float, default=None, help="Size limit in megabytes used by prune")
+    parser.add_argument("--fragments", action="store_true", help="Use the cache of rendered TXT files, see "
+                                                                  "fragment_cache.py")
+    parser.add_argument("--directory", default=None, help="Cache directory")
+    args = parser.parse_args()
+
+    if args.fragments:
+        cache = PdfCache(args.directory or parameters["Fragment cache directory"],
+                         parameters["Fragment cache size (MB)"], suffix=".fragment")
+    else:
+        cache = PdfCache(args.directory or parameters["Cache directory"], parameters["Cache size (MB)"])
+    if args.command == "info":
+        entries = cache.entries()
+        size = sum(x[1] for x in entries)
+        print(f"Cache directory: {cache.directory}")
+        print(f"Entries: {len(entries)}")
+        print(f"Size: {size / 1024 / 1024:.1f} MB of {cache.max_size / 1024 / 1024:.1f} MB")
+    elif args.command == "prune":
+        print(f"Removed {cache.prune(args.max_size)} entries")
+    else:
+        print(f"Removed {cache.clear()} entries")
+
+
+if __name__ == "__main__":
+    main()
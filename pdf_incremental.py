@@ -0,0 +1,297 @@
+import os
+import re
+from array import array
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject, NumberObject
+from PyPDF2.pdf import PdfFileReader
+from pdf_assembly import PdfCopier, link_annotation
+
+
+def _find_startxref(stream):
+    """
+    Reads the offset of the last cross-reference section from the end of the file
+    """
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(max(0, size - 2048))
+    tail = stream.read()
+    match = re.search(rb"startxref\s+(\d+)\s+%%EOF\s*$", tail)
+    if match is None:
+        raise ValueError("Could not find startxref from the end of the file")
+    return int(match.group(1))
+
+
+class IncrementalUpdate:
+    """
+    Collects modified and new objects of an existing pdf file and appends them to the end of the file as an
+    incremental update: the new objects, a cross-reference section covering only them and a trailer pointing to the
+    previous cross-reference section. The rest of the file is not read or written again
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._stream = open(filename, 'rb')
+        self.reader = PdfFileReader(self._stream, strict=False)
+        if self.reader.isEncrypted:
+            raise ValueError("Incremental updates of encrypted files are not supported")
+        self.previous_xref = _find_startxref(self._stream)
+        self._stream.seek(self.previous_xref)
+        if not self._stream.read(4) == b"xref":
+            raise ValueError("Incremental updates need a file with a cross-reference table")
+        self.size = self.reader.trailer["/Size"]
+        self.objects = {}
+        self._page_references = {}
+
+    def page_reference(self, page_index):
+        """
+        Returns indirect reference to the page object. Read from the /Kids arrays of the page tree, so only the nodes
+        of the tree on the way to the page are loaded and not the pages, unlike with PdfFileReader.getPage that loads
+        every page of the document
+        :param page_index: Index of the page starting from zero
+        """
+        if page_index in self._page_references:
+            return self._page_references[page_index]
+        node = self.reader.trailer["/Root"].raw_get("/Pages")
+        index = page_index
+        reference = None
+        while reference is None:
+            tree = node.getObject()
+            kids = tree["/Kids"]
+            if len(kids) == int(tree["/Count"]) and kids[index].getObject().get("/Type") != "/Pages":
+                #  Every child is a page, like in the documents written by this program
+                reference = kids[index]
+                break
+            for kid in kids:
+                child = kid.getObject()
+                count = int(child["/Count"]) if child.get("/Type") == "/Pages" else None
+                if count is None and index == 0:
+                    reference = kid
+                    break
+                if count is not None and index < count:
+                    node = kid
+                    break
+                index -= 1 if count is None else count
+            else:
+                raise IndexError(f"Page index {page_index} out of range")
+        self._page_references[page_index] = reference
+        return reference
+
+    def add_object(self, obj):
+        """
+        Adds new object to the file
+        :return: IndirectObject referring to the new object
+        """
+        reference = IndirectObject(self.size, 0, None)
+        self.size += 1
+        self.objects[(reference.idnum, reference.generation)] = obj
+        return reference
+
+    def replace_object(self, reference, obj):
+        """
+        Replaces existing object. The object keeps its number so references to it stay valid
+        """
+        self.objects[(reference.idnum, reference.generation)] = obj
+
+    def add_links(self, links):
+        """
+        Adds link annotations to pages
+        :param links: List of (page index of link, page index of destination, rectangle) tuples
+        :return:
+        """
+        pages = {}
+        for page_index, page_destination, rect in links:
+            if page_index not in pages:
+                reference = self.page_reference(page_index)
+                page = reference.getObject()
+                modified = DictionaryObject()
+                modified.update(page)
+                annotations = ArrayObject()
+                if "/Annots" in page:
+                    annotations.extend(page["/Annots"])
+                modified[NameObject("/Annots")] = annotations
+                pages[page_index] = (reference, modified)
+            annotation = link_annotation(self.page_reference(page_destination), rect)
+            pages[page_index][1]["/Annots"].append(self.add_object(annotation))
+        for reference, modified in pages.values():
+            self.replace_object(reference, modified)
+
+    def write(self):
+        """
+        Appends the update to the end of the file
+        :return: Number of bytes appended
+        """
+        self._stream.close()
+        with open(self.filename, 'r+b') as out:
+            size = out.seek(0, os.SEEK_END)
+            out.write(b"\n")
+            offsets = {}
+            for key in sorted(self.objects):
+                offsets[key] = out.tell()
+                out.write(f"{key[0]} {key[1]} obj\n".encode())
+                self.objects[key].writeToStream(out, None)
+                out.write(b"\nendobj\n")
+            xref_offset = out.tell()
+            #  Entry of object zero is repeated so that readers expecting zero-indexed tables don't complain
+            out.write(b"xref\n0 1\n0000000000 65535 f \n")
+            keys = sorted(offsets)
+            start = 0
+            while start < len(keys):
+                #  Subsections of consecutive object numbers
+                end = start + 1
+                while end < len(keys) and keys[end][0] == keys[end - 1][0] + 1:
+                    end += 1
+                out.write(f"{keys[start][0]} {end - start}\n".encode())
+                for idnum, generation in keys[start:end]:
+                    out.write(f"{offsets[(idnum, generation)]:010d} {generation:05d} n \n".encode())
+                start = end
+            trailer = DictionaryObject()
+            for key in ("/Root", "/Info", "/ID"):
+                if key in self.reader.trailer:
+                    trailer[NameObject(key)] = self.reader.trailer.raw_get(key)
+            trailer[NameObject("/Size")] = NumberObject(self.size)
+            trailer[NameObject("/Prev")] = NumberObject(self.previous_xref)
+            out.write(b"trailer\n")
+            trailer.writeToStream(out, None)
+            out.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+            return out.tell() - size
+
+
+def append_links(filename, links):
+    """
+    Adds link annotations to existing pdf file as an incremental update. Only the modified pages and the new
+    annotations are written so the time does not depend on the size of the rest of the document
+    :param filename: Path of the pdf file
+    :param links: List of (page index of link, page index of destination, rectangle) tuples
+    :return: Number of bytes appended
+    """
+    update = IncrementalUpdate(filename)
+    update.add_links(links)
+    return update.write()
+
+
+class IncrementalDocument(PdfCopier):
+    """
+    Changes the pages of an existing pdf file with an incremental update. Runs of pages already in the file are kept
+    as fragments without reading or writing them again, and only the pages of new fragments, the objects they use
+    and the page tree are appended to the end of the file. Pages left out of the document stay in the file unused.
+    Has the add, open, add_document and close methods of pdf_assembly.FragmentStore, so a document is assembled from
+    the kept and the new fragments the same way
+    """
+
+    def __init__(self, filename, deduplicate=True):
+        self.update = IncrementalUpdate(filename)
+        self.filename = filename
+        super().__init__(deduplicate, pages_ref=self.update.reader.trailer["/Root"].raw_get("/Pages"))
+        self._fragments = {}
+        self._page_numbers = None
+        #  Size of the update appended by close()
+        self.bytes_written = 0
+
+    def _allocate(self):
+        return self.update.add_object(NullObject())
+
+    def _write_object(self, reference, obj, data=None):
+        self.update.replace_object(reference, obj)
+
+    def get_num_pages(self):
+        return int(self._pages_ref.getObject()["/Count"])
+
+    def _existing_pages(self):
+        """
+        Returns the object numbers of the pages in the file. Read from the root of the page tree when all pages are
+        its direct children, like in the documents written by this program, so the pages themselves are not loaded
+        """
+        if self._page_numbers is None:
+            root = self._pages_ref.getObject()
+            kids = root["/Kids"]
+            if len(kids) == int(root["/Count"]):
+                self._page_numbers = array("L", [x.idnum for x in kids])
+            else:
+                self._page_numbers = array("L")
+                reader = self.update.reader
+                for i in range(reader.getNumPages()):
+                    page = reader.getPage(i)
+                    #  Pages of a deeper page tree become children of the root, with the inherited attributes
+                    #  copied to them by PdfFileReader
+                    modified = DictionaryObject()
+                    modified.update(page)
+                    modified[NameObject("/Parent")] = self._pages_ref
+                    self.update.replace_object(page.indirectRef, modified)
+                    self._page_numbers.append(page.indirectRef.idnum)
+        return self._page_numbers
+
+    def keep(self, name, pages):
+        """
+        Makes a fragment of pages already in the file
+        :param name: Name of the fragment
+        :param pages: Indexes of the pages in the file
+        :return:
+        """
+        numbers = self._existing_pages()
+        self._fragments[name] = array("L", [numbers[i] for i in pages])
+
+    def add(self, name, reader, pages=None):
+        """
+        Copies the pages of the document to the update as a fragment, replacing the fragment of the same name
+        :param name: Name of the fragment
+        :param reader: PdfFileReader of the document
+        :param pages: Indexes of the pages copied, by default all pages
+        :return: Number of pages
+        """
+        self.pages = array("L")
+        self.add_document(reader, pages=pages)
+        self._fragments[name] = self.pages
+        self.pages = array("L")
+        return len(self._fragments[name])
+
+    def open(self, output_file, names):
+        """
+        Starts the document whose body pages are the pages of the fragments in the given order
+        :param output_file: Path of the pdf file, must be the file being updated
+        :param names: Names of the fragments
+        :return: The document itself
+        """
+        if os.path.abspath(output_file) != os.path.abspath(self.filename):
+            raise ValueError("Incremental update is written to the file being updated")
+        self.pages = array("L")
+        for name in names:
+            self.pages.extend(self._fragments[name])
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def discard(self):
+        """
+        Closes the file without changing it
+        :return:
+        """
+        if self.update is not None:
+            self.update._stream.close()
+            self.update = None
+
+    def close(self):
+        """
+        Replaces the root of the page tree with one listing the pages of the document and appends the update to the
+        file
+        :return: Number of pages in the document
+        """
+        if self.update is None:
+            return len(self.pages)
+        root = DictionaryObject()
+        #  Inherited attributes of the old root, like the page size of documents written by FPDF, stay
+        for key, value in self._pages_ref.getObject().items():
+            if key not in ("/Kids", "/Count", "/Parent"):
+                root[NameObject(key)] = value
+        root[NameObject("/Type")] = NameObject("/Pages")
+        root[NameObject("/Kids")] = ArrayObject([IndirectObject(x, 0, None) for x in self.pages])
+        root[NameObject("/Count")] = NumberObject(len(self.pages))
+        self.update.replace_object(self._pages_ref, root)
+        self.bytes_written = self.update.write()
+        self.update = None
+        return len(self.pages)
@@ -0,0 +1,82 @@
+import os
+import threading
+from collections import OrderedDict
+from PyPDF2.pdf import PageObject
+
+
+class PdfInfo:
+    """
+    Page count and text of the first page of a pdf file. Enough for the table of contents of rtf conversion
+    """
+
+    def __init__(self, num_pages, first_page_text):
+        self.num_pages = num_pages
+        self.first_page_text = first_page_text
+
+
+def probe_reader(reader):
+    """
+    Reads the page count from the root of the page tree and the text of the first page. Other pages are not loaded
+    and the page tree is not flattened like PdfFileReader.getNumPages and getPage do
+    :param reader: PdfFileReader of the file
+    :return: PdfInfo
+    """
+    pages = reader.trailer["/Root"]["/Pages"]
+    if "/Count" not in pages:
+        return PdfInfo(reader.getNumPages(), reader.getPage(0).extractText())
+    node = pages
+    while "/Kids" in node and len(node["/Kids"]) > 0:
+        #  First leaf of the page tree is the first page
+        node = node["/Kids"][0].getObject()
+    text = ""
+    if "/Contents" in node:
+        page = PageObject(reader)
+        page.update(node)
+        text = page.extractText()
+    return PdfInfo(int(pages["/Count"]), text)
+
+
+def probe_key(input_file, engine):
+    """
+    Returns the key of the probe results of a converted file. The converted file gets a new name in every
+    compilation, so the key is made of the path, size and modification time of the input file it was converted from
+    and the engine that converted it. Only the file system metadata of the input file is read
+    :param input_file: Path of the *.rtf file
+    :param engine: Engine that converted the file
+    :return: Tuple
+    """
+    stat = os.stat(input_file)
+    return engine, os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns
+
+
+class ProbeCache:
+    """
+    Results of probe_reader by the input file, so a file that has been probed once, in this or an earlier compilation
+    of the same program run, is not probed again
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def probe(self, key, reader):
+        """
+        Returns page count and first page text of the converted file
+        :param key: Key created by probe_key()
+        :param reader: PdfFileReader of the converted file, used when the file is not in the cache
+        :return: PdfInfo
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        info = probe_reader(reader)
+        with self._lock:
+            self._entries[key] = info
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return info
+
+
+probe_cache = ProbeCache()
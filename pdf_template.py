@@ -1,11 +1,21 @@
 from builtins import filter
+import os
+import zlib
+from array import array
 
 from fpdf import FPDF
+from fpdf.php import sprintf, UTF8ToUTF16BE
 import settings
 from helper_functions import break_chapter_to_lines
+from font_cache import add_cached_font
 
 PARAMETERS = settings.get_parameters()
 
+# Characters of the fixed parts of the table of contents pages
+TOC_CHARACTERS = "Table of Contents_.0123456789 "
+# Font of all pages, read from the program folder
+FONT_FILE = "CourierNewRegular.ttf"
+
 
 def get_text_body_length(text_body):
     return len(text_body.splitlines())
@@ -13,23 +23,31 @@ def get_text_body_length(text_body):
 
 class PDF(FPDF):
 
-    def __init__(self, orientation='P', unit='mm', format='A4'):
+    def __init__(self, orientation='P', unit='mm', format='A4', glyphs=None):
+        """
+        :param glyphs: Characters always embedded from the font. Documents merged together share one embedded font
+            when they are created with the same characters. By default only the characters written are embedded
+        """
         super().__init__(orientation, unit, format)
         self.footer_text = ""
-        path_to_font = "CourierNewRegular.ttf"
-        self.add_font('Courier New', '', path_to_font, uni=True)
+        #  Font metrics are parsed once and then loaded from the cache next to the font file
+        add_cached_font(self, 'Courier New', FONT_FILE, glyphs)
         # Containing coordinates for link
         self.link_locations = []
         # Page numbers where links lead. Used for rtf conversion
         self.link_page = []
+        # Table of contents page of every link, counted from the first table of contents page
+        self.link_toc_page = []
         self.writing_toc = False
 
-    def table_of_contents(self, contents, orientation, create_hyperlink=True):
+    def table_of_contents(self, contents, orientation, create_hyperlink=True, link_pages=None):
         """
         Creates a table of contents page at the first page.
         :param create_hyperlink: Boolean indicating if we want to create hyperlinks to toc items
         :param orientation: Page orientation. Values "P" or "L"
         :param contents: Dictionary where keys are chapter names and values are page numbers where chapter starts
+        :param link_pages: Function giving the page of this document where a page number of the table of contents
+            leads to. By default the page number itself
         :return:
         """
         #  TODO: figure out why there is a need to use "Hack" to get toc items working
@@ -37,14 +55,15 @@ class PDF(FPDF):
         self.set_auto_page_break(True, margin=40)
         self.add_page(orientation=orientation)
         self.toc_header()
-        self.set_font('Courier New', '', PARAMETERS["Toc font size"])
+        self.set_font('Courier New', '', PARAMETERS["TOC font size"])
         first_item = True
+        first_page = self.page
 
         for chapter_name, page_number in contents.items():
             link = None
             if create_hyperlink:
                 link = self.add_link()
-                self.set_link(link, page=page_number)
+                self.set_link(link, page=page_number if link_pages is None else link_pages(page_number))
             broken_text = break_chapter_to_lines(chapter_name)
             for line in broken_text:
                 self.link_page.append(page_number)
@@ -65,19 +84,22 @@ class PDF(FPDF):
                     else:
                         text = f'{" " * 5}{line}'
 
-                link_loc = [self.x, self.y + .5 - .5 * self.font_size, self.get_string_width(text), self.font_size]
+                link_x = self.x
+                self.cell(0, 9, text, link=link)
+                #  Location is taken after the cell, which moves the line to the next page when it does not fit
+                link_loc = [link_x, self.y + .5 - .5 * self.font_size, self.get_string_width(text), self.font_size]
                 link_loc = [x * self.k for x in link_loc]  # Change back to pixels
 
                 self.link_locations.append(link_loc)
-                self.cell(0, 9, text, link=link)
+                self.link_toc_page.append(self.page - first_page)
                 self.ln(8)
 
     def get_link_locations(self):
         """
         Helper function to get link locations so we can add them later
-        :return:
+        :return: Link locations, page numbers where the links lead and table of contents pages of the links
         """
-        return self.link_locations, self.link_page
+        return self.link_locations, self.link_page, self.link_toc_page
 
     def text_header(self):
         """
@@ -112,6 +134,8 @@ class PDF(FPDF):
         :return:
         """
         if self.writing_toc:
+            #  Table of contents pages have no footer text, also when they are written after the text pages
+            self._set_footer_text("")
             self.toc_header()
         else:
             self.text_header()
@@ -181,10 +205,46 @@ class PDF(FPDF):
         self.set_y(PARAMETERS["Chapter body y-offset"])
         self.set_auto_page_break(False)
         self.set_x(PARAMETERS["Chapter body x-offset"])
-        self.multi_cell(0, PARAMETERS["Distance between lines of chapter body"], text_body)
+        h = PARAMETERS["Distance between lines of chapter body"]
+        if not (PARAMETERS["Fast text body"] and self._monospace_body(h, text_body)):
+            self.multi_cell(0, h, text_body)
         self.set_auto_page_break(True)
         self.ln()
 
+    def _monospace_body(self, h, text_body):
+        """
+        Prints pre-formatted text as one text object where every line is the same distance below the previous one.
+        Lines are placed where multi_cell places them when no line is wrapped, but the lines are not measured
+        character by character
+        :param h: Distance between the lines
+        :param text_body: Python string what to print to the page
+        :return: False if some line might not fit on the page. Nothing is printed then and multi_cell has to be used
+        """
+        if self.ws or self.underline or not self.unifontsubset:
+            return False
+        lines = text_body.replace("\r", "").split("\n")
+        if len(lines) > 1 and lines[-1] == "":
+            #  multi_cell ignores a newline at the end of the text
+            lines.pop()
+        characters = set(text_body)
+        characters.difference_update("\r\n")
+        #  Every character of a monospaced font has the same width, so only the different characters are measured
+        widest = max((self.get_string_width(x) for x in characters), default=0)
+        if max(len(x) for x in lines) * widest >= self.w - self.r_margin - self.x - 2 * self.c_margin:
+            return False
+        self.current_font['subset'].extend(sorted(ord(x) for x in characters))
+        k = self.k
+        text = ") Tj T* (".join(self._escape(UTF8ToUTF16BE(x, False)) for x in lines)
+        s = sprintf('BT %.2f %.2f Td %.4f TL (%s) Tj ET', (self.x + self.c_margin) * k,
+                    (self.h - (self.y + .5 * h + .3 * self.font_size)) * k, h * k, text)
+        if self.color_flag:
+            s = 'q ' + self.text_color + ' ' + s + ' Q'
+        self._out(s)
+        self.lasth = h
+        self.y += h * len(lines)
+        self.x = self.l_margin
+        return True
+
     def _set_footer_text(self, text):
         """
         Sets the footer text that footer function prints out
@@ -209,3 +269,177 @@ class PDF(FPDF):
         self._set_footer_text(footer_text)
         self.chapter_title(chapter_title)
         self._chapter_body(text_body)
+
+    def print_document(self, document):
+        """
+        Prints all the pages of a parsed text file
+        :param document: helper_functions.ParsedDocument
+        :return:
+        """
+        self.set_title(document.header_text.strip())
+        for block in document.blocks:
+            self.print_chapter(chapter_title=document.chapter_name.strip(), text_body=block,
+                               footer_text=document.program_info.strip())
+
+
+class StreamingPDF(PDF):
+    """
+    PDF that writes every page to the output file as soon as the page is finished instead of keeping all pages in
+    memory until output(). Fonts, images, the page tree and the cross-reference table are written when the document
+    is closed, so memory use does not depend on the number of pages. Object numbers are the same as FPDF uses.
+
+    Page number aliases (alias_nb_pages) are not supported and internal links have to be set before the page with
+    the link is finished. Pages can be written in another order than they are in the document, see move_to_front.
+
+    The document is written to filename + ".part" and moved over the file when it is closed. Used as a context
+    manager the partial file is removed if the block raises an exception
+    """
+
+    def __init__(self, filename, orientation='P', unit='mm', format='A4', glyphs=None):
+        super().__init__(orientation, unit, format, glyphs)
+        self.filename = filename
+        self._partial = filename + ".part"
+        self._file = open(self._partial, 'wb')
+        self._header_written = False
+        #  Offsets of the page and page content objects. Page n is object 1 + 2n and its content object 2 + 2n
+        self._page_offsets = array("Q")
+        #  Pages from this page on come first in the document
+        self._front_page = 1
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            if os.path.exists(self._partial):
+                os.remove(self._partial)
+
+    @property
+    def bytes_written(self):
+        """
+        Bytes written to the output file so far
+        """
+        return self._size if self._file.closed else self._file.tell()
+
+    def move_to_front(self, page):
+        """
+        Puts the pages from the given page on in front of the earlier pages, so the table of contents can be written
+        after the pages it lists
+        :param page: Number of the first page moved, counted from 1
+        :return:
+        """
+        self._front_page = page
+
+    def _endpage(self):
+        super()._endpage()
+        self._write_page(self.page)
+
+    def _write_page(self, n):
+        """
+        Writes the page object and the content stream of page n to the file and frees the page contents
+        """
+        if not self._header_written:
+            self._file.write(f"%PDF-{self.pdf_version}\n".encode("latin1"))
+            self._header_written = True
+        w_pt, h_pt = (self.fw_pt, self.fh_pt) if self.def_orientation == 'P' else (self.fh_pt, self.fw_pt)
+        lines = [f"{1 + 2 * n} 0 obj", "<</Type /Page", "/Parent 1 0 R"]
+        if n in self.orientation_changes:
+            lines.append('/MediaBox [0 0 %.2f %.2f]' % (h_pt, w_pt))
+        lines.append("/Resources 2 0 R")
+        if n in self.page_links:
+            annots = '/Annots ['
+            for pl in self.page_links.pop(n):
+                rect = '%.2f %.2f %.2f %.2f' % (pl[0], pl[1], pl[0] + pl[2], pl[1] - pl[3])
+                annots += '<</Type /Annot /Subtype /Link /Rect [' + rect + '] /Border [0 0 0] '
+                if isinstance(pl[4], str):
+                    annots += '/A <</S /URI /URI ' + self._textstring(pl[4]) + '>>>>'
+                else:
+                    link = self.links[pl[4]]
+                    h = w_pt if link[0] in self.orientation_changes else h_pt
+                    annots += '/Dest [%d 0 R /XYZ 0 %.2f null]>>' % (1 + 2 * link[0], h - link[1] * self.k)
+            lines.append(annots + ']')
+        if self.pdf_version > '1.3':
+            lines.append('/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>')
+        lines += [f"/Contents {2 + 2 * n} 0 R>>", "endobj"]
+        content = self.pages.pop(n).encode("latin1")
+        if self.compress:
+            content = zlib.compress(content)
+        self._page_offsets.append(self._file.tell())
+        self._file.write(("\n".join(lines) + "\n").encode("latin1"))
+        self._page_offsets.append(self._file.tell())
+        stream_filter = '/Filter /FlateDecode ' if self.compress else ''
+        self._file.write(f"{2 + 2 * n} 0 obj\n<<{stream_filter}/Length {len(content)}>>\nstream\n".encode("latin1"))
+        self._file.write(content)
+        self._file.write(b"\nendstream\nendobj\n")
+
+    def _enddoc(self):
+        """
+        Writes the objects that FPDF writes after the pages, the cross-reference table and the trailer
+        """
+        if not self._header_written:
+            self._file.write(f"%PDF-{self.pdf_version}\n".encode("latin1"))
+        self.n = 2 + 2 * self.page
+        self.buffer = ""
+        #  Pages root
+        w_pt, h_pt = (self.fw_pt, self.fh_pt) if self.def_orientation == 'P' else (self.fh_pt, self.fw_pt)
+        self.offsets[1] = len(self.buffer)
+        self._out('1 0 obj')
+        self._out('<</Type /Pages')
+        order = list(range(self._front_page - 1, self.page)) + list(range(self._front_page - 1))
+        self._out('/Kids [' + ''.join(f"{3 + 2 * i} 0 R " for i in order) + ']')
+        self._out('/Count ' + str(self.page))
+        self._out('/MediaBox [0 0 %.2f %.2f]' % (w_pt, h_pt))
+        self._out('>>')
+        self._out('endobj')
+        self._putresources()
+        #  Info
+        self._newobj()
+        self._out('<<')
+        self._putinfo()
+        self._out('>>')
+        self._out('endobj')
+        #  Catalog
+        self._newobj()
+        self._out('<<')
+        self._putcatalog()
+        self._out('>>')
+        self._out('endobj')
+        start = self._file.tell()
+        self._file.write(self.buffer.encode("latin1"))
+        self.buffer = ""
+
+        xref_offset = self._file.tell()
+        self._out('xref')
+        self._out('0 ' + str(self.n + 1))
+        self._out('0000000000 65535 f ')
+        for i in range(1, self.n + 1):
+            if 3 <= i <= 2 + 2 * self.page:
+                offset = self._page_offsets[i - 3]
+            else:
+                offset = start + self.offsets[i]
+            self._out('%010d 00000 n ' % offset)
+        self._out('trailer')
+        self._out('<<')
+        self._puttrailer()
+        self._out('>>')
+        self._out('startxref')
+        self._out(xref_offset)
+        self._out('%%EOF')
+        self._file.write(self.buffer.encode("latin1"))
+        self._size = self._file.tell()
+        self._file.close()
+        os.replace(self._partial, self.filename)
+        self.buffer = ""
+        self.state = 3
+
+    def output(self, name='', dest=''):
+        """
+        Finishes the document. The pages are already in the file given when the object was created
+        :return:
+        """
+        self.close()
+        return ''
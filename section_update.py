@@ -0,0 +1,157 @@
+"""
+Inserts, replaces and removes sections of a compiled document using the manifest written next to it. Only the new and
+changed input files are rendered or converted. Their pages, the new table of contents with its links and a new page
+tree are appended to the document as an incremental update, so the pages of the other sections are not read or
+written again. Pages of replaced and removed sections and the old table of contents stay in the file unused until
+the document is compiled again.
+
+New files are placed among the sections in the alphabetical order of the paths, like the files of a glob pattern in
+the command line version. With --refresh every section whose input file has changed since the document was compiled
+is replaced.
+
+Usage: python section_update.py compiled.pdf --add tables/t_14_3_2.rtf --engine libreoffice
+       python section_update.py compiled.pdf --remove listings/l_16_2_1.txt --refresh
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from cli import load_settings, parse_setting
+
+
+def update_sections(pdf_file, add=(), remove=(), refresh=False, engine="word", converter_pool=None):
+    """
+    Changes the sections of a compiled document that has a manifest
+    :param pdf_file: Path of the compiled document
+    :param add: Input files added to the document. Files that already are sections of the document are replaced
+    :param remove: Input files whose sections are removed
+    :param refresh: Also replaces the sections whose input file has changed
+    :param engine: Converter of *.rtf files when converter_pool is not given
+    :param converter_pool: Optional running converter_pool.ConverterPool for *.rtf files
+    :return: (Manifest of the updated document, number of files rendered or converted)
+    :raises ValueError: When the manifest does not match the document or a file is not valid
+    """
+    from converter_pool import ConverterPool
+    from helper_functions import parse_documents, settings
+    from main_functions import Converter, add_converted_files, add_rendered_documents
+    from manifest import Manifest
+    from pdf_cache import PdfCache, hash_file
+    from pdf_incremental import IncrementalDocument
+    from pdf_template import TOC_CHARACTERS
+    from workspace import Workspace
+
+    pdf_file = os.path.abspath(pdf_file)
+    manifest = Manifest.load(pdf_file)
+    known = {section.file: section for section in manifest.sections}
+    add = list(dict.fromkeys(os.path.abspath(x) for x in add))
+    remove = {os.path.abspath(x) for x in remove}
+    for file in remove - known.keys():
+        raise ValueError(f"{file} is not a section of the document")
+    for file in add:
+        if file in remove:
+            raise ValueError(f"{file} is both added and removed")
+        if not os.path.isfile(file):
+            raise ValueError(f"{file} not found")
+    changed = add
+    if refresh:
+        changed += [x.file for x in manifest.sections if x.file not in remove and x.file not in add
+                    and os.path.isfile(x.file) and hash_file(x.file) != x.digest]
+    if not changed and not remove:
+        return manifest, 0
+
+    names = [x.file for x in manifest.sections if x.file not in remove]
+    for file in sorted(x for x in changed if x not in known):
+        position = next((i for i, name in enumerate(names) if name > file), len(names))
+        names.insert(position, file)
+
+    document = IncrementalDocument(pdf_file, deduplicate=settings["Deduplicate resources"])
+    try:
+        if document.get_num_pages() != manifest.num_pages:
+            raise ValueError("Document has changed since the manifest was written, compile it again")
+        for name in names:
+            if name not in changed:
+                document.keep(name, known[name].page_indexes())
+        sections = {name: (known[name].chapter_name, known[name].num_pages) for name in names if name not in changed}
+        glyphs = None
+        with Workspace.from_settings(settings) as workspace:
+            if changed and manifest.filetype == "txt":
+                documents = list(parse_documents(changed, settings["Parser workers"], settings["Parser chunk size"]))
+                #  The new sections and the table of contents share one font subset. The fonts of the kept sections
+                #  are not read, so the subset is embedded once more
+                glyphs = set(TOC_CHARACTERS).union(*(x.characters for x in documents))
+                add_rendered_documents(document, changed, documents, workspace.path, frozenset(glyphs))
+                sections.update((file, (x.chapter_name, x.num_pages)) for file, x in zip(changed, documents))
+            elif changed:
+                pool = converter_pool
+                if pool is None:
+                    pool = ConverterPool(engine, instances=settings["Converter instances"],
+                                         cache=PdfCache.from_settings(settings))
+                try:
+                    sections.update(zip(changed, add_converted_files(document, changed, pool, workspace.path)))
+                finally:
+                    if pool is not converter_pool:
+                        pool.close()
+
+        converter = Converter()
+        converter.filename = pdf_file
+        converter.set_filetype(manifest.filetype)
+        converter.set_create_toc(manifest.toc_pages > 0)
+        converter.set_toc_orientation(manifest.toc_orientation)
+        chapters = [sections[name][0] for name in names]
+        pages = [sections[name][1] for name in names]
+        converter.assemble_fragments(document, names, chapters, pages, glyphs)
+    except BaseException:
+        document.discard()
+        raise
+    digests = {x.file: x.digest for x in manifest.sections if x.file not in changed}
+    updated = Manifest.from_compilation(manifest.filetype, names, chapters, pages, converter.toc_pages,
+                                        manifest.toc_orientation, digests)
+    updated.save(pdf_file)
+    return updated, len(changed)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("document", help="Compiled pdf file that has a manifest next to it")
+    parser.add_argument("--add", nargs="+", default=[], metavar="FILE", help="Input files added to the document or "
+                                                                              "replacing their sections")
+    parser.add_argument("--remove", nargs="+", default=[], metavar="FILE", help="Input files whose sections are "
+                                                                                 "removed")
+    parser.add_argument("--refresh", action="store_true", help="Replace the sections whose input file has changed")
+    parser.add_argument("--engine", default="word", help="Converter of *.rtf files: word or libreoffice")
+    parser.add_argument("--set", type=parse_setting, action="append", default=[], metavar="KEY=VALUE",
+                        help="Overrides a setting of settings.json, can be repeated")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not (args.add or args.remove or args.refresh):
+        parser.error("Nothing to do, give --add, --remove or --refresh")
+    document = os.path.abspath(args.document)
+    add = [os.path.abspath(x) for x in args.add]
+    remove = [os.path.abspath(x) for x in args.remove]
+
+    try:
+        load_settings(args.set)
+    except KeyError as e:
+        parser.error(e.args[0])
+    from converter_pool import normalize_engine
+    try:
+        engine = normalize_engine(args.engine)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        manifest, num_changed = update_sections(document, add, remove, args.refresh, engine)
+    except (OSError, ValueError) as e:
+        print(f"Update failed: {e}", file=sys.stderr)
+        return 1
+    print(f"{document}: {num_changed} sections rendered or converted, {len(remove)} removed, "
+          f"{manifest.num_pages} pages")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
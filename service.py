@@ -0,0 +1,323 @@
+"""
+Long-running compilation service. Compilations are submitted as jobs to a local HTTP API and run by a fixed number of
+job threads in one process, so Python, the font and the settings are loaded once and every job of an engine shares
+one pool of warm Word or LibreOffice instances. Only connections from this machine are accepted.
+
+API, all bodies are JSON:
+    POST /jobs          {"files": [absolute paths or glob patterns], "output": absolute path, "filetype": "txt" | "rtf",
+                         "create_toc": true, "toc_orientation": "P" | "L", "engine": "word" | "libreoffice"}
+                        Only files and output are required. Returns 202 and the job
+    GET  /jobs          All jobs, oldest first
+    GET  /jobs/<id>     The job: state (queued, running, done or failed), progress, total, output and error, and
+                        the measured stages when "Instrumentation" is enabled, see instrumentation.py
+
+Settings are the same for all jobs and are given when the service is started.
+
+Usage: python service.py serve --port 8765 --jobs 2 --set "Converter instances=4"
+       python service.py submit "listings/*.txt" -o compiled.pdf --wait
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cli import find_files, guess_filetype, load_settings, parse_setting
+
+DEFAULT_PORT = 8765
+
+
+class Job:
+    """
+    One compilation submitted to the service
+    """
+
+    def __init__(self, files, filetype, output, create_toc=True, toc_orientation="P", engine="word"):
+        self.id = uuid.uuid4().hex
+        self.files = files
+        self.filetype = filetype
+        self.output = output
+        self.create_toc = create_toc
+        self.toc_orientation = toc_orientation
+        self.engine = engine
+        self.state = "queued"
+        self.progress = 0
+        self.error = None
+        self.report = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "id": self.id, "state": self.state, "progress": min(self.progress, len(self.files)),
+            "total": len(self.files), "filetype": self.filetype, "output": self.output, "error": self.error,
+            "submitted": self.submitted, "started": self.started, "finished": self.finished, "report": self.report,
+        }
+
+
+class JobQueue:
+    """
+    Runs submitted jobs in job threads. Each job gets its own Converter, and all jobs of the same engine share one
+    ConverterPool that is started with the first *.rtf job and kept warm until the queue is closed
+    """
+
+    def __init__(self, parameters, concurrent_jobs=2, max_finished=1000):
+        self.parameters = parameters
+        self.max_finished = max_finished
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(max(1, concurrent_jobs))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, files, output, filetype=None, create_toc=True, toc_orientation="P", engine="word"):
+        """
+        Validates the job and adds it to the queue
+        :param files: List of input files or glob patterns
+        :param output: Path of the compiled pdf file
+        :return: Job
+        :raises ValueError: When the job is not valid
+        """
+        from converter_pool import normalize_engine
+        if not isinstance(files, list) or not files or not all(isinstance(x, str) and os.path.isabs(x) for x in files):
+            raise ValueError("files must be a non-empty list of absolute paths or glob patterns")
+        if not output or not os.path.isabs(output):
+            raise ValueError("output must be an absolute path")
+        found = find_files(files)
+        if not found:
+            raise ValueError("No input files found")
+        filetype = filetype or guess_filetype(found)
+        if filetype not in ("txt", "rtf"):
+            raise ValueError("Could not tell the type of the input files, give filetype")
+        if toc_orientation not in ("P", "L"):
+            raise ValueError("toc_orientation must be P or L")
+        job = Job(found, filetype, output, bool(create_toc), toc_orientation, normalize_engine(engine))
+        with self._lock:
+            self._jobs[job.id] = job
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _pool(self, engine):
+        from converter_pool import ConverterPool
+        from pdf_cache import PdfCache
+        with self._lock:
+            if engine not in self._pools:
+                self._pools[engine] = ConverterPool(engine, instances=self.parameters["Converter instances"],
+                                                    cache=PdfCache.from_settings(self.parameters))
+            return self._pools[engine]
+
+    def _forget_old_jobs(self):
+        with self._lock:
+            finished = [x for x in self._jobs.values() if x.finished is not None]
+            for job in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job.id]
+
+    def _run(self, job):
+        from main_functions import Converter
+        converter = Converter()
+        converter.set_files(job.files)
+        converter.set_filetype(job.filetype)
+        converter.set_filename(job.output)
+        converter.set_create_toc(job.create_toc)
+        converter.set_toc_orientation(job.toc_orientation)
+        converter.set_engine(job.engine)
+        if job.filetype == "rtf":
+            converter.set_converter_pool(self._pool(job.engine))
+        converter.progress.connect(lambda count: setattr(job, "progress", count))
+        converter.send_report.connect(lambda report: setattr(job, "report", report))
+        converter.convert()
+        job.output = converter.filename
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            job.state = "running"
+            job.started = time.time()
+            try:
+                self._run(job)
+                job.state = "done"
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.state = "failed"
+            job.finished = time.time()
+            self._forget_old_jobs()
+
+    def close(self):
+        """
+        Waits for the queued jobs to finish and shuts down the backend instances
+        :return:
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        for pool in self._pools.values():
+            pool.close()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the JobQueue set as server.job_queue
+    """
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        job_queue = self.server.job_queue
+        if self.path == "/jobs":
+            self._send(200, [job.to_dict() for job in job_queue.jobs()])
+        elif self.path.startswith("/jobs/"):
+            job = job_queue.get(self.path[len("/jobs/"):])
+            if job is None:
+                self._send(404, {"error": "No such job"})
+            else:
+                self._send(200, job.to_dict())
+        else:
+            self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self._send(404, {"error": "Not found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if not isinstance(body, dict):
+                raise ValueError("Body must be a JSON object")
+            job = self.server.job_queue.submit(**body)
+        except (ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        self._send(202, job.to_dict())
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(job_queue, port=DEFAULT_PORT, verbose=False):
+    """
+    Creates the HTTP server of the service listening on this machine only. Run with serve_forever()
+    :param job_queue: JobQueue running the jobs
+    :param port: TCP port, 0 picks a free port
+    :return: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), ServiceHandler)
+    server.job_queue = job_queue
+    server.verbose = verbose
+    return server
+
+
+def request(url, method="GET", body=None):
+    """
+    Sends a request to the service
+    :return: (status, decoded JSON body) tuple
+    """
+    data = None if body is None else json.dumps(body).encode()
+    call = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(call) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def wait_for_job(url, job_id, interval=0.2):
+    """
+    Polls the job until it is done or failed
+    :return: Job as a dictionary
+    """
+    while True:
+        status, job = request(f"{url}/jobs/{job_id}")
+        if status != 200 or job["state"] in ("done", "failed"):
+            return job
+        time.sleep(interval)
+
+
+def serve(args):
+    try:
+        parameters = load_settings(args.set)
+    except KeyError as e:
+        sys.exit(e.args[0])
+    #  Imported here only to load it before the first job, so the first job is not slower than the others
+    importlib.import_module("main_functions")
+    job_queue = JobQueue(parameters, args.jobs)
+    server = create_server(job_queue, args.port, args.verbose)
+    print(f"Listening on http://127.0.0.1:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        job_queue.close()
+
+
+def submit(args):
+    url = f"http://127.0.0.1:{args.port}"
+    body = {"files": [os.path.abspath(x) for x in args.inputs], "output": os.path.abspath(args.output),
+            "create_toc": not args.no_toc, "toc_orientation": args.toc_orientation, "engine": args.engine}
+    if args.type:
+        body["filetype"] = args.type
+    status, job = request(f"{url}/jobs", "POST", body)
+    if status != 202:
+        sys.exit(job["error"])
+    if args.wait:
+        job = wait_for_job(url, job["id"])
+    print(json.dumps(job, indent=4))
+    return 0 if job["state"] != "failed" else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="Runs the service")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port on 127.0.0.1")
+    serve_parser.add_argument("--jobs", type=int, default=2, help="Number of jobs running at the same time")
+    serve_parser.add_argument("--set", type=parse_setting, action="append", default=[], metavar="KEY=VALUE",
+                              help="Overrides a setting of settings.json for all jobs, can be repeated")
+    serve_parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    submit_parser = commands.add_parser("submit", help="Submits a job to a running service")
+    submit_parser.add_argument("inputs", nargs="+", help="Input files or glob patterns")
+    submit_parser.add_argument("-o", "--output", required=True, help="Path of the compiled pdf file")
+    submit_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port of the service")
+    submit_parser.add_argument("--type", choices=["txt", "rtf"], help="Type of the input files")
+    submit_parser.add_argument("--no-toc", action="store_true", help="Do not create the table of contents")
+    submit_parser.add_argument("--toc-orientation", choices=["P", "L"], default="P")
+    submit_parser.add_argument("--engine", default="word", help="Converter of *.rtf files: word or libreoffice")
+    submit_parser.add_argument("--wait", action="store_true", help="Wait until the job is finished")
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        return serve(args)
+    return submit(args)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -1,5 +1,28 @@
 import json, csv
 
+# Values used when settings.json was saved by an older version of the program and lacks newer keys
+DEFAULTS = {
+    "Converter instances": 1,
+    "Conversion cache": True,
+    "Cache directory": "conversion_cache",
+    "Cache size (MB)": 2048,
+    "Parser workers": 1,
+    "Parser chunk size": 8,
+    "Render workers": 1,
+    "Auto accept TOC": False,
+    "TOC file": "",
+    "Incremental hyperlinks": False,
+    "Deduplicate resources": True,
+    "Streamed TXT size (MB)": 64,
+    "Fast text body": True,
+    "Scratch directory": "",
+    "Section manifest": True,
+    "Fragment cache": False,
+    "Fragment cache directory": "fragment_cache",
+    "Fragment cache size (MB)": 512,
+    "Instrumentation": False,
+}
+
 
 def init():
     global PARAMETERS
@@ -7,6 +30,8 @@ def init():
 
     with open("settings.json", "r") as JSON:
         PARAMETERS = json.load(JSON)
+    for key, value in DEFAULTS.items():
+        PARAMETERS.setdefault(key, value)
 
     #with open('settings.csv', 'r') as csvfile:
     #    read = csv.DictReader(csvfile)
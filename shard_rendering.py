@@ -0,0 +1,84 @@
+import os
+from functools import partial
+from itertools import accumulate
+import instrumentation
+from helper_functions import worker_pool
+from pdf_template import StreamingPDF
+
+
+def plan_shards(page_counts, num_shards):
+    """
+    Splits the documents into contiguous runs that have roughly the same number of pages
+    :param page_counts: List of how many pages each document takes
+    :param num_shards: Number of runs wanted
+    :return: List of (start, end) index pairs, end not included
+    """
+    num_shards = max(1, min(num_shards, len(page_counts)))
+    ends = list(accumulate(page_counts))
+    total = ends[-1] if ends else 0
+    shards = []
+    start = 0
+    for shard in range(1, num_shards):
+        target = total * shard / num_shards
+        end = start + 1
+        #  Moves the boundary forward while the run is under its share of pages, leaving at least one document for
+        #  every remaining run
+        while end < len(page_counts) - (num_shards - shard) and ends[end - 1] < target:
+            end += 1
+        shards.append((start, end))
+        start = end
+    shards.append((start, len(page_counts)))
+    return shards
+
+
+def render_shard(documents, output_file, glyphs=None, progress=None):
+    """
+    Renders the pages of the documents into a pdf file. Pages are written to the file as they are finished. Run in a
+    worker process
+    :param documents: List of ParsedDocument objects
+    :param output_file: Path of the pdf file
+    :param glyphs: Characters embedded from the font, see PDF
+    :param progress: Optional function called with the number of documents rendered so far
+    :return: Path of the pdf file
+    """
+    pdf = StreamingPDF(output_file, glyphs=glyphs)
+    pdf.set_title("")
+    for count, document in enumerate(documents):
+        pdf.print_document(document)
+        if progress is not None:
+            progress(count + 1)
+    pdf.close()
+    return output_file
+
+
+def _render_shard_job(job):
+    return render_shard(*job)
+
+
+def render_shards(documents, workers, directory, glyphs=None, progress=None):
+    """
+    Renders contiguous runs of documents into separate pdf files in worker processes
+    :param documents: List of ParsedDocument objects
+    :param workers: Number of worker processes. 0 uses one process per cpu core and 1 renders in this process
+    :param directory: Folder where the pdf files are written
+    :param glyphs: Characters embedded from the font in every file, so the files share one embedded font when they
+        are merged
+    :param progress: Optional function called with the number of documents rendered so far
+    :return: List of paths of the pdf files in document order
+    """
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    shards = [documents[start:end] for start, end in plan_shards([x.num_pages for x in documents], workers)]
+    jobs = [(shard, os.path.join(directory, f"shard_{i}.pdf"), glyphs) for i, shard in enumerate(shards)]
+    if len(jobs) == 1:
+        return [render_shard(*jobs[0], progress)]
+    rendered = []
+    count = 0
+    with worker_pool(len(jobs)) as pool:
+        for shard, (pdf_file, cpu) in zip(shards, pool.imap(partial(instrumentation.timed, _render_shard_job), jobs)):
+            instrumentation.worker_cpu(cpu)
+            rendered.append(pdf_file)
+            count += len(shard)
+            if progress is not None:
+                progress(count)
+    return rendered
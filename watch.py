@@ -0,0 +1,261 @@
+"""
+Watch mode. Compiles the *.txt or *.rtf files of a folder and keeps the compiled document up to date while the files
+are edited. Every file is rendered or converted into a pdf fragment of its own whose pages are kept in memory for
+the session, ready to be written to the document, so when files change only those files are parsed and rendered or
+converted again. The table of contents is then compiled again from the page counts of all fragments and the document
+is written from the kept pages. Changes are collected until the folder has been quiet for the debounce time, so
+saving many files at once gives one update. With "Fragment cache" enabled rendered *.txt files are also kept in the
+fragment cache, so watching the folder again later only renders the files changed in between.
+
+Usage: python watch.py listings -o compiled.pdf --toc-orientation L
+       python watch.py tables -o tables.pdf --type rtf --engine libreoffice --debounce 2
+"""
+import argparse
+import fnmatch
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from cli import guess_filetype, load_settings, parse_setting
+
+
+class Section:
+    """
+    Chapter name and page count of an input file whose pages are in the fragment store
+    """
+
+    def __init__(self, chapter_name, num_pages):
+        self.chapter_name = chapter_name
+        self.num_pages = num_pages
+
+
+class WatchCompiler:
+    """
+    Keeps the pages of the input files of a folder and rebuilds the compiled document when files are changed, added
+    or removed
+    """
+
+    def __init__(self, directory, output, filetype, create_toc=True, toc_orientation="P", engine="word"):
+        from helper_functions import settings
+        from fragment_cache import FragmentCache
+        from main_functions import Converter
+        from pdf_assembly import FragmentStore
+        from workspace import Workspace
+        self.directory = os.path.abspath(directory)
+        self.output = os.path.abspath(output)
+        self.filetype = filetype
+        self.engine = engine
+        self.sections = {}
+        self.converter_pool = None
+        self.fragment_cache = FragmentCache.from_settings(settings)
+        self.store = FragmentStore(deduplicate=settings["Deduplicate resources"])
+        self.workspace = Workspace.from_settings(settings)
+        self.converter = Converter()
+        self.converter.set_create_toc(create_toc)
+        self.converter.set_toc_orientation(toc_orientation)
+
+    def scan(self):
+        """
+        Lists the input files of the folder. Lock files of Word and hidden files are left out
+        :return: Dictionary of path: (modification time, size)
+        """
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(("~$", ".")) or not fnmatch.fnmatch(entry.name.lower(), f"*.{self.filetype}"):
+                    continue
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    #  Removed while scanning
+                    pass
+        return files
+
+    def _render_txt_files(self, files):
+        from fragment_cache import iter_documents
+        sections = [None] * len(files)
+        for index, document in iter_documents(files, self.fragment_cache, self.workspace.path):
+            self.store.add_fragment(files[index], document.fragment)
+            sections[index] = Section(document.chapter_name, document.num_pages)
+        return sections
+
+    def _convert_rtf_files(self, files):
+        from converter_pool import ConverterPool
+        from helper_functions import settings
+        from main_functions import add_converted_files
+        from pdf_cache import PdfCache
+        if self.converter_pool is None:
+            #  Backend instances are started once and kept warm for the whole session
+            self.converter_pool = ConverterPool(self.engine, instances=settings["Converter instances"],
+                                                cache=PdfCache.from_settings(settings))
+        return [Section(chapter_name, num_pages) for chapter_name, num_pages
+                in add_converted_files(self.store, files, self.converter_pool, self.workspace.path)]
+
+    def update(self, changed, removed=()):
+        """
+        Renders or converts the changed files again and rebuilds the compiled document. The document is written
+        next to the output first and then moved over it, so a pdf viewer never sees a half-written file
+        :param changed: Paths of the added or modified files
+        :param removed: Paths of the removed files
+        :return: Number of pages in the document, not counting the table of contents
+        """
+        changed = sorted(changed)
+        if changed:
+            if self.filetype == "txt":
+                sections = self._render_txt_files(changed)
+            else:
+                sections = self._convert_rtf_files(changed)
+        else:
+            sections = []
+        self.sections.update(zip(changed, sections))
+        for file in removed:
+            self.sections.pop(file, None)
+            self.store.remove(file)
+        if not self.sections:
+            return 0
+        #  Same order as the files given to the command line version
+        names = sorted(self.sections)
+        ordered = [self.sections[file] for file in names]
+        glyphs = None
+        if self.filetype == "txt":
+            from fragment_cache import FRAGMENT_GLYPHS
+            glyphs = FRAGMENT_GLYPHS.union(*(x.chapter_name for x in ordered))
+        partial = os.path.join(os.path.dirname(self.output), f".{os.path.basename(self.output)}.part")
+        self.converter.filename = partial
+        try:
+            self.converter.assemble_fragments(self.store, names, [x.chapter_name for x in ordered],
+                                              [x.num_pages for x in ordered], glyphs)
+            os.replace(partial, self.output)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return sum(x.num_pages for x in ordered)
+
+    def watch(self, interval=0.5, debounce=1.0, stop=None, report=None):
+        """
+        Compiles all files and then polls the folder, updating the document after every burst of changes
+        :param interval: Seconds between scans of the folder
+        :param debounce: Seconds the folder has to stay unchanged before the document is updated
+        :param stop: Optional threading.Event that ends watching
+        :param report: Function called with a message after every update. By default the message is printed to stderr
+        :return:
+        """
+        stop = stop or threading.Event()
+        report = report or print_status
+        previous = {}
+        changed = set()
+        removed = set()
+        last_change = time.monotonic() - debounce
+        #  Set when the update failed, cleared by the next change in the folder
+        failed = False
+        while True:
+            current = self.scan()
+            for file, state in current.items():
+                if previous.get(file) != state:
+                    changed.add(file)
+                    removed.discard(file)
+                    last_change = time.monotonic()
+                    failed = False
+            for file in previous.keys() - current.keys():
+                removed.add(file)
+                changed.discard(file)
+                last_change = time.monotonic()
+                failed = False
+            previous = current
+            if (changed or removed) and not failed and time.monotonic() - last_change >= debounce:
+                start = time.perf_counter()
+                try:
+                    num_pages = self.update(changed, removed)
+                except Exception as e:
+                    #  A file may be half-written or invalid. The changes are kept and tried again, together with
+                    #  the new ones, after the next change in the folder
+                    report(f"Update failed: {type(e).__name__}: {e}")
+                    failed = True
+                else:
+                    report(f"Updated {self.output} in {time.perf_counter() - start:.2f} s: {len(changed)} changed, "
+                           f"{len(removed)} removed, {num_pages} pages")
+                    changed = set()
+                    removed = set()
+            if stop.wait(interval):
+                break
+
+    def close(self):
+        """
+        Shuts down the backend instances and removes the workspace
+        :return:
+        """
+        if self.converter_pool is not None:
+            self.converter_pool.close()
+        self.workspace.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def print_status(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Folder of the input files")
+    parser.add_argument("-o", "--output", required=True, help="Path of the compiled pdf file")
+    parser.add_argument("--type", choices=["txt", "rtf"], help="Type of the input files. By default from the file "
+                                                               "extensions")
+    parser.add_argument("--no-toc", action="store_true", help="Do not create the table of contents")
+    parser.add_argument("--toc-orientation", choices=["P", "L"], default="P", help="Orientation of the table of "
+                                                                                   "contents pages")
+    parser.add_argument("--toc-file", help="Table of contents in the \"chapter: page\" format used instead of the "
+                                           "proposed one")
+    parser.add_argument("--engine", default="word", help="Converter of *.rtf files: word or libreoffice")
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between scans of the folder")
+    parser.add_argument("--debounce", type=float, default=1.0, help="Seconds without changes before the document "
+                                                                    "is updated")
+    parser.add_argument("--set", type=parse_setting, action="append", default=[], metavar="KEY=VALUE",
+                        help="Overrides a setting of settings.json, can be repeated")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    directory = os.path.abspath(args.directory)
+    if not os.path.isdir(directory):
+        parser.error(f"{args.directory} is not a folder")
+    filetype = args.type or guess_filetype([x.path for x in os.scandir(directory)
+                                            if x.is_file() and x.name.lower().endswith((".txt", ".rtf"))])
+    if filetype is None:
+        parser.error("Could not tell the type of the input files, use --type")
+    output = os.path.abspath(args.output)
+    toc_file = os.path.abspath(args.toc_file) if args.toc_file else None
+
+    try:
+        parameters = load_settings(args.set)
+    except KeyError as e:
+        parser.error(e.args[0])
+    if toc_file:
+        parameters["TOC file"] = toc_file
+
+    from converter_pool import normalize_engine
+    try:
+        engine = normalize_engine(args.engine)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Watching {directory}, press Ctrl+C to stop", file=sys.stderr)
+    with WatchCompiler(directory, output, filetype, not args.no_toc, args.toc_orientation, engine) as compiler:
+        try:
+            compiler.watch(args.interval, args.debounce)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Scratch directories of compilations. Every compilation writes its temporary files, for example the pdf files converted
+from *.rtf files and the rendered parts of the *.txt files, to a directory of its own so compilations running at the
+same time never use the same file names. The directories are created on a memory-backed tmpfs when one is available
+and has enough free space, so the temporary files are never written to disk.
+"""
+import os
+import shutil
+import tempfile
+
+# Memory-backed folders tried when no scratch directory is set
+TMPFS_DIRECTORIES = ("/dev/shm",)
+# tmpfs is often small, it is used only when at least this much space is free
+TMPFS_MIN_FREE = 1024 * 1024 * 1024
+
+
+def scratch_root(directory=""):
+    """
+    Returns the folder where the workspaces are created
+    :param directory: Folder set in the settings. Empty to use tmpfs when available and the system temp folder otherwise
+    :return: Path of the folder or None for the system temp folder
+    """
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        return directory
+    for candidate in TMPFS_DIRECTORIES:
+        try:
+            if os.access(candidate, os.W_OK | os.X_OK) and shutil.disk_usage(candidate).free >= TMPFS_MIN_FREE:
+                return candidate
+        except OSError:
+            pass
+    return None
+
+
+class Workspace:
+    """
+    Scratch directory of one compilation. Removed with everything in it by cleanup() or when used as a context manager
+    """
+
+    def __init__(self, root=None, prefix="job_"):
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+
+    @classmethod
+    def from_settings(cls, parameters):
+        """
+        Creates the workspace in the scratch directory of the program settings
+        :param parameters: Settings dictionary
+        :return: Workspace
+        """
+        return cls(scratch_root(parameters["Scratch directory"]))
+
+    def file(self, name):
+        """
+        Returns path of a file in the workspace
+        """
+        return os.path.join(self.path, name)
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()